@@ -0,0 +1,180 @@
+"""
+准入控制模块
+每个并发池限制同时处理的请求数，超出时排队；排队超过时间预算或队列已满的请求直接返回 503（带 Retry-After），
+避免上游变慢时请求无限堆积，拖垮只读本地数据的路由
+"""
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.routing import Match
+
+
+class Overloaded(Exception):
+    """并发池已满，请求被拒绝"""
+
+    def __init__(self, gate: str, retry_after: int):
+        super().__init__(f"{gate} 繁忙")
+        self.gate = gate
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """并发池：最多 limit 个请求同时处理，最多 max_queue 个请求排队，每个请求最多排队 queue_timeout 秒
+
+    limit 为 0 时不限制；空出的名额按排队顺序直接交给下一个请求
+    """
+
+    def __init__(self, name: str, limit: int, queue_timeout: float, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: deque = deque()
+        # 统计：放行数、拒绝数（其中排队超时的数量）、累计和最长排队时间（秒）
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.queue_time = 0.0
+        self.queue_time_max = 0.0
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    def _reject(self):
+        self.shed += 1
+        raise Overloaded(self.name, self.retry_after)
+
+    async def acquire(self):
+        """获取名额，排队超时或队列已满时抛出 Overloaded"""
+        if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue or self.queue_timeout <= 0:
+            self._reject()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # 超时与交出名额发生在同一轮事件循环时（Python 3.12+ 的 wait_for 仍抛出超时），名额已经给了本请求，归还
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            self.timed_out += 1
+            self._reject()
+        except asyncio.CancelledError:
+            # 客户端断开：名额已经交给本请求时归还
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        waited = time.perf_counter() - started
+        self.admitted += 1
+        self.queue_time += waited
+        self.queue_time_max = max(self.queue_time_max, waited)
+
+    def release(self):
+        """归还名额：有排队的请求时直接交给最早的一个"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "queue_time_avg_ms": round(self.queue_time / self.admitted * 1000, 3) if self.admitted else 0.0,
+            "queue_time_max_ms": round(self.queue_time_max * 1000, 3),
+        }
+
+
+def parse_route_limits(value: str) -> Dict[str, Tuple[int, Optional[float]]]:
+    """解析单独限制的路由：逗号分隔的 路由名=并发数[:排队秒数]，如 search_movies=16:1,add_favorite=8"""
+    limits = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, spec = item.partition("=")
+        limit, _, timeout = spec.partition(":")
+        limits[name.strip()] = (int(limit), float(timeout) if timeout.strip() else None)
+    return limits
+
+
+def route_name(routes: List, scope) -> Optional[str]:
+    """返回与请求完全匹配的路由的处理函数名，没有匹配的路由时返回 None"""
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "name", "")
+    return None
+
+
+class AdmissionMiddleware:
+    """按路由选择并发池（ASGI 中间件，名额一直保持到响应发送完毕，包括流式响应）
+
+    resolve 根据路由的处理函数名返回并发池，返回 None 的路由（页面、静态文件、监控接口）不受限制
+    """
+
+    def __init__(self, app, routes: Callable[[], List], resolve: Callable[[str], Optional[AdmissionGate]]):
+        self.app = app
+        self.routes = routes
+        self.resolve = resolve
+
+    def gate_for(self, scope) -> Optional[AdmissionGate]:
+        name = route_name(self.routes(), scope)
+        return None if name is None else self.resolve(name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        gate = self.gate_for(scope)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await gate.acquire()
+        except Overloaded as e:
+            body = json.dumps(
+                {"detail": {"error": "服务繁忙", "message": f"{e.gate} 请求过多，请稍后重试"}},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(e.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+
+__all__ = ['AdmissionGate', 'AdmissionMiddleware', 'Overloaded', 'parse_route_limits', 'route_name']
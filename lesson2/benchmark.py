@@ -0,0 +1,713 @@
+"""
+性能基准测试
+用法：
+    python benchmark.py favorites --count 100000
+    python benchmark.py history --count 100000
+    python benchmark.py index --count 1000000
+    python benchmark.py snapshot --count 200000
+    python benchmark.py catalog --count 1000000
+    python benchmark.py discover --count 1000000
+    python benchmark.py recommend --count 500000
+    python benchmark.py ratelimit --count 1000000 --clients 100000
+    python benchmark.py peers --instances 3 --movies 200
+    python benchmark.py load --duration 10 --connections 64
+    python benchmark.py workers --max-workers 8 --backend sqlite
+    python benchmark.py disconnect --requests 300 --latency 1
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+
+from catalog import MovieCatalog
+from discover import discover
+from rate_limit import SharedSlidingWindowLimiter, SlidingWindowLimiter, client_key, parse_tokens
+from recommend import Recommender
+from favorites_store import FavoritesStore, SORT_ORDERS
+from search_history import SearchHistory
+from shared_state import MiniRedisServer, RedisBackend, SQLiteBackend
+from snapshot import open_snapshot, write_snapshot
+from suggest import SuggestTrie
+from title_index import LIST_FIELDS, TitleIndex
+
+
+def fake_movie(i: int) -> dict:
+    """生成一条测试用的电影数据（与 convert_tmdb_to_douban_format 的输出格式一致）"""
+    return {
+        "id": str(i),
+        "title": f"测试电影 {i}",
+        "original_title": f"Test Movie {i}",
+        "year": str(1950 + i % 75),
+        "rating": round(random.uniform(1, 10), 1),
+        "rating_count": random.randint(0, 50000),
+        "cover": "/static/default-movie.jpg",
+        "summary": "这是一段测试用的剧情简介。" * 5,
+        "genres": random.sample(["剧情", "动作", "喜剧", "科幻", "爱情", "动画"], 2),
+        "directors": ["导演甲"],
+        "actors": ["演员甲", "演员乙", "演员丙"],
+    }
+
+
+def timed(label: str, func, *args):
+    """执行函数并打印耗时"""
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"  {label:<28} {elapsed:10.2f} ms")
+    return result
+
+
+def bench_favorites(count: int):
+    """收藏存储：批量写入、排序读取、单条增删"""
+    print(f"📊 收藏存储基准测试（{count} 条收藏）")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = FavoritesStore(str(Path(tmp) / "favorites.db"))
+
+        def insert_all():
+            with store._transaction():
+                for i in range(count):
+                    store._add(str(i), fake_movie(i), added_at=f"2024-01-01T00:00:{i:08d}")
+
+        timed("批量写入", insert_all)
+        for sort_by in SORT_ORDERS:
+            timed(f"全量读取 sort_by={sort_by}", store._list, sort_by)
+        for sort_by in SORT_ORDERS:
+            _, cursor = store._page(sort_by, 20)
+            timed(f"游标翻页 sort_by={sort_by}", store._page, sort_by, 20, cursor)
+        timed("统计汇总", store._stats)
+        timed("单条添加", store._add, "new", fake_movie(count))
+        timed("单条查询", store._contains, "new")
+        timed("单条删除", store._remove, "new")
+        timed("异步查询（含线程切换）", asyncio.run, store.contains("1"))
+
+
+def bench_history(count: int):
+    """搜索历史：记录搜索（含写日志和热门统计）、读取最近记录和热门关键词"""
+    print(f"📊 搜索历史基准测试（{count} 次搜索）")
+    keywords = [f"关键词{int(random.paretovariate(1.2))}" for _ in range(count)]
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = str(Path(tmp) / "search_history.log")
+        history = SearchHistory(log_path)
+
+        async def record_all():
+            for keyword in keywords:
+                await history.record(keyword, 20)
+            await history.flush()
+
+        start = time.perf_counter()
+        asyncio.run(record_all())
+        per_call = (time.perf_counter() - start) / count * 1e6
+        print(f"  {'单次记录（平均）':<28} {per_call:10.2f} µs")
+        timed("最近 20 条", asyncio.run, history.latest(20))
+        timed("热门 10 个", asyncio.run, history.trending_searches(10))
+        timed("启动时回放日志", SearchHistory, log_path)
+
+
+# 生成测试标题用的字和词：常用汉字范围内的 3000 个字、2000 个英文词
+TITLE_CHARS = [chr(0x4E00 + i) for i in range(3000)]
+TITLE_WORDS = [f"word{i}" for i in range(2000)]
+
+
+def fake_title(i: int) -> tuple:
+    """生成测试用的 (中文标题, 英文原名)"""
+    title = "".join(random.choices(TITLE_CHARS, k=random.randint(2, 8)))
+    original = " ".join(random.choices(TITLE_WORDS, k=random.randint(1, 4)))
+    return title, original
+
+
+def bench_index(count: int):
+    """标题倒排索引：构建耗时、内存占用、查询延迟"""
+    print(f"📊 标题索引基准测试（{count} 部电影）")
+    titles = [fake_title(i) for i in range(count)]
+    index = TitleIndex()
+
+    def build():
+        for i, (title, original) in enumerate(titles):
+            index.add({"id": str(i), "title": title, "original_title": original, "rating_count": i % 5000})
+
+    tracemalloc.start()
+    timed("构建索引", build)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {'索引内存':<28} {size / 1024 / 1024:10.1f} MB")
+
+    queries = [titles[random.randrange(count)][0][:random.randint(2, 4)] for _ in range(500)]
+    queries += [" ".join(titles[random.randrange(count)][1].split()[:2]) for _ in range(500)]
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query)
+    per_query = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"  {'单次查询（平均）':<28} {per_query:10.2f} ms")
+
+
+GENRE_NAMES = ["动作", "冒险", "动画", "喜剧", "犯罪", "纪录", "剧情", "家庭", "奇幻", "历史",
+               "恐怖", "音乐", "悬疑", "爱情", "科幻", "电视电影", "惊悚", "战争", "西部"]
+
+
+def fake_list_movie(i: int) -> dict:
+    """生成一条列表格式的测试电影（每条的文本都不同，避免字符串被共用而低估内存）"""
+    title, original = fake_title(i)
+    return {
+        "id": str(100000 + i),
+        "title": title,
+        "original_title": original,
+        "year": str(1950 + i % 75),
+        "rating": round(random.uniform(1, 10), 1),
+        "rating_count": random.randint(0, 50000),
+        "cover": f"https://image.tmdb.org/t/p/w500/{random.getrandbits(100):x}.jpg",
+        "summary": "".join(random.choices(TITLE_CHARS, k=random.randint(40, 160))),
+        "genres": [GENRE_NAMES[g] for g in sorted(random.sample(range(len(GENRE_NAMES)), 2))],
+    }
+
+
+def bench_catalog(count: int):
+    """电影目录：字典列表与列式目录的内存占用和读取耗时"""
+    print(f"📊 电影目录基准测试（{count} 部电影）")
+
+    def measure(label: str, build):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = build()
+        elapsed = (time.perf_counter() - start) * 1000
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {label:<28} {size / 1024 / 1024:10.1f} MB  构建 {elapsed:8.0f} ms")
+        return result
+
+    random.seed(0)
+    records = measure("字典列表", lambda: [
+        {field: movie[field] for field in LIST_FIELDS} for movie in map(fake_list_movie, range(count))
+    ])
+
+    def build_catalog():
+        catalog = MovieCatalog()
+        random.seed(0)
+        for i in range(count):
+            catalog.append(fake_list_movie(i))
+        return catalog
+
+    catalog = measure("列式目录", build_catalog)
+    assert catalog.matches(count // 2, records[count // 2])
+
+    docs = random.sample(range(count), 10000)
+    start = time.perf_counter()
+    for doc in docs:
+        catalog[doc]
+    per_read = (time.perf_counter() - start) / len(docs) * 1e6
+    print(f"  {'读取一条（组装为字典）':<28} {per_read:10.2f} µs")
+
+
+def bench_discover(count: int):
+    """本地筛选：向量化筛选加部分排序，与逐条筛选加完整排序对比"""
+    print(f"📊 本地筛选基准测试（{count} 部电影）")
+    catalog = MovieCatalog()
+    random.seed(0)
+    for i in range(count):
+        catalog.append(fake_list_movie(i))
+
+    queries = {
+        "无条件，按评价人数": {},
+        "2000-2010 年，评分 ≥ 7": {"year_from": 2000, "year_to": 2010, "min_rating": 7},
+        "剧情+爱情（全部），按评分": {"genres": ("剧情", "爱情"), "match_all_genres": True, "sort_by": "rating"},
+        "科幻或动画，按年份升序": {"genres": ("科幻", "动画"), "sort_by": "year", "descending": False},
+    }
+    for label, query in queries.items():
+        discover(catalog, **query)
+        start = time.perf_counter()
+        for _ in range(10):
+            total, docs = discover(catalog, **query)
+        elapsed = (time.perf_counter() - start) / 10 * 1000
+        print(f"  {label:<28} {elapsed:10.2f} ms  （{total} 部）")
+
+    def scan():
+        rows = [catalog[doc] for doc in range(len(catalog))]
+        rows = [row for row in rows if "2000" <= row["year"] <= "2010" and row["rating"] >= 7]
+        return sorted(rows, key=lambda row: -row["rating_count"])[:20]
+
+    timed("对比：逐条筛选 + 完整排序", scan)
+
+
+def fake_credits(i: int) -> dict:
+    """测试用的演职员（从固定的人名池中选取，使不同电影之间有重叠）"""
+    return {
+        "directors": [f"导演{random.randrange(2000)}"],
+        "actors": [f"演员{random.randrange(20000)}" for _ in range(5)],
+    }
+
+
+def bench_recommend(count: int):
+    """推荐：批量和增量建立向量、精确计算与聚类近似计算的耗时和召回率"""
+    print(f"📊 推荐基准测试（{count} 部电影，10% 带演职员）")
+    catalog = MovieCatalog()
+    credits = {}
+    random.seed(0)
+    for i in range(count):
+        catalog.append(fake_list_movie(i))
+        if i % 10 == 0:
+            credits[i] = fake_credits(i)
+
+    def add_credits(recommender: Recommender):
+        for doc, record in credits.items():
+            recommender.add(doc, {**catalog[doc], **record})
+
+    exact = Recommender(ann_min_size=0)
+    timed("批量建立向量（快照恢复）", exact.rebuild, catalog)
+    start = time.perf_counter()
+    add_credits(exact)
+    per_add = (time.perf_counter() - start) / len(credits) * 1e6
+    print(f"  {'增量加入一部电影':<28} {per_add:10.2f} µs")
+
+    approximate = Recommender(ann_min_size=1)
+    approximate.rebuild(catalog)
+    add_credits(approximate)
+    timed("聚类（后台线程）", approximate.train_now)
+    print(f"  {'簇数量':<28} {len(approximate.lists):10d}")
+
+    # 收藏：随机选 20 部带演职员的电影
+    favorites = [{**catalog[doc], **credits[doc]} for doc in random.sample(sorted(credits), 20)]
+    for label, recommender in (("精确计算", exact), ("聚类近似计算", approximate)):
+        recommender.recommend(favorites, 20)
+        start = time.perf_counter()
+        for _ in range(20):
+            recommender.recommend(favorites, 20)
+        elapsed = (time.perf_counter() - start) / 20 * 1000
+        print(f"  {label:<28} {elapsed:10.2f} ms")
+
+    expected = {doc for doc, _ in exact.recommend(favorites, 20)}
+    found = {doc for doc, _ in approximate.recommend(favorites, 20)}
+    print(f"  {'近似计算召回率（前 20）':<28} {len(expected & found) / len(expected):10.0%}")
+
+
+def bench_ratelimit(count: int, clients: int, shared_count: int):
+    """客户端限流：每个请求的额外耗时（进程内 / 共享状态后端）和进程内的内存占用"""
+    print(f"📊 客户端限流基准测试（{count} 次请求，{clients} 个客户端）")
+    random.seed(0)
+    keys = [f"ip:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+    sequence = [keys[random.randrange(clients)] for _ in range(count)]
+
+    headers = {"x-api-key": "0123456789abcdef"}
+    tokens = parse_tokens("0123456789abcdef")
+    start = time.perf_counter()
+    for _ in range(count):
+        client_key(headers, "127.0.0.1", tokens=tokens)
+    print(f"  {'识别客户端（Token 摘要）':<28} {(time.perf_counter() - start) / count * 1e6:10.2f} µs/次")
+
+    tracemalloc.start()
+    limiter = SlidingWindowLimiter(limit=60, window=60, max_clients=clients)
+    start = time.perf_counter()
+    rejected = sum(limiter.hit(key) > 0 for key in sequence)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"  {'进程内滑动窗口':<28} {elapsed / count * 1e6:10.2f} µs/次  （拒绝 {rejected} 次）")
+    print(f"  {'进程内内存':<28} {memory / 1024 / 1024:10.2f} MB  （{len(limiter)} 个客户端，{memory / len(limiter):.0f} 字节/个）")
+
+    small = SlidingWindowLimiter(limit=60, window=60, max_clients=clients // 10)
+    start = time.perf_counter()
+    for key in sequence:
+        small.hit(key)
+    elapsed = time.perf_counter() - start
+    print(f"  {'进程内（客户端上限 1/10）':<28} {elapsed / count * 1e6:10.2f} µs/次  （{len(small)} 个客户端）")
+
+    async def run_shared(label: str, backend):
+        shared = SharedSlidingWindowLimiter(backend, "bench", limit=60, window=60)
+        await shared.hit(sequence[0])
+        start = time.perf_counter()
+        for key in sequence[:shared_count]:
+            await shared.hit(key)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<28} {elapsed / shared_count * 1e6:10.2f} µs/次")
+
+    async def shared_benchmarks():
+        with tempfile.TemporaryDirectory() as tmp:
+            await run_shared("共享：sqlite", SQLiteBackend(os.path.join(tmp, "state.db")))
+        server = await asyncio.start_server(MiniRedisServer().handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            backend = RedisBackend(f"redis://127.0.0.1:{port}/0")
+            await run_shared("共享：redis（本地替身服务）", backend)
+            await backend.close()
+
+    asyncio.run(shared_benchmarks())
+
+
+def bench_snapshot(count: int):
+    """快照：写入耗时、文件大小，以及加载快照与重新构建索引的耗时对比"""
+    print(f"📊 快照基准测试（{count} 部电影）")
+    titles = [fake_title(i) for i in range(count)]
+    index = TitleIndex()
+    trie = SuggestTrie()
+
+    def build():
+        for i, (title, original) in enumerate(titles):
+            index.add({"id": str(i), "title": title, "original_title": original, "rating_count": i % 5000})
+            trie.add(title, i % 5000)
+
+    timed("重新构建索引和建议", build)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "cache.snapshot")
+        frozen = timed("复制索引（事件循环中）", index.copy)
+        sections = timed("编码快照（线程中）", lambda: {**frozen.dump_snapshot(), **trie.dump_snapshot()})
+        timed("写入快照", write_snapshot, path, sections)
+        print(f"  {'快照大小':<28} {Path(path).stat().st_size / 1024 / 1024:10.1f} MB")
+
+        restored = TitleIndex()
+        snapshot = timed("加载快照（映射文件）", open_snapshot, path)
+        timed("恢复标题索引", restored.load_snapshot, snapshot)
+        query = titles[0][0][:2]
+        timed("加载后第一次搜索", restored.search, query)
+        timed("加载后第二次搜索", restored.search, query)
+        timed("加载后加入一部电影", restored.add, {"id": "new", "title": "新电影", "original_title": "New"})
+        timed("恢复搜索建议（后台分批）", lambda: sum(1 for _ in SuggestTrie().restore(snapshot)))
+        timed("再次编码快照", restored.dump_snapshot)
+
+
+def isolated_env(data_dir: str) -> dict:
+    """测试实例的数据文件放在临时目录中，不使用快照：不覆盖真实的快照、收藏和搜索历史，各轮测试之间也互不影响"""
+    return {
+        "SNAPSHOT_PATH": "",
+        "FAVORITES_DB": os.path.join(data_dir, "favorites.db"),
+        "SEARCH_HISTORY_LOG": os.path.join(data_dir, "search_history.log"),
+        "STATE_DB": os.path.join(data_dir, "shared_state.db"),
+    }
+
+
+def start_instances(count: int, base_port: int, peers: bool, data_dir: str) -> list:
+    """启动多个使用模拟数据的应用实例，peers 为 True 时组成分片集群；数据文件放在 data_dir 中"""
+    urls = [f"http://127.0.0.1:{base_port + i}" for i in range(count)]
+    processes = []
+    for i, url in enumerate(urls):
+        env = {
+            **os.environ,
+            **isolated_env(os.path.join(data_dir, str(i))),
+            "USE_MOCK_DATA": "true",
+            "PEERS": ",".join(urls) if peers else "",
+            "SELF_URL": url,
+        }
+        port = url.rsplit(":", 1)[1]
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", port, "--log-level", "warning"],
+            cwd=Path(__file__).parent, env=env, stdout=subprocess.DEVNULL
+        ))
+
+    # 等待所有实例可以访问
+    deadline = time.time() + 30
+    for url in urls:
+        while True:
+            try:
+                httpx.get(f"{url}/api/metrics", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline:
+                    raise RuntimeError(f"实例启动超时: {url}")
+                time.sleep(0.2)
+    return urls, processes
+
+
+async def request_details(urls: list, movies: int):
+    """每个实例都请求同一批电影详情"""
+    async with httpx.AsyncClient(timeout=30) as client:
+        for movie_id in range(1, movies + 1):
+            await asyncio.gather(*(client.get(f"{url}/api/movie/{movie_id}") for url in urls))
+
+
+def bench_peers(instances: int, movies: int, base_port: int):
+    """多实例分片：对比各实例独立缓存和一致性哈希分片时向 TMDB 请求详情的次数"""
+    print(f"📊 多实例分片基准测试（{instances} 个实例，每个实例请求 {movies} 部电影详情）")
+    for peers in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            urls, processes = start_instances(instances, base_port, peers, tmp)
+            try:
+                start = time.perf_counter()
+                asyncio.run(request_details(urls, movies))
+                elapsed = time.perf_counter() - start
+                counters = [httpx.get(f"{url}/api/metrics").json()["counters"] for url in urls]
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.wait()
+
+        upstream = sum(c.get("detail_upstream_fetches", 0) for c in counters)
+        remote = sum(c.get("peer_fetches", 0) for c in counters)
+        label = "一致性哈希分片" if peers else "各实例独立缓存"
+        print(f"  {label:<20} 上游请求 {upstream:6d}  实例间请求 {remote:6d}  总耗时 {elapsed:6.2f} s")
+
+
+# 负载测试对比的启动方式：(说明, python 命令行参数)，端口通过环境变量 PORT 和 {port} 传入
+LOAD_TARGETS = [
+    ("uvicorn 单进程 asyncio+h11",
+     ["-m", "uvicorn", "main:app", "--loop", "asyncio", "--http", "h11", "--log-level", "warning", "--port", "{port}"]),
+    ("server.py uvloop+httptools", ["server.py"]),
+]
+
+
+async def keep_alive_client(host: str, port: int, path: str, deadline: float, latencies: list):
+    """最简单的 HTTP/1.1 keep-alive 客户端，避免压测客户端本身成为瓶颈"""
+    reader, writer = await asyncio.open_connection(host, port)
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode()
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in headers.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+def measure_throughput(label: str, command: list, env: dict, port: int, path: str, duration: float, connections: int):
+    """启动服务，等待可以访问后用 keep-alive 连接压测 duration 秒，打印吞吐量和延迟"""
+    process = subprocess.Popen(
+        [sys.executable, *(arg.format(port=port) for arg in command)],
+        cwd=Path(__file__).parent, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 30
+        while True:
+            try:
+                httpx.get(f"{url}{path}", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline:
+                    raise RuntimeError(f"服务启动超时: {label}")
+                time.sleep(0.2)
+
+        latencies = []
+
+        async def run():
+            end = time.perf_counter() + duration
+            await asyncio.gather(*(
+                keep_alive_client("127.0.0.1", port, path, end, latencies) for _ in range(connections)
+            ))
+
+        asyncio.run(run())
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"  {label:<30} {len(latencies) / duration:8.0f} req/s  p50 {p50:6.1f} ms  p99 {p99:6.1f} ms")
+
+
+def bench_load(duration: float, connections: int, workers: int, port: int, path: str):
+    """负载测试：对比 uvicorn 默认配置和 server.py 的吞吐量（使用模拟数据）"""
+    print(f"📊 负载测试（{path}，{connections} 个连接，每项 {duration:.0f} 秒，CPU 核数 {os.cpu_count()}）")
+    for label, command in LOAD_TARGETS:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                **os.environ,
+                **isolated_env(tmp),
+                "USE_MOCK_DATA": "true",
+                "HOST": "127.0.0.1",
+                "PORT": str(port),
+                "WORKERS": str(workers),
+            }
+            measure_throughput(label, command, env, port, path, duration, connections)
+
+
+def disconnect_paths(requests: int) -> list:
+    """各不相同的详情和搜索请求（不命中缓存，也不合并上游请求）"""
+    return [f"/api/movie/{i + 1}" if i % 2 else f"/api/search?q=disconnect{i}" for i in range(requests)]
+
+
+async def abandon_requests(url: str, paths: list, timeout: float):
+    """同时发出所有请求，timeout 秒后客户端断开（不等待响应）"""
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        results = await asyncio.gather(*(client.get(f"{url}{path}") for path in paths), return_exceptions=True)
+    return sum(isinstance(result, httpx.TimeoutException) for result in results)
+
+
+def bench_disconnect(requests: int, latency: float, port: int):
+    """客户端断开：替身服务延迟 latency 秒，客户端在延迟一半时断开，对比是否取消上游请求（白做的上游请求数）"""
+    print(f"📊 客户端断开测试（{requests} 个请求，上游延迟 {latency:.1f} s，客户端 {latency / 2:.1f} s 后断开）")
+    stub = subprocess.Popen(
+        [sys.executable, "tmdb_stub.py", "serve", "--port", str(port + 1), "--latency", str(latency)],
+        cwd=Path(__file__).parent, stdout=subprocess.DEVNULL
+    )
+    try:
+        for cancel in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {
+                    **os.environ,
+                    **isolated_env(tmp),
+                    "USE_MOCK_DATA": "false",
+                    "TMDB_API_BASE": f"http://127.0.0.1:{port + 1}/3",
+                    "TMDB_API_KEY": "stub",
+                    "TMDB_RATE_LIMIT": "0",
+                    "TMDB_MAX_CONNECTIONS": str(requests),
+                    "ADMISSION_UPSTREAM_LIMIT": "0",
+                    "RATE_LIMIT_SEARCH": "0",
+                    "RATE_LIMIT_DETAIL": "0",
+                    "CHANGES_POLL_INTERVAL": "0",
+                    "CANCEL_ON_DISCONNECT": str(cancel),
+                }
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                    cwd=Path(__file__).parent, env=env, stdout=subprocess.DEVNULL
+                )
+                try:
+                    url = f"http://127.0.0.1:{port}"
+                    deadline = time.time() + 30
+                    while True:
+                        try:
+                            httpx.get(f"{url}/api/metrics", timeout=1)
+                            break
+                        except httpx.HTTPError:
+                            if time.time() > deadline:
+                                raise RuntimeError("服务启动超时")
+                            time.sleep(0.2)
+
+                    abandoned = asyncio.run(abandon_requests(url, disconnect_paths(requests), latency / 2))
+                    # 等待没有取消的上游请求全部完成
+                    time.sleep(latency * 2)
+                    counters = httpx.get(f"{url}/api/metrics").json()["counters"]
+                finally:
+                    process.terminate()
+                    process.wait()
+
+            upstream = counters.get("upstream_requests", 0)
+            cancelled = counters.get("upstream_cancelled", 0)
+            label = "断开时取消" if cancel else "不取消"
+            print(
+                f"  {label:<12} 客户端断开 {abandoned:5d}  上游请求 {upstream:5d}  已取消 {cancelled:5d}  "
+                f"白做 {upstream - cancelled:5d}"
+            )
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+def bench_workers(duration: float, connections: int, max_workers: int, backend: str, port: int, path: str):
+    """worker 扩展：server.py 使用共享状态后端（sqlite 或本地 Redis 替身服务）时，吞吐量随 worker 数量的变化"""
+    print(f"📊 worker 扩展测试（{path}，共享状态 {backend}，{connections} 个连接，每项 {duration:.0f} 秒，CPU 核数 {os.cpu_count()}）")
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        redis = None
+        if backend == "redis":
+            redis = subprocess.Popen(
+                [sys.executable, "shared_state.py", "--port", str(port + 1)],
+                cwd=Path(__file__).parent, stdout=subprocess.DEVNULL
+            )
+            time.sleep(1)
+        try:
+            for workers in counts:
+                env = {
+                    **os.environ,
+                    **isolated_env(tmp),
+                    "USE_MOCK_DATA": "true",
+                    "HOST": "127.0.0.1",
+                    "PORT": str(port),
+                    "WORKERS": str(workers),
+                    "STATE_BACKEND": backend,
+                    "STATE_URL": f"redis://127.0.0.1:{port + 1}/0",
+                }
+                measure_throughput(f"{workers} 个 worker", ["server.py"], env, port, path, duration, connections)
+        finally:
+            if redis is not None:
+                redis.terminate()
+                redis.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TMDB 电影应用性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    favorites_parser = subparsers.add_parser("favorites", help="收藏存储")
+    favorites_parser.add_argument("--count", type=int, default=100_000)
+
+    history_parser = subparsers.add_parser("history", help="搜索历史")
+    history_parser.add_argument("--count", type=int, default=100_000)
+
+    index_parser = subparsers.add_parser("index", help="标题倒排索引")
+    index_parser.add_argument("--count", type=int, default=1_000_000)
+
+    peers_parser = subparsers.add_parser("peers", help="多实例分片（启动多个本地进程）")
+    peers_parser.add_argument("--instances", type=int, default=3)
+    peers_parser.add_argument("--movies", type=int, default=200)
+    peers_parser.add_argument("--base-port", type=int, default=8100)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="快照写入和加载")
+    snapshot_parser.add_argument("--count", type=int, default=200_000)
+
+    catalog_parser = subparsers.add_parser("catalog", help="电影目录内存占用")
+    catalog_parser.add_argument("--count", type=int, default=1_000_000)
+
+    discover_parser = subparsers.add_parser("discover", help="本地筛选（向量化）")
+    discover_parser.add_argument("--count", type=int, default=1_000_000)
+
+    recommend_parser = subparsers.add_parser("recommend", help="收藏推荐（向量相似度）")
+    recommend_parser.add_argument("--count", type=int, default=500_000)
+
+    ratelimit_parser = subparsers.add_parser("ratelimit", help="客户端限流")
+    ratelimit_parser.add_argument("--count", type=int, default=1_000_000)
+    ratelimit_parser.add_argument("--clients", type=int, default=100_000)
+    ratelimit_parser.add_argument("--shared-count", type=int, default=5000, help="共享状态后端测试的请求数")
+
+    load_parser = subparsers.add_parser("load", help="HTTP 负载测试（对比启动方式）")
+    load_parser.add_argument("--duration", type=float, default=10)
+    load_parser.add_argument("--connections", type=int, default=64)
+    load_parser.add_argument("--workers", type=int, default=0, help="server.py 的 worker 数量，0 表示自动（local 后端时为 1）")
+    load_parser.add_argument("--port", type=int, default=8300)
+    load_parser.add_argument("--path", default="/api/top250?count=20")
+
+    workers_parser = subparsers.add_parser("workers", help="吞吐量随 worker 数量的变化（共享状态后端）")
+    workers_parser.add_argument("--duration", type=float, default=10)
+    workers_parser.add_argument("--connections", type=int, default=64)
+    workers_parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    workers_parser.add_argument("--backend", choices=("sqlite", "redis"), default="sqlite")
+    workers_parser.add_argument("--port", type=int, default=8400)
+    workers_parser.add_argument("--path", default="/api/search?q=%E7%94%B5%E5%BD%B1", help="默认搜索“电影”（经过共享搜索缓存）")
+
+    disconnect_parser = subparsers.add_parser("disconnect", help="客户端断开时取消上游请求（启动替身服务）")
+    disconnect_parser.add_argument("--requests", type=int, default=300)
+    disconnect_parser.add_argument("--latency", type=float, default=1.0, help="替身服务每个请求的延迟（秒）")
+    disconnect_parser.add_argument("--port", type=int, default=8500)
+
+    args = parser.parse_args()
+    if args.command == "favorites":
+        bench_favorites(args.count)
+    elif args.command == "history":
+        bench_history(args.count)
+    elif args.command == "index":
+        bench_index(args.count)
+    elif args.command == "catalog":
+        bench_catalog(args.count)
+    elif args.command == "discover":
+        bench_discover(args.count)
+    elif args.command == "recommend":
+        bench_recommend(args.count)
+    elif args.command == "ratelimit":
+        bench_ratelimit(args.count, args.clients, args.shared_count)
+    elif args.command == "snapshot":
+        bench_snapshot(args.count)
+    elif args.command == "peers":
+        bench_peers(args.instances, args.movies, args.base_port)
+    elif args.command == "load":
+        bench_load(args.duration, args.connections, args.workers, args.port, args.path)
+    elif args.command == "workers":
+        bench_workers(args.duration, args.connections, args.max_workers, args.backend, args.port, args.path)
+    elif args.command == "disconnect":
+        bench_disconnect(args.requests, args.latency, args.port)
+
+
+if __name__ == "__main__":
+    main()
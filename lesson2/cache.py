@@ -0,0 +1,112 @@
+"""
+缓存模块
+带过期时间和容量上限的内存缓存
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, List, Optional
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存
+
+    每个条目单独设置过期时间，超过容量时淘汰最久未使用的条目；
+    设置了 sizeof 时记录每个条目的大致字节数，加入内存预算后写入时由预算统一淘汰（见 memory.py）
+    """
+
+    def __init__(self, maxsize: int = 1000, sizeof: Optional[Callable[[Any], int]] = None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        # 条目总字节数（未设置 sizeof 时为 0）
+        self.bytes = 0
+        self.budget = None
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存，不存在或已过期时返回 default"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value, size = item
+        if expires_at < time.time():
+            del self._data[key]
+            self.bytes -= size
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def _put(self, key: Hashable, expires_at: float, value: Any):
+        old = self._data.get(key)
+        if old is not None:
+            self.bytes -= old[2]
+        size = self.sizeof(value) if self.sizeof else 0
+        self._data[key] = (expires_at, value, size)
+        self._data.move_to_end(key)
+        self.bytes += size
+
+    def _trim(self):
+        while len(self._data) > self.maxsize:
+            self.evict_oldest()
+        if self.budget is not None:
+            self.budget.enforce()
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """写入缓存，ttl 为有效秒数"""
+        self._put(key, time.time() + ttl, value)
+        self._trim()
+
+    def expires_at(self, key: Hashable) -> Optional[float]:
+        """条目的过期时间，不存在或已过期时返回 None（不影响淘汰顺序）"""
+        item = self._data.get(key)
+        if item is None or item[0] < time.time():
+            return None
+        return item[0]
+
+    def delete(self, key: Hashable):
+        """删除缓存条目"""
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[2]
+
+    def evict_oldest(self) -> int:
+        """淘汰最久未使用的条目，返回释放的字节数"""
+        if not self._data:
+            return 0
+        _, (_, _, size) = self._data.popitem(last=False)
+        self.bytes -= size
+        return size
+
+    def track_size(self, sizeof: Callable[[Any], int]):
+        """开始记录条目大小（重新计算已有的条目）"""
+        self.sizeof = sizeof
+        self.bytes = 0
+        for key, (expires_at, value, _) in list(self._data.items()):
+            size = sizeof(value)
+            self._data[key] = (expires_at, value, size)
+            self.bytes += size
+
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def dump(self) -> List[tuple]:
+        """未过期的条目 [(键, 过期时间, 值)]，从最久未使用到最近使用"""
+        now = time.time()
+        return [(key, expires_at, value) for key, (expires_at, value, _) in self._data.items() if expires_at >= now]
+
+    def load(self, entries: Iterable[tuple]):
+        """恢复 dump 导出的条目（过期时间为绝对时间，跨进程仍然有效），跳过已过期的条目"""
+        now = time.time()
+        for key, expires_at, value in entries:
+            if expires_at >= now:
+                self._put(key, expires_at, value)
+        self._trim()
+
+
+__all__ = ['TTLCache']
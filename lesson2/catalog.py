@@ -0,0 +1,332 @@
+"""
+电影目录模块
+按列保存转换后的电影：数值字段使用定长数组，文本集中保存在字节池中，类型使用位图；
+读取时才组装为与 convert_tmdb_to_douban_format 输出相同格式的字典。
+一百万部电影时，内存只有字典列表的几分之一（见 python benchmark.py catalog）
+"""
+import json
+import sys
+from array import array
+from typing import Any, Dict, List, Optional
+
+from memory import approx_size, sampled_size
+from snapshot import Snapshot, encode_json
+
+# 文本长度的最高位表示编码：0 为 ASCII（每字 1 字节），1 为 UTF-16（每字 2 字节，与 Python 保存中文的方式相同）
+WIDE = 1 << 31
+
+# 类型位图最多支持的类型数量
+MAX_GENRES = 64
+
+# 评分列的最高位：原值为整数
+INT_RATING = 1 << 15
+
+# 数值列（属性名）
+NUMBER_COLUMNS = ("ids", "years", "ratings", "rating_counts", "genres", "cover_prefix_codes")
+
+
+class TextColumn:
+    """文本列：所有文本连续保存在字节池中，每行记录起始位置和长度
+
+    从快照恢复时，快照中的文本（base）直接引用映射的文件，之后写入的文本追加到 data；
+    修改某一行时追加新文本，旧文本不回收
+    """
+
+    def __init__(self, base: memoryview = b""):
+        self.base = base
+        self.data = bytearray()
+        self.starts = array("Q")
+        self.lengths = array("L")
+        # 复制时记录 data 的长度，之后追加的内容不属于这个副本
+        self.limit: Optional[int] = None
+
+    def _store(self, text: str) -> tuple:
+        if text.isascii():
+            encoded, flag = text.encode("ascii"), 0
+        else:
+            encoded, flag = text.encode("utf-16-le"), WIDE
+        start = len(self.base) + len(self.data)
+        self.data += encoded
+        return start, len(encoded) | flag
+
+    def append(self, text: str):
+        start, length = self._store(text)
+        self.starts.append(start)
+        self.lengths.append(length)
+
+    def __setitem__(self, i: int, text: str):
+        if self[i] != text:
+            self.starts[i], self.lengths[i] = self._store(text)
+
+    def __getitem__(self, i: int) -> str:
+        start, length = self.starts[i], self.lengths[i]
+        size = length & ~WIDE
+        if start < len(self.base):
+            raw = self.base[start:start + size]
+        else:
+            start -= len(self.base)
+            raw = self.data[start:start + size]
+        return str(raw, "utf-16-le" if length & WIDE else "ascii")
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def copy(self) -> "TextColumn":
+        """浅复制（写快照用）：字节池共用，位置数组复制"""
+        other = TextColumn(self.base)
+        other.data = self.data
+        other.limit = len(self.data)
+        other.starts = array("Q", self.starts)
+        other.lengths = array("L", self.lengths)
+        return other
+
+    def pool(self) -> bytes:
+        data = self.data if self.limit is None else self.data[:self.limit]
+        return bytes(self.base) + bytes(data)
+
+    def approx_bytes(self) -> int:
+        """占用的内存（不含映射的快照文件，由操作系统按需换入换出）"""
+        return sys.getsizeof(self.data) + sys.getsizeof(self.starts) + sys.getsizeof(self.lengths)
+
+
+class StringPool:
+    """字符串池：重复出现的字符串（如图片地址前缀）只保存一次，行中只记录编号"""
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[str] = list(values or [])
+        self.codes: Dict[str, int] = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class MovieCatalog:
+    """列式电影目录，下标为文档编号（与标题索引一致）
+
+    - id、评价人数：整数数组；年份：16 位整数数组；评分：乘以 10 后的 16 位整数数组
+    - 标题、原名、简介：TextColumn；封面：前缀放入字符串池，文件名放入 TextColumn
+    - 类型：64 位位图，类型名称放入字符串池（输出时按类型第一次出现在目录中的顺序排列）
+    无法按上述方式保存的值（非数字 ID、非整十分之一的评分等）放在 overflow 中，除类型顺序外读出的值与写入时一致
+    """
+
+    TEXT_FIELDS = ("title", "original_title", "summary")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.years = array("H")
+        self.ratings = array("H")
+        self.rating_counts = array("q")
+        self.genres = array("Q")
+        self.texts = {field: TextColumn() for field in self.TEXT_FIELDS}
+        self.cover_prefixes = StringPool()
+        self.cover_prefix_codes = array("H")
+        self.cover_names = TextColumn()
+        self.genre_names = StringPool()
+        self.overflow: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def approx_bytes(self) -> int:
+        """大致占用的内存（字节）"""
+        size = sum(sys.getsizeof(getattr(self, name)) for name in NUMBER_COLUMNS)
+        size += sum(column.approx_bytes() for column in (*self.texts.values(), self.cover_names))
+        size += sampled_size(self.overflow)
+        size += approx_size(self.cover_prefixes.values) + approx_size(self.genre_names.values)
+        return size
+
+    # ---------- 写入 ----------
+
+    def _encode(self, record: dict) -> tuple:
+        """把一条记录拆分为各列的值，返回 (各列的值, 无法按列保存的字段)"""
+        values = {}
+        extra = {}
+
+        movie_id = record.get("id", "")
+        if isinstance(movie_id, str) and movie_id.isdigit() and str(int(movie_id)) == movie_id:
+            values["ids"] = int(movie_id)
+        else:
+            values["ids"] = -1
+            extra["id"] = movie_id
+
+        year = record.get("year", "")
+        values["years"] = 0
+        if isinstance(year, str) and year.isdigit() and len(year) == 4 and year[0] != "0":
+            values["years"] = int(year)
+        elif year != "":
+            extra["year"] = year
+
+        # 评分保存为十分之一的整数；最高位表示原值是整数（TMDB 未评分时为 0）
+        rating = record.get("rating", 0)
+        values["ratings"] = 0
+        if type(rating) in (int, float) and 0 <= rating * 10 < INT_RATING and round(rating * 10) / 10 == rating:
+            values["ratings"] = round(rating * 10) | (INT_RATING if type(rating) is int else 0)
+        else:
+            extra["rating"] = rating
+
+        rating_count = record.get("rating_count", 0)
+        values["rating_counts"] = 0
+        if type(rating_count) is int:
+            values["rating_counts"] = rating_count
+        else:
+            extra["rating_count"] = rating_count
+
+        # 类型按第一次出现的顺序编号，位图不保留列表中的顺序；重复或超出位图范围的类型原样保存
+        genres = record.get("genres", [])
+        codes = [self.genre_names.code(name) for name in genres] if isinstance(genres, list) else None
+        values["genres"] = 0
+        if codes is not None and len(set(codes)) == len(codes) and all(code < MAX_GENRES for code in codes):
+            for code in codes:
+                values["genres"] |= 1 << code
+        else:
+            extra["genres"] = genres
+
+        # 封面地址按最后一个 / 拆分，前缀（图片服务器地址）放入字符串池
+        cover = record.get("cover", "")
+        if not isinstance(cover, str):
+            extra["cover"] = cover
+            cover = ""
+        cut = cover.rfind("/") + 1
+        values["cover_prefix_codes"] = self.cover_prefixes.code(cover[:cut])
+        values["cover_names"] = cover[cut:]
+
+        for field in self.TEXT_FIELDS:
+            text = record.get(field, "")
+            if not isinstance(text, str):
+                extra[field] = text
+                text = ""
+            values[field] = text
+        return values, extra
+
+    def _columns(self) -> dict:
+        columns = {name: getattr(self, name) for name in NUMBER_COLUMNS}
+        columns["cover_names"] = self.cover_names
+        columns.update(self.texts)
+        return columns
+
+    def append(self, record: dict):
+        """在末尾加入一条记录"""
+        values, extra = self._encode(record)
+        doc = len(self.ids)
+        for name, column in self._columns().items():
+            column.append(values[name])
+        if extra:
+            self.overflow[doc] = extra
+
+    def __setitem__(self, doc: int, record: dict):
+        """替换一条记录"""
+        values, extra = self._encode(record)
+        for name, column in self._columns().items():
+            column[doc] = values[name]
+        if extra:
+            self.overflow[doc] = extra
+        else:
+            self.overflow.pop(doc, None)
+
+    # ---------- 读取 ----------
+
+    def __getitem__(self, doc: int) -> dict:
+        """组装为字典（字段顺序与列表接口一致）"""
+        if doc < 0:
+            doc += len(self)
+        mask = self.genres[doc]
+        year = self.years[doc]
+        rating = self.ratings[doc]
+        record = {
+            "id": str(self.ids[doc]),
+            "title": self.texts["title"][doc],
+            "original_title": self.texts["original_title"][doc],
+            "year": str(year) if year else "",
+            "rating": (rating ^ INT_RATING) // 10 if rating & INT_RATING else rating / 10,
+            "rating_count": self.rating_counts[doc],
+            "cover": self.cover_prefixes.values[self.cover_prefix_codes[doc]] + self.cover_names[doc],
+            "summary": self.texts["summary"][doc],
+            "genres": [name for code, name in enumerate(self.genre_names.values) if mask >> code & 1],
+        }
+        extra = self.overflow.get(doc)
+        if extra:
+            record.update(extra)
+        return record
+
+    def __iter__(self):
+        for doc in range(len(self)):
+            yield self[doc]
+
+    def matches(self, doc: int, record: dict) -> bool:
+        """判断记录与目录中保存的是否相同（类型不区分顺序）"""
+        stored = self[doc]
+        genres = record.get("genres")
+        if isinstance(genres, list) and stored.get("genres") == genres:
+            return stored == record
+        if isinstance(genres, list) and sorted(stored.get("genres") or []) == sorted(genres):
+            return stored == {**record, "genres": stored["genres"]}
+        return stored == record
+
+    def rating_count(self, doc: int) -> int:
+        """评价人数（排序用，不组装整条记录）"""
+        extra = self.overflow.get(doc)
+        if extra and "rating_count" in extra:
+            return extra["rating_count"] or 0
+        return self.rating_counts[doc]
+
+    # ---------- 复制和快照 ----------
+
+    def copy(self) -> "MovieCatalog":
+        """浅复制（写快照用）：数值数组复制，文本字节池共用"""
+        other = MovieCatalog.__new__(MovieCatalog)
+        for name in NUMBER_COLUMNS:
+            setattr(other, name, array(getattr(self, name).typecode, getattr(self, name)))
+        other.texts = {field: column.copy() for field, column in self.texts.items()}
+        other.cover_names = self.cover_names.copy()
+        other.cover_prefixes = StringPool(self.cover_prefixes.values)
+        other.genre_names = StringPool(self.genre_names.values)
+        other.overflow = dict(self.overflow)
+        return other
+
+    def dump_snapshot(self, prefix: str) -> Dict[str, bytes]:
+        """编码为快照的各段（段名以 prefix 开头）"""
+        sections = {
+            f"{prefix}.meta": encode_json({
+                "cover_prefixes": self.cover_prefixes.values,
+                "genre_names": self.genre_names.values,
+                "overflow": [[doc, extra] for doc, extra in self.overflow.items()],
+            }),
+        }
+        for name in NUMBER_COLUMNS:
+            sections[f"{prefix}.{name}"] = getattr(self, name).tobytes()
+        for name, column in [*self.texts.items(), ("cover_names", self.cover_names)]:
+            sections[f"{prefix}.{name}.starts"] = column.starts.tobytes()
+            sections[f"{prefix}.{name}.lengths"] = column.lengths.tobytes()
+            sections[f"{prefix}.{name}.pool"] = column.pool()
+        return sections
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot, prefix: str) -> Optional["MovieCatalog"]:
+        """从快照恢复：数值数组复制到内存，文本直接引用映射的文件；快照中没有目录时返回 None"""
+        meta = snapshot.section(f"{prefix}.meta")
+        if meta is None:
+            return None
+        meta = json.loads(bytes(meta))
+
+        catalog = cls()
+        catalog.cover_prefixes = StringPool(meta["cover_prefixes"])
+        catalog.genre_names = StringPool(meta["genre_names"])
+        catalog.overflow = {doc: extra for doc, extra in meta["overflow"]}
+        for name in NUMBER_COLUMNS:
+            getattr(catalog, name).frombytes(snapshot.section(f"{prefix}.{name}"))
+        for name in (*cls.TEXT_FIELDS, "cover_names"):
+            column = TextColumn(snapshot.section(f"{prefix}.{name}.pool"))
+            column.starts.frombytes(snapshot.section(f"{prefix}.{name}.starts"))
+            column.lengths.frombytes(snapshot.section(f"{prefix}.{name}.lengths"))
+            if name == "cover_names":
+                catalog.cover_names = column
+            else:
+                catalog.texts[name] = column
+        return catalog
+
+
+__all__ = ['MovieCatalog', 'TextColumn', 'StringPool']
@@ -0,0 +1,58 @@
+"""
+TMDB 变更订阅模块
+读取 TMDB 的电影变更列表（/movie/changes，按天筛选，每页 100 条），只处理本地缓存过的电影，
+不必在缓存过期时重新请求所有电影
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Tuple
+
+# TMDB 只支持查询最近 14 天的变更
+MAX_WINDOW_DAYS = 14
+
+
+def change_window(since: float, until: float) -> Tuple[date, date]:
+    """时间戳区间对应的查询日期（UTC，首尾两天都包含）；超过 14 天时只查询最近 14 天"""
+    start = datetime.fromtimestamp(since, timezone.utc).date()
+    end = datetime.fromtimestamp(until, timezone.utc).date()
+    return max(start, end - timedelta(days=MAX_WINDOW_DAYS)), end
+
+
+async def iter_changed_ids(
+    fetch: Callable[[str, dict], Awaitable[dict]],
+    since: float,
+    until: float,
+) -> AsyncIterator[List[str]]:
+    """逐页返回区间内有变更的电影 ID"""
+    start, end = change_window(since, until)
+    page = 1
+    while True:
+        data = await fetch("movie/changes", {
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "page": page,
+        })
+        yield [str(item["id"]) for item in data.get("results", []) if item.get("id") is not None]
+        if page >= (data.get("total_pages") or 1):
+            return
+        page += 1
+
+
+async def run_batches(
+    items: Iterable,
+    func: Callable[[object], Awaitable[object]],
+    size: int,
+    pause: float,
+) -> list:
+    """分批并发执行，每批之间暂停 pause 秒（给用户请求留出上游配额），返回每项的结果或异常"""
+    items = list(items)
+    results = []
+    for start in range(0, len(items), size):
+        if start and pause > 0:
+            await asyncio.sleep(pause)
+        batch = items[start:start + size]
+        results.extend(await asyncio.gather(*map(func, batch), return_exceptions=True))
+    return results
+
+
+__all__ = ['change_window', 'iter_changed_ids', 'run_batches']
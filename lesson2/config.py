@@ -19,14 +19,152 @@ class Settings:
         self.TMDB_API_BASE: str = os.getenv("TMDB_API_BASE", "https://api.themoviedb.org/3")
         self.TMDB_IMAGE_BASE: str = os.getenv("TMDB_IMAGE_BASE", "https://image.tmdb.org/t/p/w500")
         
+        # 语言：接口不传 lang 时使用 DEFAULT_LANGUAGE；标题或简介缺少翻译时用 FALLBACK_LANGUAGE 补全（留空表示不补全），
+        # 备用语言的数据缓存 FALLBACK_CACHE_TTL 秒
+        self.DEFAULT_LANGUAGE: str = os.getenv("DEFAULT_LANGUAGE", "zh-CN")
+        self.FALLBACK_LANGUAGE: str = os.getenv("FALLBACK_LANGUAGE", "en-US")
+        self.FALLBACK_CACHE_TTL: float = float(os.getenv("FALLBACK_CACHE_TTL", "86400"))
+        # lang 参数允许的语言（逗号分隔），其它语言返回 400；DEFAULT_LANGUAGE 和 FALLBACK_LANGUAGE 总是允许
+        self.SUPPORTED_LANGUAGES: str = os.getenv(
+            "SUPPORTED_LANGUAGES", "zh-CN,zh-TW,en-US,ja-JP,ko-KR,fr-FR,de-DE,es-ES"
+        )
+        
         # 服务器配置
         self.HOST: str = os.getenv("HOST", "127.0.0.1")
         self.PORT: int = int(os.getenv("PORT", "8000"))
+        # 开发模式：修改代码后自动重启（单进程）；关闭时 python main.py 使用生产启动方式（server.py）
+        self.RELOAD: bool = os.getenv("RELOAD", "False").lower() == "true"
+        
+        # 生产启动配置（server.py）
+        # worker 数量，0 表示自动：共享状态后端为 sqlite/redis 时与 CPU 核数相同，local 时为 1（local 的状态不在 worker 之间共享）
+        self.WORKERS: int = int(os.getenv("WORKERS", "0"))
+        # fork worker 之前预热缓存，预热数据由所有 worker 以写时复制方式共享
+        self.PREFORK_WARMUP: bool = os.getenv("PREFORK_WARMUP", "True").lower() == "true"
+        self.WARMUP_PAGES: int = int(os.getenv("WARMUP_PAGES", "5"))
+        # 监听队列长度、keep-alive 空闲超时、优雅退出时等待进行中请求的最长时间（秒）
+        self.BACKLOG: int = int(os.getenv("BACKLOG", "2048"))
+        self.KEEP_ALIVE_TIMEOUT: int = int(os.getenv("KEEP_ALIVE_TIMEOUT", "5"))
+        self.GRACEFUL_TIMEOUT: int = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+        # 访问日志（反向代理已记录访问日志时建议关闭）
+        self.ACCESS_LOG: bool = os.getenv("ACCESS_LOG", "False").lower() == "true"
         
         # 应用配置
         self.USE_MOCK_DATA: bool = os.getenv("USE_MOCK_DATA", "False").lower() == "true"
         self.TIMEOUT: float = float(os.getenv("TIMEOUT", "10.0"))
         
+        # TMDB 请求限速（每个进程）：每秒请求数（0 表示不限速）、允许连续发出的请求数、连接池大小
+        self.TMDB_RATE_LIMIT: float = float(os.getenv("TMDB_RATE_LIMIT", "40"))
+        self.TMDB_BURST: int = int(os.getenv("TMDB_BURST", "20"))
+        self.TMDB_MAX_CONNECTIONS: int = int(os.getenv("TMDB_MAX_CONNECTIONS", "20"))
+        
+        # 准入控制：请求 TMDB 的路由和只读本地数据的路由分别限制同时处理的请求数（0 表示不限制）和最长排队时间（秒），
+        # 超出时返回 503 和 Retry-After；ADMISSION_ROUTES 单独限制某些路由，如 search_movies=16:1,add_favorite=8
+        self.ADMISSION_UPSTREAM_LIMIT: int = int(os.getenv("ADMISSION_UPSTREAM_LIMIT", "64"))
+        self.ADMISSION_UPSTREAM_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_UPSTREAM_QUEUE_TIMEOUT", "2.0"))
+        self.ADMISSION_LOCAL_LIMIT: int = int(os.getenv("ADMISSION_LOCAL_LIMIT", "64"))
+        self.ADMISSION_LOCAL_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_LOCAL_QUEUE_TIMEOUT", "0.5"))
+        self.ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+        self.ADMISSION_ROUTES: str = os.getenv("ADMISSION_ROUTES", "")
+        
+        # 客户端提前断开时取消请求 TMDB 的路由（关闭后上游请求照常完成，用于对比测试）
+        self.CANCEL_ON_DISCONNECT: bool = os.getenv("CANCEL_ON_DISCONNECT", "True").lower() == "true"
+        
+        # 客户端限流：搜索、详情、添加收藏每个客户端（API Token 或 IP）在 RATE_LIMIT_WINDOW 秒内的最多请求数（0 表示不限）
+        # RATE_LIMIT_API_TOKENS 为有效的 API Token（逗号分隔），只有这些 Token 单独计数，其它请求按 IP 计数
+        # 每个进程最多记录 RATE_LIMIT_MAX_CLIENTS 个客户端；RATE_LIMIT_SHARED 时使用共享状态后端（sqlite/redis），
+        # 所有 worker 共用限制；RATE_LIMIT_TRUST_PROXY 时按 X-Forwarded-For 识别 IP（只应在反向代理之后开启）
+        self.RATE_LIMIT_WINDOW: float = float(os.getenv("RATE_LIMIT_WINDOW", "60"))
+        self.RATE_LIMIT_SEARCH: int = int(os.getenv("RATE_LIMIT_SEARCH", "60"))
+        self.RATE_LIMIT_DETAIL: int = int(os.getenv("RATE_LIMIT_DETAIL", "120"))
+        self.RATE_LIMIT_FAVORITE: int = int(os.getenv("RATE_LIMIT_FAVORITE", "30"))
+        self.RATE_LIMIT_API_TOKENS: str = os.getenv("RATE_LIMIT_API_TOKENS", "")
+        self.RATE_LIMIT_MAX_CLIENTS: int = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+        self.RATE_LIMIT_SHARED: bool = os.getenv("RATE_LIMIT_SHARED", "False").lower() == "true"
+        self.RATE_LIMIT_TRUST_PROXY: bool = os.getenv("RATE_LIMIT_TRUST_PROXY", "False").lower() == "true"
+        
+        # 预取详情：搜索和 Top250 返回后在后台获取前 PREFETCH_COUNT 部电影的详情（0 表示关闭）
+        # 只在令牌桶剩余一半以上时预取，同时最多 PREFETCH_CONCURRENCY 个，不挤占用户请求的配额
+        self.PREFETCH_COUNT: int = int(os.getenv("PREFETCH_COUNT", "0"))
+        self.PREFETCH_CONCURRENCY: int = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+        
+        # 首页数据内联到 HTML（首屏零 API 请求，但主页响应需等待上游数据）
+        self.INLINE_HOME_DATA: bool = os.getenv("INLINE_HOME_DATA", "False").lower() == "true"
+        
+        # 流式接口同时请求的最大页数
+        self.STREAM_CONCURRENCY: int = int(os.getenv("STREAM_CONCURRENCY", "4"))
+        
+        # 缓存配置（时间单位：秒）
+        self.CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+        self.SEARCH_CACHE_TTL: float = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+        # 结果数少于阈值的搜索使用较短的缓存时间
+        self.SEARCH_NEGATIVE_TTL: float = float(os.getenv("SEARCH_NEGATIVE_TTL", "60"))
+        self.SEARCH_NEGATIVE_THRESHOLD: int = int(os.getenv("SEARCH_NEGATIVE_THRESHOLD", "3"))
+        
+        # 内存预算（每个进程，MB，0 表示只统计不限制）：缓存、索引等进程内存储的估算总量超出时按 LRU 淘汰缓存
+        # 索引等不能淘汰的存储每隔 MEMORY_MEASURE_INTERVAL 秒重新估算；
+        # MEMORY_TRACEMALLOC_FRAMES 大于 0 时启动 tracemalloc，/debug/memory 显示分配最多的代码位置（有额外开销）
+        self.MEMORY_BUDGET_MB: float = float(os.getenv("MEMORY_BUDGET_MB", "0"))
+        self.MEMORY_MEASURE_INTERVAL: float = float(os.getenv("MEMORY_MEASURE_INTERVAL", "30"))
+        self.MEMORY_TRACEMALLOC_FRAMES: int = int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", "0"))
+        
+        # 收藏数据库文件（SQLite）
+        self.FAVORITES_DB: str = os.getenv("FAVORITES_DB", str(Path(__file__).parent / "data" / "favorites.db"))
+        
+        # 搜索历史：内存中保留的最近记录数、日志文件、热门关键词数量
+        # 日志超过 SEARCH_HISTORY_LOG_MAX_KB 时压缩为当前状态（0 表示不压缩）
+        self.SEARCH_HISTORY_SIZE: int = int(os.getenv("SEARCH_HISTORY_SIZE", "50"))
+        self.SEARCH_HISTORY_LOG: str = os.getenv("SEARCH_HISTORY_LOG", str(Path(__file__).parent / "data" / "search_history.log"))
+        self.SEARCH_HISTORY_LOG_MAX_KB: int = int(os.getenv("SEARCH_HISTORY_LOG_MAX_KB", "1024"))
+        self.TRENDING_TOP_K: int = int(os.getenv("TRENDING_TOP_K", "20"))
+        
+        # 本地标题索引搜索：标题中连续包含关键词的结果不少于该数量时不再请求 TMDB
+        self.LOCAL_SEARCH: bool = os.getenv("LOCAL_SEARCH", "True").lower() == "true"
+        self.LOCAL_SEARCH_MIN_RESULTS: int = int(os.getenv("LOCAL_SEARCH_MIN_RESULTS", "5"))
+        
+        # 搜索建议：每个前缀保存的建议数、前缀树最大深度、最多保留的搜索关键词数（按得分）
+        self.SUGGEST_TOP_K: int = int(os.getenv("SUGGEST_TOP_K", "10"))
+        self.SUGGEST_MAX_PREFIX: int = int(os.getenv("SUGGEST_MAX_PREFIX", "16"))
+        self.SUGGEST_MAX_KEYWORDS: int = int(os.getenv("SUGGEST_MAX_KEYWORDS", "10000"))
+        
+        # 推荐：参与计算偏好的最近收藏数量；电影数量达到 RECOMMEND_ANN_MIN_SIZE 后使用聚类索引近似计算
+        # （0 表示始终精确计算），查询时计算 RECOMMEND_ANN_PROBES 个最接近的簇
+        self.RECOMMEND_PROFILE_SIZE: int = int(os.getenv("RECOMMEND_PROFILE_SIZE", "100"))
+        self.RECOMMEND_ANN_MIN_SIZE: int = int(os.getenv("RECOMMEND_ANN_MIN_SIZE", "50000"))
+        self.RECOMMEND_ANN_PROBES: int = int(os.getenv("RECOMMEND_ANN_PROBES", "16"))
+        
+        # 共享状态后端：local（单进程）、sqlite（同一台机器的多个 worker）、redis（Redis 协议服务）
+        self.STATE_BACKEND: str = os.getenv("STATE_BACKEND", "local").lower()
+        self.STATE_DB: str = os.getenv("STATE_DB", str(Path(__file__).parent / "data" / "shared_state.db"))
+        self.STATE_URL: str = os.getenv("STATE_URL", "redis://127.0.0.1:6379/0")
+        
+        # 电影详情缓存时间（秒）：有变更订阅时 TMDB 上修改过的电影会及时刷新，可以缓存几天（最多 14 天，即变更列表的查询范围）；
+        # STATE_BACKEND 为 sqlite/redis 时详情缓存保存在共享状态后端
+        self.DETAIL_CACHE_TTL: float = float(os.getenv("DETAIL_CACHE_TTL", "259200"))
+        
+        # 变更订阅：每隔 CHANGES_POLL_INTERVAL 秒读取 TMDB 的电影变更列表（0 表示关闭，此时应把详情缓存时间调回 1 小时）
+        # 变更过的电影中，已缓存的详情重新获取（refresh）或直接删除（invalidate），已收藏的电影更新收藏中保存的数据
+        # 重新获取按 CHANGES_BATCH_SIZE 部一批进行，每批之间暂停 CHANGES_BATCH_PAUSE 秒，给用户请求留出上游配额
+        self.CHANGES_POLL_INTERVAL: float = float(os.getenv("CHANGES_POLL_INTERVAL", "600"))
+        self.CHANGES_MODE: str = os.getenv("CHANGES_MODE", "refresh").lower()
+        self.CHANGES_BATCH_SIZE: int = int(os.getenv("CHANGES_BATCH_SIZE", "10"))
+        self.CHANGES_BATCH_PAUSE: float = float(os.getenv("CHANGES_BATCH_PAUSE", "1.0"))
+        
+        # 多实例分片：PEERS 为所有实例地址（逗号分隔），SELF_URL 为本实例地址
+        # 每部电影只由一致性哈希环上的一个实例请求 TMDB，其它实例通过 /internal/movie/{id} 获取
+        self.PEERS: str = os.getenv("PEERS", "")
+        self.SELF_URL: str = os.getenv("SELF_URL", f"http://{self.HOST}:{self.PORT}")
+        self.PEER_REPLICAS: int = int(os.getenv("PEER_REPLICAS", "64"))
+        # 内部接口的共享密钥（请求头 X-Peer-Secret）；留空时只接受来自 PEERS 中地址的请求
+        self.PEER_SECRET: str = os.getenv("PEER_SECRET", "")
+        # 非所有者实例本地保存的热点电影数量和时间（秒）
+        self.PEER_HOT_CACHE_SIZE: int = int(os.getenv("PEER_HOT_CACHE_SIZE", "256"))
+        self.PEER_HOT_TTL: float = float(os.getenv("PEER_HOT_TTL", "60"))
+        
+        # 快照：关闭时和每隔 SNAPSHOT_INTERVAL 秒把标题索引、搜索建议和缓存写入文件，启动时加载
+        # SNAPSHOT_PATH 为空时不使用快照，SNAPSHOT_INTERVAL 为 0 时只在关闭时写入
+        self.SNAPSHOT_PATH: str = os.getenv("SNAPSHOT_PATH", str(Path(__file__).parent / "data" / "cache.snapshot"))
+        self.SNAPSHOT_INTERVAL: float = float(os.getenv("SNAPSHOT_INTERVAL", "300"))
+        
         # 验证必需配置
         self._validate()
     
@@ -47,6 +185,12 @@ class Settings:
     
     def _validate(self):
         """验证必需的配置"""
+        if self.STATE_BACKEND not in ("local", "sqlite", "redis"):
+            raise ValueError(f"⚠️  STATE_BACKEND 只能是 local、sqlite 或 redis，当前为: {self.STATE_BACKEND}")
+        
+        if self.CHANGES_MODE not in ("refresh", "invalidate"):
+            raise ValueError(f"⚠️  CHANGES_MODE 只能是 refresh 或 invalidate，当前为: {self.CHANGES_MODE}")
+        
         if not self.TMDB_API_KEY and not self.USE_MOCK_DATA:
             raise ValueError(
                 "⚠️  未找到 TMDB_API_KEY！\n"
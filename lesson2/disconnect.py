@@ -0,0 +1,58 @@
+"""
+客户端断开检测模块
+客户端提前断开（关闭页面、取消搜索、超时重试）时立即取消请求处理，不再等待上游和转换数据。
+在 ASGI 层实现，所有请求上游的路由（包括流式接口）都不需要在处理函数中单独处理
+"""
+import asyncio
+from typing import Callable, Collection, List
+
+from admission import route_name
+
+
+class DisconnectMiddleware:
+    """请求 names 中的路由时，在后台读取客户端消息，收到 http.disconnect 后取消请求处理（ASGI 中间件）
+
+    客户端消息照常转交给应用（流式响应仍能收到断开消息）；on_disconnect 在取消请求时调用，用于统计
+    """
+
+    def __init__(self, app, routes: Callable[[], List], names: Collection[str], on_disconnect: Callable[[], None]):
+        self.app = app
+        self.routes = routes
+        self.names = frozenset(names)
+        self.on_disconnect = on_disconnect
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or route_name(self.routes(), scope) not in self.names:
+            await self.app(scope, receive, send)
+            return
+
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def forward():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send))
+        reader = asyncio.ensure_future(forward())
+        try:
+            done, _ = await asyncio.wait({handler, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if handler not in done:
+                handler.cancel()
+                self.on_disconnect()
+                # 等待取消完成（上游请求、排队名额等在 finally 中释放），客户端已断开，不再发送响应
+                await asyncio.wait({handler})
+                if not handler.cancelled():
+                    handler.exception()
+                return
+        except asyncio.CancelledError:
+            handler.cancel()
+            raise
+        finally:
+            reader.cancel()
+        handler.result()
+
+
+__all__ = ['DisconnectMiddleware']
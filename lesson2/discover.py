@@ -0,0 +1,123 @@
+"""
+本地筛选模块
+在列式电影目录上用 NumPy 向量化计算筛选条件和排序键，只对前 k 个结果排序，不请求 TMDB
+"""
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from catalog import INT_RATING, MAX_GENRES, MovieCatalog
+
+# 支持的排序字段
+DISCOVER_SORTS = ("rating", "rating_count", "year")
+
+
+def to_number(value) -> float:
+    """overflow 中的值转换为数字，无法转换时为 NaN（不满足任何比较条件）"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def genre_bits(catalog: MovieCatalog, names: Iterable[str]) -> Tuple[int, int]:
+    """类型名称转换为位图，返回 (位图, 位图中没有的类型数量)"""
+    mask, missing = 0, 0
+    for name in set(names):
+        code = catalog.genre_names.codes.get(name)
+        if code is None or code >= MAX_GENRES:
+            missing += 1
+        else:
+            mask |= 1 << code
+    return mask, missing
+
+
+def discover(
+    catalog: MovieCatalog,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    genres: Tuple[str, ...] = (),
+    match_all_genres: bool = False,
+    min_rating: Optional[float] = None,
+    max_rating: Optional[float] = None,
+    min_votes: Optional[int] = None,
+    sort_by: str = "rating_count",
+    descending: bool = True,
+    start: int = 0,
+    count: int = 20,
+) -> Tuple[int, List[int]]:
+    """筛选并排序，返回 (满足条件的总数, 第 start 条起的 count 个文档编号)
+
+    排序相同时按文档编号（加入目录的先后）排列，翻页结果稳定
+    """
+    size = len(catalog)
+    if size == 0:
+        return 0, []
+
+    # 列的零复制视图：只在本函数内使用，返回前全部释放（存在视图时数组不能扩容）
+    years = np.frombuffer(catalog.years, dtype=np.uint16).astype(np.float64)
+    ratings_raw = np.frombuffer(catalog.ratings, dtype=np.uint16)
+    ratings = (ratings_raw & (INT_RATING - 1)) / 10
+    votes = np.frombuffer(catalog.rating_counts, dtype=np.int64).astype(np.float64)
+    genre_column = np.frombuffer(catalog.genres, dtype=np.uint64)
+    del ratings_raw
+    years[years == 0] = np.nan
+
+    # 无法按列保存的值（很少）逐条修正
+    overflow_genres = {}
+    for doc, extra in catalog.overflow.items():
+        if "year" in extra:
+            years[doc] = to_number(extra["year"])
+        if "rating" in extra:
+            ratings[doc] = to_number(extra["rating"])
+        if "rating_count" in extra:
+            votes[doc] = to_number(extra["rating_count"])
+        if "genres" in extra:
+            overflow_genres[doc] = extra["genres"] if isinstance(extra["genres"], list) else []
+
+    mask = np.ones(size, dtype=bool)
+    if year_from is not None:
+        mask &= years >= year_from
+    if year_to is not None:
+        mask &= years <= year_to
+    if min_rating is not None:
+        mask &= ratings >= min_rating
+    if max_rating is not None:
+        mask &= ratings <= max_rating
+    if min_votes is not None:
+        mask &= votes >= min_votes
+    if genres:
+        # all：包含全部类型（位图中没有某个类型时只有 overflow 中的记录可能满足）；any：包含任一类型
+        wanted, missing = genre_bits(catalog, genres)
+        bits = np.uint64(wanted)
+        if match_all_genres:
+            genre_match = (genre_column & bits) == bits if not missing else np.zeros(size, dtype=bool)
+        else:
+            genre_match = (genre_column & bits) != 0
+        for doc, names in overflow_genres.items():
+            found = set(genres) & set(names)
+            genre_match[doc] = len(found) == len(set(genres)) if match_all_genres else bool(found)
+        mask &= genre_match
+    del genre_column
+
+    matched = np.flatnonzero(mask)
+    total = len(matched)
+    end = min(start + count, total)
+    if start >= end:
+        return total, []
+
+    keys = {"rating": ratings, "rating_count": votes, "year": years}[sort_by][matched]
+    # 缺失值（NaN）总是排在最后
+    keys = np.where(np.isnan(keys), np.inf, -keys if descending else keys)
+
+    # 只取前 end 个：np.partition 为 O(n)，只对不超过第 end 名的候选排序（与边界排序键相同的全部保留，保证顺序稳定）
+    if end < total:
+        threshold = np.partition(keys, end - 1)[end - 1]
+        candidates = np.flatnonzero(keys <= threshold)
+    else:
+        candidates = np.arange(total)
+    order = candidates[np.lexsort((matched[candidates], keys[candidates]))]
+    return total, matched[order[start:end]].tolist()
+
+
+__all__ = ['discover', 'DISCOVER_SORTS']
@@ -0,0 +1,335 @@
+"""
+收藏存储模块
+使用 SQLite（WAL 模式）持久化收藏数据，多个进程可以共享同一个数据库文件
+"""
+import asyncio
+import base64
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+
+# 支持的排序方式及对应的 SQL（每种排序都有对应的索引）
+SORT_ORDERS = {
+    "added_at": "added_at DESC, movie_id DESC",
+    "rating": "rating DESC, movie_id DESC",
+    "year": "year DESC, movie_id DESC",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS favorites (
+    movie_id TEXT PRIMARY KEY,
+    added_at TEXT NOT NULL,
+    rating REAL NOT NULL DEFAULT 0,
+    year TEXT NOT NULL DEFAULT '',
+    note TEXT NOT NULL DEFAULT '',
+    movie TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_favorites_added_at ON favorites (added_at, movie_id);
+CREATE INDEX IF NOT EXISTS idx_favorites_rating ON favorites (rating, movie_id);
+CREATE INDEX IF NOT EXISTS idx_favorites_year ON favorites (year, movie_id);
+
+-- 统计汇总：每次增删收藏时在同一事务内更新，读取统计无需扫描收藏表
+CREATE TABLE IF NOT EXISTS favorite_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL DEFAULT 0,
+    rating_sum REAL NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS favorite_genres (genre TEXT PRIMARY KEY, count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS favorite_years (year TEXT PRIMARY KEY, count INTEGER NOT NULL);
+-- 评分直方图：桶号为评分 × 10（评分只有一位小数），用于计算分位数
+CREATE TABLE IF NOT EXISTS favorite_ratings (bucket INTEGER PRIMARY KEY, count INTEGER NOT NULL);
+"""
+
+# IN 查询每批的参数数量（低于 SQLite 的参数上限）
+QUERY_BATCH_SIZE = 500
+
+# 统计返回的评分分位数
+RATING_QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+
+def encode_cursor(sort_by: str, row: sqlite3.Row) -> str:
+    """根据一页的最后一条记录生成游标（对调用方不透明）"""
+    payload = json.dumps([sort_by, row[sort_by], row["movie_id"]], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(sort_by: str, cursor: str) -> Tuple:
+    """解析游标，返回 (排序值, movie_id)；游标无效或与排序方式不符时抛出 ValueError"""
+    try:
+        cursor_sort, value, movie_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("无效的游标")
+    if cursor_sort != sort_by:
+        raise ValueError("游标与排序方式不一致")
+    return value, movie_id
+
+
+def quantiles_from_buckets(buckets: List[Tuple[int, int]], total: int) -> Dict[str, float]:
+    """根据评分直方图计算分位数（buckets 按桶号升序）"""
+    if total == 0:
+        return {}
+
+    result = {}
+    targets = [(q, q * (total - 1)) for q in RATING_QUANTILES]
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        while targets and targets[0][1] < seen:
+            q, _ = targets.pop(0)
+            result[f"p{int(q * 100)}"] = bucket / 10
+    return result
+
+
+def row_to_favorite(row: sqlite3.Row) -> dict:
+    """把数据库记录转换为接口返回的收藏格式"""
+    return {
+        "movie": json.loads(row["movie"]),
+        "added_at": row["added_at"],
+        "note": row["note"],
+    }
+
+
+class FavoritesStore:
+    """收藏存储
+
+    同步方法以 _ 开头，在线程池中执行；异步方法供路由直接调用，不阻塞事件循环
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+        self._ensure_aggregates()
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接（SQLite 连接不能跨线程使用）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """fork 出的子进程中调用：不再使用父进程打开的连接（不关闭，避免影响父进程），之后按需重新连接"""
+        self._inherited = self._local
+        self._local = threading.local()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务；调用方已经开启事务时直接复用"""
+        conn = self._connect()
+        if conn.in_transaction:
+            yield conn
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _update_aggregates(self, conn: sqlite3.Connection, movie: dict, delta: int):
+        """把一部电影计入（delta=1）或移出（delta=-1）统计汇总，耗时 O(类型数)"""
+        rating = movie.get("rating", 0) or 0
+        rated = 1 if rating > 0 else 0
+        conn.execute(
+            "UPDATE favorite_totals SET total = total + ?, rating_sum = rating_sum + ?, "
+            "rating_count = rating_count + ? WHERE id = 1",
+            (delta, rating * rated * delta, rated * delta),
+        )
+
+        counters = [("favorite_genres", "genre", genre) for genre in set(movie.get("genres", []))]
+        if movie.get("year"):
+            counters.append(("favorite_years", "year", movie["year"]))
+        if rated:
+            counters.append(("favorite_ratings", "bucket", round(rating * 10)))
+
+        for table, column, key in counters:
+            conn.execute(
+                f"INSERT INTO {table} ({column}, count) VALUES (?, ?) "
+                f"ON CONFLICT({column}) DO UPDATE SET count = count + excluded.count",
+                (key, delta),
+            )
+            if delta < 0:
+                conn.execute(f"DELETE FROM {table} WHERE {column} = ? AND count <= 0", (key,))
+
+    def _ensure_aggregates(self):
+        """统计汇总不存在时（新库或旧版本的库）根据现有收藏重建"""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM favorite_totals").fetchone():
+                return
+            for table in ("favorite_genres", "favorite_years", "favorite_ratings"):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("INSERT INTO favorite_totals (id) VALUES (1)")
+            for row in conn.execute("SELECT movie FROM favorites").fetchall():
+                self._update_aggregates(conn, json.loads(row["movie"]), 1)
+
+    # ---------- 同步实现 ----------
+
+    def _add(self, movie_id: str, movie: dict, note: str = "", added_at: str = None) -> dict:
+        favorite = {
+            "movie": movie,
+            "added_at": added_at or datetime.now().isoformat(),
+            "note": note,
+        }
+        with self._transaction() as conn:
+            old = conn.execute("SELECT movie FROM favorites WHERE movie_id = ?", (movie_id,)).fetchone()
+            if old:
+                self._update_aggregates(conn, json.loads(old["movie"]), -1)
+            conn.execute(
+                "INSERT OR REPLACE INTO favorites (movie_id, added_at, rating, year, note, movie) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (movie_id, favorite["added_at"], movie.get("rating", 0), movie.get("year", ""),
+                 note, json.dumps(movie, ensure_ascii=False)),
+            )
+            self._update_aggregates(conn, movie, 1)
+        return favorite
+
+    def _remove(self, movie_id: str) -> Optional[dict]:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM favorites WHERE movie_id = ?", (movie_id,)).fetchone()
+            if row is None:
+                return None
+            favorite = row_to_favorite(row)
+            conn.execute("DELETE FROM favorites WHERE movie_id = ?", (movie_id,))
+            self._update_aggregates(conn, favorite["movie"], -1)
+        return favorite
+
+    def _refresh(self, movies: Dict[str, dict]) -> int:
+        """更新已收藏电影的数据（保留收藏时间和备注，未收藏的忽略），返回内容有变化的数量"""
+        updated = 0
+        with self._transaction() as conn:
+            for movie_id, movie in movies.items():
+                old = conn.execute("SELECT movie FROM favorites WHERE movie_id = ?", (movie_id,)).fetchone()
+                if old is None:
+                    continue
+                old_movie = json.loads(old["movie"])
+                if old_movie == movie:
+                    continue
+                self._update_aggregates(conn, old_movie, -1)
+                conn.execute(
+                    "UPDATE favorites SET rating = ?, year = ?, movie = ? WHERE movie_id = ?",
+                    (movie.get("rating", 0), movie.get("year", ""), json.dumps(movie, ensure_ascii=False), movie_id),
+                )
+                self._update_aggregates(conn, movie, 1)
+                updated += 1
+        return updated
+
+    def _favorited(self, movie_ids: Iterable[str]) -> Set[str]:
+        movie_ids = list(movie_ids)
+        conn = self._connect()
+        found = set()
+        for start in range(0, len(movie_ids), QUERY_BATCH_SIZE):
+            batch = movie_ids[start:start + QUERY_BATCH_SIZE]
+            rows = conn.execute(
+                f"SELECT movie_id FROM favorites WHERE movie_id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update(row["movie_id"] for row in rows)
+        return found
+
+    def _contains(self, movie_id: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM favorites WHERE movie_id = ?", (movie_id,)
+        ).fetchone()
+        return row is not None
+
+    def _list(self, sort_by: str = "added_at") -> List[dict]:
+        rows = self._connect().execute(
+            f"SELECT * FROM favorites ORDER BY {SORT_ORDERS[sort_by]}"
+        ).fetchall()
+        return [row_to_favorite(row) for row in rows]
+
+    def _page(self, sort_by: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        # 键集分页：从上一页最后一条记录之后继续沿索引读取，与偏移量无关
+        sql = "SELECT * FROM favorites"
+        args: list = []
+        if cursor:
+            sql += f" WHERE ({sort_by}, movie_id) < (?, ?)"
+            args.extend(decode_cursor(sort_by, cursor))
+        sql += f" ORDER BY {SORT_ORDERS[sort_by]} LIMIT ?"
+        args.append(limit + 1)
+
+        rows = self._connect().execute(sql, args).fetchall()
+        next_cursor = encode_cursor(sort_by, rows[limit - 1]) if len(rows) > limit else None
+        return [row_to_favorite(row) for row in rows[:limit]], next_cursor
+
+    def _count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM favorites").fetchone()[0]
+
+    def _stats(self) -> dict:
+        conn = self._connect()
+        totals = conn.execute("SELECT * FROM favorite_totals WHERE id = 1").fetchone()
+        genres = conn.execute("SELECT genre, count FROM favorite_genres").fetchall()
+        years = conn.execute("SELECT year, count FROM favorite_years ORDER BY year").fetchall()
+        ratings = conn.execute("SELECT bucket, count FROM favorite_ratings ORDER BY bucket").fetchall()
+
+        years_distribution = {row["year"]: row["count"] for row in years}
+        decades_distribution: Dict[str, int] = {}
+        for year, count in years_distribution.items():
+            if year[:3].isdigit():
+                decade = f"{year[:3]}0s"
+                decades_distribution[decade] = decades_distribution.get(decade, 0) + count
+
+        rating_count = totals["rating_count"]
+        return {
+            "total": totals["total"],
+            "average_rating": totals["rating_sum"] / rating_count if rating_count else 0,
+            "rating_quantiles": quantiles_from_buckets([tuple(row) for row in ratings], rating_count),
+            "genres_distribution": {row["genre"]: row["count"] for row in genres},
+            "years_distribution": years_distribution,
+            "decades_distribution": decades_distribution,
+        }
+
+    # ---------- 异步接口 ----------
+
+    async def add(self, movie_id: str, movie: dict, note: str = "") -> dict:
+        """添加或更新收藏"""
+        return await asyncio.to_thread(self._add, movie_id, movie, note)
+
+    async def remove(self, movie_id: str) -> Optional[dict]:
+        """删除收藏，返回被删除的收藏，不存在时返回 None"""
+        return await asyncio.to_thread(self._remove, movie_id)
+
+    async def refresh(self, movies: Dict[str, dict]) -> int:
+        """用最新的电影数据更新收藏快照 {movie_id: 电影}，返回更新的数量"""
+        return await asyncio.to_thread(self._refresh, movies)
+
+    async def favorited(self, movie_ids: Iterable[str]) -> Set[str]:
+        """返回其中已收藏的电影 ID"""
+        return await asyncio.to_thread(self._favorited, movie_ids)
+
+    async def contains(self, movie_id: str) -> bool:
+        """是否已收藏"""
+        return await asyncio.to_thread(self._contains, movie_id)
+
+    async def list(self, sort_by: str = "added_at") -> List[dict]:
+        """按指定方式排序返回全部收藏（排序由索引完成）"""
+        return await asyncio.to_thread(self._list, sort_by)
+
+    async def page(self, sort_by: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """按排序读取一页收藏，返回 (收藏列表, 下一页游标)；没有下一页时游标为 None"""
+        return await asyncio.to_thread(self._page, sort_by, limit, cursor)
+
+    async def count(self) -> int:
+        """收藏总数"""
+        return await asyncio.to_thread(self._count)
+
+    async def stats(self) -> dict:
+        """收藏统计（直接读取汇总表，与收藏数量无关）"""
+        return await asyncio.to_thread(self._stats)
+
+
+__all__ = ['FavoritesStore', 'SORT_ORDERS']
@@ -0,0 +1,301 @@
+"""
+批量导入电影
+逐行读取 TMDB 每日导出的电影 ID 文件（gzip 压缩、每行一个 JSON），通过限速的连接池并发获取详情，
+转换后写入标题索引、推荐索引和搜索建议，定期保存快照和进度；中断后再次运行从上次的进度继续。
+
+用法：
+    python ingest.py data/movie_ids_10_18_2026.json.gz
+    python ingest.py --date 2026-10-18              # 直接从 TMDB 下载（边下载边导入）
+    python ingest.py data/movie_ids.json.gz --concurrency 16 --min-popularity 1
+
+导入结果保存在快照（SNAPSHOT_PATH）中，应用启动时加载。
+应用运行时会在关闭时写快照覆盖导入结果，因此请在应用停止时导入，完成后再启动应用。
+本地测试可使用替身服务：python tmdb_stub.py export / serve（见 tmdb_stub.py）
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import signal
+import time
+import zlib
+from datetime import date, datetime
+from pathlib import Path
+from typing import AsyncIterator
+
+import httpx
+from fastapi import HTTPException
+
+from config import settings
+
+# TMDB 每日导出文件地址（日期格式为 月_日_年）
+EXPORT_URL = "https://files.tmdb.org/p/exports/movie_ids_{date:%m_%d_%Y}.json.gz"
+
+# 可以重试的错误：TMDB 限流、上游超时、网络错误
+RETRY_STATUS = (429, 503, 504)
+# 重试等待时间的上限（秒）
+MAX_RETRY_DELAY = 60
+
+
+async def iter_lines(source: str) -> AsyncIterator[str]:
+    """逐行读取导出文件（本地文件或 URL），不把整个文件读入内存"""
+    if not source.startswith(("http://", "https://")):
+        opener = gzip.open if source.endswith(".gz") else open
+        with opener(source, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield line
+        return
+
+    # 边下载边解压：32 + MAX_WBITS 自动识别 gzip 头
+    decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS) if source.endswith(".gz") else None
+    buffer = b""
+    async with httpx.AsyncClient(timeout=settings.TIMEOUT, follow_redirects=True) as client:
+        async with client.stream("GET", source) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_raw():
+                buffer += decompressor.decompress(chunk) if decompressor else chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    yield line.decode("utf-8")
+    if decompressor:
+        buffer += decompressor.flush()
+    if buffer:
+        yield buffer.decode("utf-8")
+
+
+def retry_delay(error: HTTPException, attempt: int) -> float:
+    """重试前等待的秒数：指数退避，TMDB 返回 Retry-After 时至少等待这么久"""
+    delay = 2 ** attempt
+    retry_after = (error.headers or {}).get("Retry-After")
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(delay, MAX_RETRY_DELAY)
+
+
+class Checkpoint:
+    """导入进度：行号之前的所有行都已处理（并发处理时取连续完成的部分）
+
+    重试后仍因限流、超时失败的电影记录在 pending 中（行号 → 电影 ID），行号照常前进，
+    下次运行时先重新获取这些电影，全部成功之前不算导入完成
+    """
+
+    def __init__(self, path: str, source: str):
+        self.path = Path(path)
+        self.source = source
+        self.line = 0
+        self.ingested = 0
+        self.failed = 0
+        self.skipped = 0
+        self.completed = False
+        self.pending: dict = {}
+        # 已完成但前面还有未完成行的行号
+        self._done: set = set()
+
+    def load(self) -> bool:
+        """读取同一来源的进度，没有时返回 False"""
+        if not self.path.exists():
+            return False
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        if data.get("source") != self.source:
+            return False
+        self.line = data["line"]
+        self.ingested = data["ingested"]
+        self.failed = data["failed"]
+        self.skipped = data["skipped"]
+        self.completed = data.get("completed", False)
+        self.pending = {int(line): movie_id for line, movie_id in data.get("pending", {}).items()}
+        return True
+
+    def done(self, line: int):
+        self._done.add(line)
+        while self.line in self._done:
+            self._done.remove(self.line)
+            self.line += 1
+
+    def state(self) -> dict:
+        return {
+            "source": self.source,
+            "line": self.line,
+            "ingested": self.ingested,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "completed": self.completed,
+            "pending": dict(self.pending),
+            "updated_at": datetime.now().isoformat(),
+        }
+
+    def save(self, state: dict):
+        """写入进度（先写临时文件再替换）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+async def fetch_detail(application, movie_id: int, retries: int) -> dict:
+    """获取电影详情（含演员），限流、上游超时或网络错误时按指数退避重试（遵守 Retry-After）"""
+    for attempt in range(retries + 1):
+        try:
+            return await application.fetch_from_tmdb(f"movie/{movie_id}", {"append_to_response": "credits"})
+        except HTTPException as e:
+            if e.status_code not in RETRY_STATUS or attempt == retries:
+                raise
+            await asyncio.sleep(retry_delay(e, attempt))
+
+
+async def ingest(args, source: str):
+    # 导入应用模块（标题索引、推荐索引、快照都在其中）；先加载已有快照，在其基础上追加
+    import main as application
+
+    if application.restore_snapshot() is not None:
+        await application.restore_recommender()
+    checkpoint = Checkpoint(args.checkpoint, source)
+    if not args.restart and checkpoint.load():
+        if checkpoint.completed:
+            print(f"✅ {source} 已导入完成（{checkpoint.ingested} 部），使用 --restart 重新导入")
+            return
+        print(f"↩️  从第 {checkpoint.line} 行继续（已导入 {checkpoint.ingested} 部，待重试 {len(checkpoint.pending)} 部）")
+    resume_line = checkpoint.line
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 4)
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, stop.set)
+    except NotImplementedError:
+        pass
+
+    async def produce():
+        # 先重新获取上次限流、超时失败的电影
+        for line_no, movie_id in sorted(checkpoint.pending.items()):
+            if stop.is_set():
+                return
+            await queue.put((line_no, movie_id))
+        line_no = -1
+        async for line in iter_lines(source):
+            line_no += 1
+            if stop.is_set() or (args.limit and line_no >= args.limit):
+                break
+            if line_no < resume_line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            if (
+                not item or "id" not in item
+                or (item.get("adult") and not args.include_adult)
+                or (item.get("popularity") or 0) < args.min_popularity
+            ):
+                checkpoint.skipped += 1
+                checkpoint.done(line_no)
+                continue
+            await queue.put((line_no, item["id"]))
+
+    async def work():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            line_no, movie_id = item
+            # 上次待重试的电影行号已在进度之前，不再标记完成
+            retrying = line_no < resume_line
+            try:
+                data = await fetch_detail(application, movie_id, args.retries)
+                application.convert_tmdb_to_douban_format(data, is_detail=True)
+                checkpoint.ingested += 1
+                checkpoint.pending.pop(line_no, None)
+            except HTTPException as e:
+                if e.status_code in RETRY_STATUS:
+                    # 限流、超时：留待下次运行重试，不计为失败
+                    checkpoint.pending[line_no] = movie_id
+                else:
+                    checkpoint.failed += 1
+                    checkpoint.pending.pop(line_no, None)
+                if args.verbose:
+                    print(f"⚠️  电影 {movie_id} 获取失败: {e.detail}")
+            if not retrying:
+                checkpoint.done(line_no)
+
+    async def save():
+        """保存快照后再保存进度：进度在复制索引的同时记录，进度之前的电影一定已在快照中"""
+        state = checkpoint.state()
+        await application.save_snapshot()
+        checkpoint.save(state)
+        print(f"💾 已保存快照和进度（第 {state['line']} 行）")
+
+    started = time.perf_counter()
+    start_count = checkpoint.ingested
+
+    def report():
+        elapsed = time.perf_counter() - started
+        rate = (checkpoint.ingested - start_count) / elapsed if elapsed else 0
+        print(
+            f"📥 第 {checkpoint.line} 行  导入 {checkpoint.ingested}  失败 {checkpoint.failed}  "
+            f"跳过 {checkpoint.skipped}  待重试 {len(checkpoint.pending)}  {rate:.1f} 部/秒  限速等待 {application.upstream.throttled_seconds:.1f} 秒"
+        )
+
+    async def monitor():
+        last_saved = checkpoint.ingested
+        last_report = time.perf_counter()
+        while True:
+            await asyncio.sleep(1)
+            if time.perf_counter() - last_report >= args.report_interval:
+                report()
+                last_report = time.perf_counter()
+            if checkpoint.ingested - last_saved >= args.checkpoint_every:
+                last_saved = checkpoint.ingested
+                await save()
+
+    workers = [asyncio.create_task(work()) for _ in range(args.concurrency)]
+    monitor_task = asyncio.create_task(monitor())
+    try:
+        await produce()
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        monitor_task.cancel()
+
+    checkpoint.completed = not stop.is_set() and not args.limit and not checkpoint.pending
+    await save()
+    report()
+    elapsed = time.perf_counter() - started
+    if checkpoint.pending and not stop.is_set():
+        print(f"⏳ {len(checkpoint.pending)} 部电影因限流或超时未能获取，再次运行时重试")
+    print(f"{'✅ 导入完成' if checkpoint.completed else '⏸️  已暂停'}，耗时 {elapsed:.1f} 秒，索引共 {len(application.title_index)} 部电影")
+    await application.upstream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从 TMDB 电影 ID 导出文件批量导入电影")
+    parser.add_argument("source", nargs="?", help="导出文件路径或 URL（.gz 或未压缩）")
+    parser.add_argument("--date", type=date.fromisoformat, help="下载 TMDB 指定日期（YYYY-MM-DD）的导出文件")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时请求的详情数量")
+    parser.add_argument("--checkpoint", default=str(Path(__file__).parent / "data" / "ingest_checkpoint.json"))
+    parser.add_argument("--checkpoint-every", type=int, default=5000, help="每导入多少部电影保存一次快照和进度")
+    parser.add_argument("--report-interval", type=float, default=10, help="输出进度的间隔（秒）")
+    parser.add_argument("--min-popularity", type=float, default=0, help="只导入热度不低于该值的电影")
+    parser.add_argument("--include-adult", action="store_true", help="导入成人内容")
+    parser.add_argument("--limit", type=int, default=0, help="只处理前多少行（测试用）")
+    parser.add_argument("--retries", type=int, default=4, help="限流、上游超时或网络错误时的重试次数（仍失败的电影下次运行时重试）")
+    parser.add_argument("--restart", action="store_true", help="忽略进度，从头导入")
+    parser.add_argument("--verbose", action="store_true", help="输出每个失败的电影")
+    args = parser.parse_args()
+
+    if not args.source and not args.date:
+        parser.error("需要指定导出文件或 --date")
+    if not settings.SNAPSHOT_PATH:
+        parser.error("导入结果保存在快照中，请设置 SNAPSHOT_PATH")
+    if settings.USE_MOCK_DATA:
+        parser.error("模拟数据模式下无法导入，请关闭 USE_MOCK_DATA（可使用 tmdb_stub.py 替身服务）")
+
+    source = args.source or EXPORT_URL.format(date=args.date)
+    asyncio.run(ingest(args, source))
+
+
+if __name__ == "__main__":
+    main()
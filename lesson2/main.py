@@ -3,24 +3,124 @@
 完整功能: 搜索、详情、热门电影、正在上映、即将上映、收藏系统、统计分析
 """
 
-from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Dict
 import httpx
 from pathlib import Path
+import asyncio
 import json
+import os
+import time
+import tracemalloc
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache, partial
 from datetime import datetime
+from urllib.parse import urlencode
 from config import settings  # 导入配置
+from admission import AdmissionGate, AdmissionMiddleware, parse_route_limits
+from cache import TTLCache
+from change_feed import MAX_WINDOW_DAYS, iter_changed_ids, run_batches
+from discover import DISCOVER_SORTS, discover
+from disconnect import DisconnectMiddleware
+from favorites_store import FavoritesStore
+from memory import MemoryBudget, top_allocations
+from peer_cache import PeerError, PeerGroup, parse_peers
+from rate_limit import SharedSlidingWindowLimiter, SlidingWindowLimiter, client_key, parse_tokens, retry_after_header
+from recommend import Recommender, credit_weights
+from search_history import SearchHistory, SharedSearchHistory
+from shared_state import LocalBackend, create_backend
+from snapshot import BlobList, decode_json, encode_blobs, encode_json, open_snapshot, write_snapshot
+from title_index import TitleIndex, normalize_text
+from upstream import UpstreamPool
+from suggest import SuggestTrie, encode_suggestions
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用启动和关闭时执行的操作"""
+    if settings.MEMORY_TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(settings.MEMORY_TRACEMALLOC_FRAMES)
+    snapshot = restore_snapshot()
+    if snapshot is not None:
+        # 搜索建议在后台分批恢复，推荐索引在线程中重新构建，都不阻塞启动
+        asyncio.create_task(restore_suggestions(snapshot))
+        asyncio.create_task(restore_recommender())
+    await load_history_suggestions()
+    saver = asyncio.create_task(save_snapshot_periodically()) if settings.SNAPSHOT_INTERVAL > 0 else None
+    poller = (
+        asyncio.create_task(poll_changes_periodically())
+        if settings.CHANGES_POLL_INTERVAL > 0 and not settings.USE_MOCK_DATA else None
+    )
+    yield
+    for task in (saver, poller, *prefetch_tasks):
+        if task is not None:
+            task.cancel()
+    await save_snapshot()
+    await search_history.flush()
+    if peer_group is not None:
+        await peer_group.close()
+    await upstream.close()
+
 
 app = FastAPI(
     title="TMDB 电影搜索系统",
     description="完整的 TMDB 电影搜索和收藏Web应用",
-    version="2.0"
+    version="2.0",
+    lifespan=lifespan
+)
+
+# ========== 准入控制（按路由限制并发） ==========
+
+# 需要请求 TMDB 的路由与只读本地数据的路由使用不同的并发池，上游变慢时本地路由不受影响
+# 页面、静态文件和 /api/metrics 不受限制
+UPSTREAM_ROUTES = (
+    "search_movies", "get_movie_detail", "internal_movie_detail", "get_top250", "get_in_theaters",
+    "get_coming_soon", "get_home", "stream_top250", "stream_search", "add_favorite",
+)
+LOCAL_ROUTES = (
+    "suggest", "discover_movies", "get_recommendations", "remove_favorite", "get_favorites",
+    "get_stats", "get_search_history", "get_trending_searches",
 )
 
+admission_gates = {
+    "upstream": AdmissionGate(
+        "upstream", settings.ADMISSION_UPSTREAM_LIMIT, settings.ADMISSION_UPSTREAM_QUEUE_TIMEOUT,
+        max_queue=settings.ADMISSION_MAX_QUEUE
+    ),
+    "local": AdmissionGate(
+        "local", settings.ADMISSION_LOCAL_LIMIT, settings.ADMISSION_LOCAL_QUEUE_TIMEOUT,
+        max_queue=settings.ADMISSION_MAX_QUEUE
+    ),
+}
+route_gates = {name: admission_gates["upstream"] for name in UPSTREAM_ROUTES}
+route_gates.update((name, admission_gates["local"]) for name in LOCAL_ROUTES)
+
+# 单独限制的路由使用自己的并发池，未指定排队时间时沿用所属并发池的设置
+for route_name, (limit, queue_timeout) in parse_route_limits(settings.ADMISSION_ROUTES).items():
+    if route_name not in route_gates:
+        raise ValueError(f"⚠️  ADMISSION_ROUTES 中的路由不存在或不受限制: {route_name}")
+    pool = route_gates[route_name]
+    route_gates[route_name] = admission_gates[route_name] = AdmissionGate(
+        route_name, limit, pool.queue_timeout if queue_timeout is None else queue_timeout,
+        max_queue=settings.ADMISSION_MAX_QUEUE
+    )
+
+def record_disconnect():
+    metrics["client_disconnects"] += 1
+
+
+# 客户端提前断开时取消请求 TMDB 的路由，不再等待上游和转换数据（在准入控制之内，取消完成后才归还名额）
+if settings.CANCEL_ON_DISCONNECT:
+    app.add_middleware(
+        DisconnectMiddleware, routes=lambda: app.router.routes, names=UPSTREAM_ROUTES, on_disconnect=record_disconnect
+    )
+app.add_middleware(AdmissionMiddleware, routes=lambda: app.router.routes, resolve=route_gates.get)
+
 # ========== 配置静态文件和模板 ==========
 
 # 获取当前文件所在目录
@@ -58,11 +158,415 @@ for i in range(20):
 
 # ========== 简单的内存存储 ==========
 
-# 用户收藏的电影（简单版，使用内存存储）
-favorites: Dict[str, dict] = {}
+# 用户收藏的电影（SQLite 持久化，重启和多进程下数据一致）
+favorites_store = FavoritesStore(settings.FAVORITES_DB)
+
+# 共享状态后端（缓存、搜索历史）：local 只在本进程有效，sqlite/redis 在多个 worker 之间共享
+state_backend = create_backend(
+    settings.STATE_BACKEND, settings.STATE_URL, settings.STATE_DB, maxsize=settings.CACHE_MAX_ENTRIES
+)
+
+# 搜索历史：单进程使用环形缓冲区 + 追加日志，多进程保存在共享状态后端
+if settings.STATE_BACKEND == "local":
+    search_history = SearchHistory(
+        settings.SEARCH_HISTORY_LOG,
+        capacity=settings.SEARCH_HISTORY_SIZE,
+        top_k=settings.TRENDING_TOP_K,
+        max_log_bytes=settings.SEARCH_HISTORY_LOG_MAX_KB * 1024
+    )
+else:
+    search_history = SharedSearchHistory(
+        state_backend,
+        capacity=settings.SEARCH_HISTORY_SIZE,
+        top_k=settings.TRENDING_TOP_K
+    )
+
+# TMDB 连接池和限速（所有上游请求共用）
+upstream = UpstreamPool(
+    settings.TMDB_RATE_LIMIT,
+    settings.TMDB_BURST,
+    max_connections=settings.TMDB_MAX_CONNECTIONS,
+    timeout=settings.TIMEOUT
+)
+
+# 运行指标计数（通过 /api/metrics 查看）
+metrics: Counter = Counter()
+
+# 本地标题索引（收录所有转换过的电影，用于本地搜索）
+title_index = TitleIndex()
+
+# 推荐索引（文档编号与标题索引一致）
+recommender = Recommender(settings.RECOMMEND_ANN_MIN_SIZE, settings.RECOMMEND_ANN_PROBES)
+
+# 搜索建议前缀树（电影标题 + 热门搜索关键词）
+suggest_trie = SuggestTrie(
+    k=settings.SUGGEST_TOP_K, max_depth=settings.SUGGEST_MAX_PREFIX, max_keywords=settings.SUGGEST_MAX_KEYWORDS
+)
+
+# 电影详情缓存（多实例时只缓存本实例负责的电影）：STATE_BACKEND 为 sqlite/redis 时保存在共享状态后端，
+# 所有 worker 共用；local 时为本进程单独的缓存，与搜索缓存分别计算容量
+detail_cache = (
+    LocalBackend(maxsize=settings.CACHE_MAX_ENTRIES) if isinstance(state_backend, LocalBackend) else state_backend
+)
+# 变更列表只能查询最近 MAX_WINDOW_DAYS 天：详情缓存时间不超过这个范围，更早缓存的详情都已过期
+DETAIL_TTL = min(settings.DETAIL_CACHE_TTL, MAX_WINDOW_DAYS * 86400)
+
+
+def detail_key(key: str) -> str:
+    """详情在缓存中的键（电影 ID，非默认语言带语言后缀）"""
+    return f"detail:{key}"
+
+
+# 多实例分片：配置了 PEERS 时，每部电影只由哈希环上的一个实例向 TMDB 请求
+peer_group = PeerGroup(
+    settings.SELF_URL,
+    parse_peers(settings.PEERS),
+    replicas=settings.PEER_REPLICAS,
+    hot_size=settings.PEER_HOT_CACHE_SIZE,
+    hot_ttl=settings.PEER_HOT_TTL,
+    timeout=settings.TIMEOUT,
+    secret=settings.PEER_SECRET
+) if settings.PEERS else None
+
+# ========== fork 之后重新打开连接 ==========
+
+def reset_after_fork():
+    """server.py 在主进程中导入并预热后 fork 出 worker：worker 不能继续使用父进程打开的数据库连接、
+    Redis 连接、HTTP 连接和日志文件，fork 后立即丢弃，之后在 worker 中重新打开"""
+    favorites_store.after_fork()
+    state_backend.after_fork()
+    search_history.after_fork()
+    upstream.after_fork()
+    if peer_group is not None:
+        peer_group.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+# ========== 客户端限流 ==========
+
+def create_limiter(name: str, limit: int):
+    """共享状态后端为 sqlite/redis 且开启 RATE_LIMIT_SHARED 时所有 worker 共用计数，否则每个进程单独计数"""
+    if settings.RATE_LIMIT_SHARED and settings.STATE_BACKEND != "local":
+        return SharedSlidingWindowLimiter(state_backend, name, limit, settings.RATE_LIMIT_WINDOW)
+    return SlidingWindowLimiter(limit, settings.RATE_LIMIT_WINDOW, settings.RATE_LIMIT_MAX_CLIENTS)
+
+
+# 按 Token 计数的 API Token（摘要）
+rate_limit_tokens = parse_tokens(settings.RATE_LIMIT_API_TOKENS)
+
+# 会请求 TMDB 的接口按客户端限流（每个接口单独计数）
+rate_limiters = {
+    "search": create_limiter("search", settings.RATE_LIMIT_SEARCH),
+    "detail": create_limiter("detail", settings.RATE_LIMIT_DETAIL),
+    "favorite": create_limiter("favorite", settings.RATE_LIMIT_FAVORITE),
+}
+
+
+def rate_limit(name: str):
+    """路由依赖：客户端超出限制时返回 429 和 Retry-After"""
+    limiter = rate_limiters[name]
+    shared = isinstance(limiter, SharedSlidingWindowLimiter)
+    
+    async def check(request: Request):
+        if limiter.limit <= 0:
+            return
+        client = client_key(
+            request.headers, request.client.host if request.client else None, settings.RATE_LIMIT_TRUST_PROXY,
+            rate_limit_tokens
+        )
+        try:
+            wait = await limiter.hit(client) if shared else limiter.hit(client)
+        except Exception as e:
+            # 共享状态后端出错（连接断开、SQLite 被锁、Redis 错误回复等）时放行，不影响正常请求
+            print(f"⚠️  限流计数失败: {type(e).__name__}: {e}")
+            metrics["rate_limit_errors"] += 1
+            return
+        if wait > 0:
+            metrics["rate_limited"] += 1
+            metrics[f"rate_limited_{name}"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail={"error": "请求过于频繁", "message": f"请 {retry_after_header(wait)} 秒后重试"},
+                headers={"Retry-After": retry_after_header(wait)}
+            )
+    
+    return Depends(check)
+
+
+# 搜索关键词在建议中的得分权重：搜索一次约等于 1000 人评价
+HISTORY_SUGGEST_WEIGHT = 1000
+
+
+async def load_history_suggestions():
+    """启动时把热门搜索关键词加入搜索建议"""
+    for item in await search_history.trending_searches(settings.TRENDING_TOP_K):
+        suggest_trie.add(item["keyword"], item["count"] * HISTORY_SUGGEST_WEIGHT, keyword=True)
+
+
+# ========== 内存预算 ==========
+
+# 缓存写入时检查进程内存储的估算总量，超出预算时从占用最大的缓存中淘汰最久未使用的条目
+memory_budget = MemoryBudget(int(settings.MEMORY_BUDGET_MB * 1024 * 1024), settings.MEMORY_MEASURE_INTERVAL)
+if isinstance(state_backend, LocalBackend):
+    memory_budget.add_cache("detail_cache", detail_cache.values)
+    memory_budget.add_cache("search_cache", state_backend.values)
+if peer_group is not None:
+    memory_budget.add_cache("peer_hot_cache", peer_group.hot)
+if isinstance(state_backend, LocalBackend):
+    memory_budget.add_store("state_backend", state_backend.approx_bytes)
+if isinstance(search_history, SearchHistory):
+    memory_budget.add_store("search_history", search_history.approx_bytes)
+memory_budget.add_store("title_index", title_index.approx_bytes)
+memory_budget.add_store("recommender", recommender.approx_bytes)
+memory_budget.add_store("suggest_trie", suggest_trie.approx_bytes)
+memory_budget.add_store("rate_limiters", lambda: sum(
+    limiter.approx_bytes() for limiter in rate_limiters.values() if isinstance(limiter, SlidingWindowLimiter)
+))
+
+
+# ========== 快照（重启后保留缓存和索引） ==========
+
+snapshot_state = {"loaded": False, "restored": False, "signature": None}
+
+
+def snapshot_caches() -> Dict[str, TTLCache]:
+    """需要写入快照的缓存（共享状态后端为 sqlite/redis 时详情缓存和搜索缓存本身已持久化）"""
+    if not isinstance(state_backend, LocalBackend):
+        return {}
+    return {"cache.detail": detail_cache.values, "cache.search": state_backend.values}
+
+
+def snapshot_signature() -> tuple:
+    """内容没有变化时不重复写快照（搜索建议随标题索引一起变化）"""
+    return (
+        title_index.updates,
+        recommender.updates,
+        metrics["detail_upstream_fetches"],
+        metrics["upstream_requests"],
+    )
+
+
+def write_snapshot_file(index: TitleIndex, suggestions: tuple, credits: list, caches: Dict[str, list], changes_since: float):
+    """在线程中编码并写入快照（参数是在事件循环中复制好的数据）"""
+    sections = {"meta": encode_json({
+        "created_at": datetime.now().isoformat(),
+        "movies": len(index),
+        "changes_since": changes_since,
+    })}
+    sections.update(index.dump_snapshot())
+    sections.update(encode_suggestions(*suggestions))
+    sections["recommend.credits"] = encode_json(credits)
+    for name, entries in caches.items():
+        sections[name] = encode_blobs(map(encode_json, entries))
+    write_snapshot(settings.SNAPSHOT_PATH, sections)
+
+
+async def save_snapshot():
+    """写入快照：在事件循环中浅复制（不会与索引更新同时进行），在线程中编码和写文件"""
+    if not settings.SNAPSHOT_PATH:
+        return
+    signature = snapshot_signature()
+    if signature == snapshot_state["signature"]:
+        return
+    
+    index = title_index.copy()
+    suggestions = suggest_trie.export()
+    credits = dump_recommender_credits()
+    caches = {name: cache.dump() for name, cache in snapshot_caches().items()}
+    try:
+        await asyncio.to_thread(write_snapshot_file, index, suggestions, credits, caches, changes_state["since"])
+    except OSError as e:
+        print(f"⚠️  写入快照失败: {e}")
+        return
+    snapshot_state["signature"] = signature
+    metrics["snapshots_written"] += 1
+
+
+async def save_snapshot_periodically():
+    while True:
+        await asyncio.sleep(settings.SNAPSHOT_INTERVAL)
+        await save_snapshot()
+
+
+def restore_snapshot():
+    """启动时加载快照（每个进程只加载一次，预热时已加载的 worker 不再加载）
+
+    标题索引直接引用映射的文件，按需解码；缓存条目数量有上限，直接恢复
+    """
+    if snapshot_state["loaded"] or not settings.SNAPSHOT_PATH:
+        return None
+    snapshot_state["loaded"] = True
+    
+    snapshot = open_snapshot(settings.SNAPSHOT_PATH)
+    if snapshot is None:
+        return None
+    
+    # 快照中的缓存只包含变更水位线之前的修改，从水位线继续读取变更列表
+    meta = decode_json(snapshot.section("meta"))
+    changes_state["since"] = meta.get("changes_since") or datetime.fromisoformat(meta["created_at"]).timestamp()
+    title_index.load_snapshot(snapshot)
+    # 推荐向量之后由 restore_recommender 在线程中批量计算，这里只读取演职员
+    credits = snapshot.section("recommend.credits")
+    recommender_state["credits"] = decode_json(credits) if credits is not None else []
+    recommender_state["pending"] = {}
+    for name, cache in snapshot_caches().items():
+        section = snapshot.section(name)
+        if section is not None:
+            cache.load(decode_json(entry) for entry in BlobList(section))
+    
+    snapshot_state["restored"] = True
+    snapshot_state["signature"] = snapshot_signature()
+    print(f"💾 已加载快照: {len(title_index)} 部电影（{snapshot.size / 1024 / 1024:.1f} MB）")
+    return snapshot
+
+
+async def restore_suggestions(snapshot):
+    """分批恢复搜索建议，每批之间让出事件循环"""
+    for _ in suggest_trie.restore(snapshot):
+        await asyncio.sleep(0)
 
-# 搜索历史
-search_history: List[dict] = []
+
+# 从快照恢复推荐索引：credits 为快照中的演职员，pending 为恢复期间加入或更新的电影（文档编号 → 电影），
+# 不在恢复中时 pending 为 None
+recommender_state = {"credits": None, "pending": None}
+
+
+async def restore_recommender():
+    """在线程中由目录的列批量计算推荐向量并聚类，完成后在事件循环中替换推荐索引，再补上恢复期间加入的电影
+
+    目录很大时耗时较长，期间 /api/recommendations 返回热门电影，启动不必等待
+    """
+    if recommender_state["pending"] is None:
+        return
+    catalog = title_index.movies.copy()
+    credits = recommender_state["credits"]
+    rebuilt = Recommender(settings.RECOMMEND_ANN_MIN_SIZE, settings.RECOMMEND_ANN_PROBES)
+    
+    def build():
+        rebuilt.rebuild(catalog, credits)
+        if rebuilt.needs_training:
+            rebuilt.train_now()
+    
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(build)
+    except Exception as e:
+        # 构建失败：从空索引开始，之后加入的电影照常收录
+        print(f"⚠️  恢复推荐索引失败: {type(e).__name__}: {e}")
+        rebuilt = Recommender(settings.RECOMMEND_ANN_MIN_SIZE, settings.RECOMMEND_ANN_PROBES)
+    
+    pending = recommender_state["pending"]
+    recommender.load_from(rebuilt)
+    recommender_state["pending"] = recommender_state["credits"] = None
+    for doc, movie in pending.items():
+        recommender.add(doc, movie)
+    recommender.schedule_training()
+    print(f"💾 已恢复推荐索引: {len(recommender)} 部电影，耗时 {time.perf_counter() - start:.2f} 秒")
+
+
+def dump_recommender_credits() -> list:
+    """写快照用的演职员：恢复推荐索引期间使用快照中的数据，加上恢复期间加入的电影"""
+    pending = recommender_state["pending"]
+    if pending is None:
+        return recommender.dump_credits()
+    credits = dict(recommender_state["credits"])
+    for doc, movie in pending.items():
+        weights = credit_weights(movie)
+        if weights:
+            credits[doc] = weights
+    return [[doc, weights] for doc, weights in credits.items()]
+
+
+# ========== 变更订阅（TMDB 上修改过的电影及时刷新） ==========
+
+# 水位线：此前 TMDB 上的修改都已反映到本进程的缓存中（没有快照时缓存为空，从启动时算起）
+changes_state = {"since": time.time()}
+
+
+async def cached_before(movie_id: str, timestamp: float) -> bool:
+    """电影详情是否在该时间之前缓存（缓存时间 = 过期时间 - 缓存时长）"""
+    expires_at = await detail_cache.expires_at(detail_key(movie_id))
+    return expires_at is not None and expires_at - DETAIL_TTL < timestamp
+
+
+async def poll_changes():
+    """读取水位线以来有变更的电影，刷新本进程缓存中过时的详情和收藏中保存的数据
+
+    变更列表只能按天查询：水位线之后缓存的详情视为最新，同一天稍后的修改在下次读取时仍会出现在列表中
+    """
+    started = time.time()
+    since = changes_state["since"]
+    horizon = started - MAX_WINDOW_DAYS * 86400
+    if since < horizon:
+        # 超出变更列表的查询范围（如加载了很久以前的快照）：缓存时间不超过查询范围，更早缓存的详情都已过期
+        since = horizon
+    
+    changed = set()
+    async for ids in iter_changed_ids(fetch_from_tmdb, since, started):
+        changed.update(ids)
+    metrics["changes_polls"] += 1
+    metrics["changes_seen"] += len(changed)
+    
+    # 其它语言的详情不刷新，直接删除，下次访问时重新获取
+    other_keys = [language_key(movie_id, language) for movie_id in changed for language in extra_languages]
+    for key in other_keys:
+        await detail_cache.delete(detail_key(key))
+    if peer_group is not None:
+        for key in [*changed, *other_keys]:
+            peer_group.hot.delete(key)
+    
+    stale = {movie_id for movie_id in changed if await cached_before(movie_id, since)}
+    favorited = await favorites_store.favorited(changed)
+    if settings.CHANGES_MODE == "invalidate":
+        for movie_id in stale:
+            await detail_cache.delete(detail_key(movie_id))
+        metrics["changes_invalidated"] += len(stale)
+        targets = sorted(favorited)
+    else:
+        targets = sorted(stale | favorited)
+    
+    async def refresh(movie_id: str) -> dict:
+        # 水位线之后缓存的详情已是最新，收藏直接使用
+        data = None if movie_id in stale else await detail_cache.get(detail_key(movie_id))
+        if data is None:
+            data = await fetch_from_tmdb(f"movie/{movie_id}", {"append_to_response": "credits"})
+            metrics["changes_refreshed"] += 1
+            await detail_cache.set(detail_key(movie_id), data, DETAIL_TTL)
+        return data
+    
+    movies = {}
+    results = await run_batches(targets, refresh, settings.CHANGES_BATCH_SIZE, settings.CHANGES_BATCH_PAUSE)
+    for movie_id, result in zip(targets, results):
+        if isinstance(result, Exception):
+            # 获取失败（电影已删除、上游超时等）：删除过时的缓存，下次访问时再获取
+            await detail_cache.delete(detail_key(movie_id))
+            metrics["changes_failed"] += 1
+            continue
+        # 重新转换同时更新标题索引和推荐索引
+        movie = convert_tmdb_to_douban_format(result, is_detail=True)
+        if movie_id in favorited:
+            movies[movie_id] = movie
+    if movies:
+        metrics["favorites_refreshed"] += await favorites_store.refresh(movies)
+    changes_state["since"] = started
+
+
+async def poll_changes_periodically():
+    while True:
+        await asyncio.sleep(settings.CHANGES_POLL_INTERVAL)
+        try:
+            await poll_changes()
+        except HTTPException as e:
+            # 变更列表获取失败：水位线不变，下次重新读取
+            print(f"⚠️  读取 TMDB 变更列表失败: {e.detail}")
+            metrics["changes_poll_errors"] += 1
+        except Exception as e:
+            # 其它错误（收藏数据库出错等）同样保留水位线，不能让轮询任务就此退出（取消时 CancelledError 照常传播）
+            print(f"⚠️  处理 TMDB 变更失败: {type(e).__name__}: {e}")
+            metrics["changes_poll_errors"] += 1
 
 
 # ========== 数据模型 ==========
@@ -193,27 +697,71 @@ def get_mock_data(endpoint: str, params: dict = None) -> dict:
     return {'results': [], 'page': 1, 'total_results': 0, 'total_pages': 0}
 
 
-async def fetch_from_tmdb(endpoint: str, params: dict = None) -> dict:
-    """从 TMDB API 获取数据"""
+class InflightRequest:
+    """进行中的上游请求，记录共享这次请求的调用方数量"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+# 进行中的上游请求：相同的请求只发一次，其它调用方共享结果
+inflight_requests: Dict[str, InflightRequest] = {}
+
+
+def remove_inflight(key: str, entry: InflightRequest):
+    """移除已结束或已取消的上游请求（不影响同名的新请求）"""
+    if inflight_requests.get(key) is entry:
+        del inflight_requests[key]
+
+
+async def fetch_from_tmdb(endpoint: str, params: dict = None, language: Optional[str] = None) -> dict:
+    """从 TMDB API 获取数据，language 默认为 DEFAULT_LANGUAGE
+    
+    相同的请求同时只会发出一次；所有调用方都取消后，上游请求也会被取消
+    """
     # 如果使用模拟数据，直接返回
     if settings.USE_MOCK_DATA:
         print(f"📊 使用模拟数据: {endpoint}")
         return get_mock_data(endpoint, params)
     
-    url = settings.get_api_url(endpoint)
+    # 添加语言参数（API Key 在实际请求时添加）
+    params = dict(params or {})
+    params['language'] = language or settings.DEFAULT_LANGUAGE
+    key = request_key(endpoint, params)
     
-    # 添加 API Key 和中文语言参数
-    if params is None:
-        params = {}
-    params['api_key'] = settings.TMDB_API_KEY
-    params['language'] = 'zh-CN'  # 获取中文数据
+    entry = inflight_requests.get(key)
+    if entry is None:
+        entry = InflightRequest(asyncio.create_task(request_tmdb(endpoint, params)))
+        inflight_requests[key] = entry
+        entry.task.add_done_callback(lambda _: remove_inflight(key, entry))
+        metrics["upstream_requests"] += 1
+    else:
+        metrics["upstream_coalesced"] += 1
     
+    entry.waiters += 1
     try:
-        async with httpx.AsyncClient(timeout=settings.TIMEOUT, follow_redirects=True) as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            return data
+        # shield: 单个调用方被取消时不影响其它调用方
+        return await asyncio.shield(entry.task)
+    except asyncio.CancelledError:
+        if entry.waiters == 1 and not entry.task.done():
+            entry.task.cancel()
+            remove_inflight(key, entry)
+            metrics["upstream_cancelled"] += 1
+        raise
+    finally:
+        entry.waiters -= 1
+
+
+async def request_tmdb(endpoint: str, params: dict) -> dict:
+    """实际请求 TMDB API，并把网络错误转换为 HTTP 错误"""
+    url = settings.get_api_url(endpoint)
+    params = {**params, 'api_key': settings.TMDB_API_KEY}
+    
+    try:
+        response = await upstream.get(url, params)
+        response.raise_for_status()
+        return response.json()
     except httpx.TimeoutException:
         print(f"❌ 请求超时: {url}")
         raise HTTPException(
@@ -222,6 +770,14 @@ async def fetch_from_tmdb(endpoint: str, params: dict = None) -> dict:
         )
     except httpx.HTTPStatusError as e:
         print(f"❌ HTTP错误: {e.response.status_code} - {url}")
+        if e.response.status_code == 429:
+            # TMDB 限流：保留 429 和 Retry-After，调用方（如批量导入）可以等待后重试
+            retry_after = e.response.headers.get("retry-after", "1")
+            raise HTTPException(
+                status_code=429,
+                detail={"error": "TMDB 请求过于频繁", "message": f"请 {retry_after} 秒后重试"},
+                headers={"Retry-After": retry_after}
+            )
         raise HTTPException(
             status_code=502, 
             detail={"error": "API请求失败", "message": f"TMDB API返回错误: {e.response.status_code}"}
@@ -240,8 +796,262 @@ async def fetch_from_tmdb(endpoint: str, params: dict = None) -> dict:
         )
 
 
-def convert_tmdb_to_douban_format(tmdb_movie: dict, is_detail: bool = False) -> dict:
-    """将 TMDB 格式转换为前端兼容格式"""
+# TMDB 详情API：/movie/{id}，追加演员信息
+DETAIL_PARAMS = {"append_to_response": "credits"}
+
+
+async def load_movie_detail(movie_id: str, language: Optional[str] = None) -> dict:
+    """由本实例向 TMDB 获取电影详情（含演员信息），结果按语言分别缓存"""
+    language = language or settings.DEFAULT_LANGUAGE
+    key = detail_key(language_key(movie_id, language))
+    data = await detail_cache.get(key)
+    if data is not None:
+        metrics["detail_cache_hits"] += 1
+        return data
+    
+    data = await fetch_from_tmdb(f"movie/{movie_id}", DETAIL_PARAMS, language)
+    metrics["detail_upstream_fetches"] += 1
+    await detail_cache.set(key, data, DETAIL_TTL)
+    return data
+
+
+async def fetch_movie_detail(movie_id: str, language: Optional[str] = None) -> dict:
+    """获取电影详情：本实例负责的直接获取，否则向所有者实例获取；所有者不可用时直接请求 TMDB"""
+    language = language or settings.DEFAULT_LANGUAGE
+    if peer_group is None or peer_group.is_owner(movie_id):
+        return await load_movie_detail(movie_id, language)
+    
+    key = language_key(movie_id, language)
+    data = peer_group.hot.get(key)
+    if data is not None:
+        metrics["peer_hot_hits"] += 1
+        return data
+    
+    owner = peer_group.owner(movie_id)
+    path = f"/internal/movie/{movie_id}"
+    if language != settings.DEFAULT_LANGUAGE:
+        path += f"?lang={language}"
+    try:
+        status_code, data = await peer_group.fetch(owner, path)
+    except PeerError as e:
+        print(f"⚠️  实例不可用，直接请求 TMDB: {e}")
+        metrics["peer_fallbacks"] += 1
+        return await load_movie_detail(movie_id, language)
+    
+    metrics["peer_fetches"] += 1
+    if status_code != 200:
+        # 所有者返回的错误（电影不存在、上游超时等）原样传递
+        raise HTTPException(status_code=status_code, detail=data.get("detail", "获取电影详情失败"))
+    peer_group.hot.set(key, data, peer_group.hot_ttl)
+    return data
+
+
+# ========== 多语言 ==========
+
+# lang 参数：ISO 639-1 语言代码，可带 ISO 3166-1 地区代码
+LANGUAGE_PATTERN = r"^[a-z]{2}(-[A-Z]{2})?$"
+LANGUAGE_DESCRIPTION = "语言，如 zh-CN、en-US、ja-JP（不传时使用 DEFAULT_LANGUAGE，只能是 SUPPORTED_LANGUAGES 中的语言）"
+# 缺少翻译时 TMDB 返回空字符串的字段
+LOCALIZED_FIELDS = ("title", "overview")
+# 记录的需要补全的请求数量上限
+FALLBACK_HINT_SIZE = 10000
+
+# 允许的语言（默认语言和备用语言总是允许）
+SUPPORTED_LANGUAGES = frozenset(
+    {language.strip() for language in settings.SUPPORTED_LANGUAGES.split(",") if language.strip()}
+    | {settings.DEFAULT_LANGUAGE}
+    | ({settings.FALLBACK_LANGUAGE} if settings.FALLBACK_LANGUAGE else set())
+)
+
+# 最近一次需要补全的请求：再次请求时两种语言同时获取
+fallback_hints: "OrderedDict[str, None]" = OrderedDict()
+# 其它语言（这些语言的详情不随变更订阅刷新，有变更时直接删除）
+extra_languages = sorted(SUPPORTED_LANGUAGES - {settings.DEFAULT_LANGUAGE})
+
+
+def resolve_language(lang: Optional[str]) -> str:
+    """lang 参数对应的语言；不在 SUPPORTED_LANGUAGES 中时返回 400"""
+    language = lang or settings.DEFAULT_LANGUAGE
+    if language not in SUPPORTED_LANGUAGES:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "不支持的语言", "message": f"lang 只能是: {', '.join(sorted(SUPPORTED_LANGUAGES))}"}
+        )
+    return language
+
+
+def language_key(key: str, language: str) -> str:
+    """按语言区分的缓存键：默认语言不加后缀（与变更订阅、快照、预取共用原来的键），其它语言加 @语言"""
+    return key if language == settings.DEFAULT_LANGUAGE else f"{key}@{language}"
+
+
+def request_key(endpoint: str, params: dict) -> str:
+    return f"{endpoint}?{urlencode(sorted(params.items()))}"
+
+
+def missing_translation(movie: dict) -> bool:
+    return any(not movie.get(field) for field in LOCALIZED_FIELDS)
+
+
+def needs_fallback(data: dict) -> bool:
+    """详情缺少翻译，或列表中有电影缺少翻译"""
+    if "results" in data:
+        return any(missing_translation(item) for item in data["results"])
+    return missing_translation(data)
+
+
+def merge_translation(movie: dict, fallback: Optional[dict]) -> dict:
+    """用备用语言的文本填充空字段（返回新字典，不修改缓存中的数据）"""
+    if not fallback or not missing_translation(movie):
+        return movie
+    merged = dict(movie)
+    for field in LOCALIZED_FIELDS:
+        if not merged.get(field) and fallback.get(field):
+            merged[field] = fallback[field]
+    return merged
+
+
+def merge_localized(data: dict, fallback: dict) -> dict:
+    """合并详情或列表（列表按电影 ID 对应）"""
+    if "results" in data:
+        by_id = {item.get("id"): item for item in fallback.get("results", [])}
+        return {**data, "results": [merge_translation(item, by_id.get(item.get("id"))) for item in data["results"]]}
+    return merge_translation(data, fallback)
+
+
+async def fetch_fallback(endpoint: str, params: dict, language: str) -> dict:
+    """备用语言的数据，翻译很少变化，缓存 FALLBACK_CACHE_TTL 秒（只用到文本字段，详情不附带演员信息）"""
+    params = {key: value for key, value in params.items() if key != "append_to_response"}
+    cache_key = "fallback:" + request_key(endpoint, {**params, "language": language})
+    data = await state_backend.get(cache_key)
+    if data is not None:
+        metrics["language_fallback_cache_hits"] += 1
+        return data
+    data = await fetch_from_tmdb(endpoint, params, language)
+    await state_backend.set(cache_key, data, settings.FALLBACK_CACHE_TTL)
+    return data
+
+
+async def localize(data: dict, endpoint: str, params: dict, language: str, fallback: Optional[dict] = None) -> dict:
+    """主语言缺少翻译时用备用语言补全；备用语言获取失败时返回主语言的数据"""
+    fallback_language = settings.FALLBACK_LANGUAGE
+    if not fallback_language or fallback_language == language:
+        return data
+    
+    metrics["language_requests"] += 1
+    hint = request_key(endpoint, {**params, "language": language})
+    if not needs_fallback(data):
+        fallback_hints.pop(hint, None)
+        return data
+    
+    metrics["language_fallbacks"] += 1
+    fallback_hints[hint] = None
+    fallback_hints.move_to_end(hint)
+    while len(fallback_hints) > FALLBACK_HINT_SIZE:
+        fallback_hints.popitem(last=False)
+    
+    if fallback is None:
+        try:
+            fallback = await fetch_fallback(endpoint, params, fallback_language)
+        except HTTPException as e:
+            print(f"⚠️  获取备用语言数据失败: {e.detail}")
+            metrics["language_fallback_failed"] += 1
+            return data
+    return merge_localized(data, fallback)
+
+
+async def fetch_localized(
+    endpoint: str,
+    params: dict,
+    language: str,
+    load: Optional[Callable[[], Awaitable[dict]]] = None
+) -> dict:
+    """获取主语言数据并补全翻译，load 为获取主语言数据的方式（默认直接请求 TMDB）
+    
+    上次需要补全的请求（如缓存过期后再次请求）两种语言同时获取，不必等主语言返回后再请求备用语言
+    """
+    if load is None:
+        load = partial(fetch_from_tmdb, endpoint, params, language)
+    
+    fallback_language = settings.FALLBACK_LANGUAGE
+    hint = request_key(endpoint, {**params, "language": language})
+    if not fallback_language or fallback_language == language or hint not in fallback_hints:
+        return await localize(await load(), endpoint, params, language)
+    
+    metrics["language_fallback_concurrent"] += 1
+    data, fallback = await asyncio.gather(
+        load(), fetch_fallback(endpoint, params, fallback_language), return_exceptions=True
+    )
+    if isinstance(data, BaseException):
+        raise data
+    if isinstance(fallback, HTTPException):
+        print(f"⚠️  获取备用语言数据失败: {fallback.detail}")
+        metrics["language_fallback_failed"] += 1
+        return data
+    if isinstance(fallback, BaseException):
+        raise fallback
+    return await localize(data, endpoint, params, language, fallback)
+
+
+# ========== 预取详情 ==========
+
+# 令牌桶中留给用户请求的比例：剩余令牌不到一半时不预取
+PREFETCH_RESERVE = 0.5
+# 记录的已预取、尚未被访问的电影数量上限
+PREFETCH_TRACK_SIZE = 1000
+
+prefetched: "OrderedDict[str, None]" = OrderedDict()
+prefetch_tasks: set = set()
+prefetch_state = {"active": 0}
+
+
+def schedule_prefetch(movies: List[dict]):
+    """在后台预取前几部电影的详情（用户大多会点开前几个结果）"""
+    ids = [movie["id"] for movie in movies[:settings.PREFETCH_COUNT] if movie.get("id")]
+    if not ids:
+        return
+    task = asyncio.create_task(prefetch_details(ids))
+    prefetch_tasks.add(task)
+    task.add_done_callback(prefetch_tasks.discard)
+
+
+async def prefetch_details(ids: List[str]):
+    """按顺序预取详情；已缓存、不由本实例负责或限速配额不足时跳过"""
+    for movie_id in ids:
+        if movie_id in prefetched or await detail_cache.expires_at(detail_key(movie_id)) is not None:
+            continue
+        if peer_group is not None and not peer_group.is_owner(movie_id):
+            continue
+        if (
+            prefetch_state["active"] >= settings.PREFETCH_CONCURRENCY
+            or upstream.bucket.available() < upstream.bucket.burst * PREFETCH_RESERVE
+        ):
+            metrics["prefetch_skipped"] += 1
+            continue
+        
+        prefetched[movie_id] = None
+        while len(prefetched) > PREFETCH_TRACK_SIZE:
+            prefetched.popitem(last=False)
+        prefetch_state["active"] += 1
+        metrics["prefetch_issued"] += 1
+        try:
+            await load_movie_detail(movie_id)
+        except HTTPException:
+            prefetched.pop(movie_id, None)
+            metrics["prefetch_failed"] += 1
+        finally:
+            prefetch_state["active"] -= 1
+
+
+def record_prefetch_hit(movie_id: str):
+    """用户打开的电影是预取过的（已缓存或预取请求进行中，后者会合并到同一个上游请求）"""
+    if movie_id in prefetched:
+        del prefetched[movie_id]
+        metrics["prefetch_hits"] += 1
+
+
+def convert_tmdb_to_douban_format(tmdb_movie: dict, is_detail: bool = False, index: bool = True) -> dict:
+    """将 TMDB 格式转换为前端兼容格式；index 为 False 时不收录到本地索引（本地索引只收录默认语言的电影）"""
     # 基础数据
     movie = {
         "id": str(tmdb_movie.get("id", "")),
@@ -277,69 +1087,298 @@ def convert_tmdb_to_douban_format(tmdb_movie: dict, is_detail: bool = False) ->
         genre_ids = tmdb_movie.get("genre_ids", [])
         movie["genres"] = [genre_map.get(gid, "其他") for gid in genre_ids[:3]]
     
+    if index:
+        index_movie(movie)
     return movie
 
 
+def index_movie(movie: dict):
+    """把转换后的电影收录到本地标题索引、推荐索引和搜索建议"""
+    doc = title_index.add(movie)
+    if doc is not None:
+        if recommender_state["pending"] is not None:
+            # 推荐索引正在从快照恢复：恢复完成后再加入
+            recommender_state["pending"][doc] = movie
+        else:
+            recommender.add(doc, movie)
+            # 电影数量达到阈值或翻倍时在后台重新聚类（已在聚类时不重复开始）
+            recommender.schedule_training()
+    
+    # 评价人数越多的电影建议越靠前
+    score = movie.get("rating_count") or 0
+    for title in {movie.get("title"), movie.get("original_title")}:
+        if title:
+            suggest_trie.add(title, score)
+
+
+# 转换后的电影数据包含的全部字段（fields 参数只能从这里选择）
+MOVIE_FIELDS = frozenset({
+    "id", "title", "original_title", "year", "rating", "rating_count", "cover",
+    "summary", "genres", "directors", "actors", "countries", "languages",
+    "duration", "douban_url",
+})
+
+# fields 参数说明
+FIELDS_DESCRIPTION = "只返回指定字段，逗号分隔，如 id,title,cover"
+
+
+@lru_cache(maxsize=256)
+def compile_projection(fields: tuple) -> Callable[[dict], dict]:
+    """为一组字段生成投影函数（每种字段组合只生成一次）"""
+    if not fields:
+        return lambda movie: movie
+    return lambda movie: {key: movie[key] for key in fields if key in movie}
+
+
+def get_projection(fields: Optional[str]) -> Callable[[dict], dict]:
+    """解析 fields 参数并返回对应的投影函数"""
+    if not fields:
+        return compile_projection(())
+    
+    requested = tuple(sorted({f.strip() for f in fields.split(",") if f.strip()}))
+    unknown = [f for f in requested if f not in MOVIE_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "字段不存在", "message": f"不支持的字段: {', '.join(unknown)}"}
+        )
+    return compile_projection(requested)
+
+
+def require_query(q: str) -> str:
+    """规范化搜索关键词（NFKC、大小写折叠、合并空白），规范化后为空时报错"""
+    query = normalize_text(q)
+    if not query:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "参数错误", "message": "搜索关键词不能为空"}
+        )
+    return query
+
+
+def search_local_index(query: str) -> Optional[List[dict]]:
+    """在本地标题索引中搜索；连续命中关键词的结果少于阈值时认为置信度不足，返回 None"""
+    if not settings.LOCAL_SEARCH:
+        return None
+    
+    results, matched = title_index.search(query)
+    if matched < settings.LOCAL_SEARCH_MIN_RESULTS:
+        return None
+    return results
+
+
 # ========== 网页路由 ==========
 
 @app.get("/", response_class=HTMLResponse, tags=["页面"])
 async def index(request: Request):
     """主页 - 电影搜索界面"""
+    # 开启内联时把首页数据直接写进 HTML，首屏无需再请求 API
+    home_data = await build_home_payload() if settings.INLINE_HOME_DATA else None
+    
     return templates.TemplateResponse(
         "index.html",
         {
             "request": request,
             "title": "TMDB 电影搜索系统",
-            "current_year": datetime.now().year
+            "current_year": datetime.now().year,
+            "home_data": home_data
         }
     )
 
 
 # ========== API路由 ==========
 
-@app.get("/api/search", tags=["API"])
+@app.get("/api/search", tags=["API"], dependencies=[rate_limit("search")])
 async def search_movies(
     q: str = Query(..., min_length=1, description="搜索关键词"),
     start: int = Query(0, ge=0),
-    count: int = Query(20, ge=1, le=50)
+    count: int = Query(20, ge=1, le=50),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
 ):
-    """搜索电影API - 使用 TMDB"""
-    # TMDB 搜索API：/search/movie
-    params = {"query": q, "page": (start // count) + 1}
-    data = await fetch_from_tmdb("search/movie", params)
-    
-    # 转换 TMDB 数据为前端格式
-    movies = [convert_tmdb_to_douban_format(item) for item in data.get('results', [])]
-    
-    # 记录搜索历史
-    search_history.insert(0, {
-        "keyword": q,
-        "timestamp": datetime.now().isoformat(),
-        "results_count": len(movies)
-    })
+    """搜索电影API - 优先使用缓存和本地索引，未命中时使用 TMDB"""
+    project = get_projection(fields)
+    query = require_query(q)
+    language = resolve_language(lang)
+    default_language = language == settings.DEFAULT_LANGUAGE
+    page = (start // count) + 1
+    params = {"query": query, "page": page}
     
-    # 只保留最近50条搜索记录
-    if len(search_history) > 50:
-        search_history.pop()
+    # 相同含义的关键词（大小写、空白、全半角不同）共用缓存；本地索引只收录默认语言的电影
+    cache_key = language_key(f"search:{page}:{query}", language)
+    data = await state_backend.get(cache_key)
+    local_results = search_local_index(query) if data is None and default_language else None
+    
+    if local_results is not None:
+        metrics["search_local_hits"] += 1
+        metrics["search_upstream_avoided"] += 1
+        source = "local"
+        results = local_results[start:start + count]
+        total = len(local_results)
+    else:
+        source = "tmdb"
+        if data is not None:
+            metrics["search_upstream_avoided"] += 1
+            data = await localize(data, "search/movie", params, language)
+        else:
+            async def load() -> dict:
+                # TMDB 搜索API：/search/movie（缓存主语言的原始数据，补全在读取时进行）
+                fetched = await fetch_from_tmdb("search/movie", params, language)
+                
+                # 没有结果或结果很少的搜索缓存时间更短
+                if fetched.get('total_results', 0) < settings.SEARCH_NEGATIVE_THRESHOLD:
+                    await state_backend.set(cache_key, fetched, settings.SEARCH_NEGATIVE_TTL)
+                else:
+                    await state_backend.set(cache_key, fetched, settings.SEARCH_CACHE_TTL)
+                return fetched
+            
+            data = await fetch_localized("search/movie", params, language, load)
+        
+        # 转换 TMDB 数据为前端格式
+        results = [convert_tmdb_to_douban_format(item, index=default_language) for item in data.get('results', [])]
+        total = data.get('total_results', 0)
+    
+    movies = [project(movie) for movie in results]
+    if settings.PREFETCH_COUNT > 0 and default_language:
+        schedule_prefetch(results)
+    
+    # 记录搜索历史，有结果的关键词加入搜索建议
+    searches = await search_history.record(q, len(movies), key=query)
+    if movies:
+        suggest_trie.add(query, searches * HISTORY_SUGGEST_WEIGHT, keyword=True)
     
     return {
         "count": len(movies),
         "start": start,
-        "total": data.get('total_results', 0),
+        "total": total,
+        "source": source,
         "movies": movies
     }
 
 
-@app.get("/api/movie/{movie_id}", tags=["API"])
-async def get_movie_detail(movie_id: str):
+@app.get("/api/suggest", tags=["API"])
+async def suggest(
+    prefix: str = Query(..., min_length=1, description="已输入的前缀"),
+    limit: int = Query(10, ge=1, le=20)
+):
+    """搜索建议 - 根据前缀返回电影标题和热门搜索词"""
+    return {
+        "prefix": prefix,
+        "suggestions": suggest_trie.suggest(prefix, limit)
+    }
+
+
+@app.get("/api/discover", tags=["API"])
+async def discover_movies(
+    year_from: Optional[int] = Query(None, ge=1800, le=9999, description="最早年份"),
+    year_to: Optional[int] = Query(None, ge=1800, le=9999, description="最晚年份"),
+    genres: Optional[str] = Query(None, description="类型，多个用逗号分隔"),
+    genre_mode: str = Query("any", pattern="^(any|all)$", description="any：包含任一类型；all：包含全部类型"),
+    min_rating: Optional[float] = Query(None, ge=0, le=10),
+    max_rating: Optional[float] = Query(None, ge=0, le=10),
+    min_votes: Optional[int] = Query(None, ge=0, description="最少评价人数"),
+    sort_by: str = Query("rating_count", description=f"排序字段：{'、'.join(DISCOVER_SORTS)}"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    start: int = Query(0, ge=0),
+    count: int = Query(20, ge=1, le=50),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """按年份、类型、评分筛选本地索引中的电影（只使用已缓存的数据，不请求 TMDB）"""
+    project = get_projection(fields)
+    if sort_by not in DISCOVER_SORTS:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "参数错误", "message": f"不支持的排序字段: {sort_by}"}
+        )
+    
+    catalog = title_index.movies
+    total, docs = discover(
+        catalog,
+        year_from=year_from,
+        year_to=year_to,
+        genres=tuple(g.strip() for g in (genres or "").split(",") if g.strip()),
+        match_all_genres=genre_mode == "all",
+        min_rating=min_rating,
+        max_rating=max_rating,
+        min_votes=min_votes,
+        sort_by=sort_by,
+        descending=order == "desc",
+        start=start,
+        count=count,
+    )
+    metrics["discover_queries"] += 1
+    
+    movies = [project(catalog[doc]) for doc in docs]
+    return {
+        "count": len(movies),
+        "start": start,
+        "total": total,
+        "source": "local",
+        "movies": movies
+    }
+
+
+@app.get("/api/recommendations", tags=["API"])
+async def get_recommendations(
+    start: int = Query(0, ge=0),
+    count: int = Query(20, ge=1, le=50),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """根据最近的收藏推荐本地索引中的相似电影（类型、年代、评分、导演和演员）；没有收藏时返回热门电影"""
+    project = get_projection(fields)
+    favorites, _ = await favorites_store.page("added_at", settings.RECOMMEND_PROFILE_SIZE)
+    records = [fav["movie"] for fav in favorites]
+    metrics["recommendations"] += 1
+    
+    catalog = title_index.movies
+    # 没有收藏，或推荐索引还在从快照恢复时返回热门电影
+    if not records or recommender_state["pending"] is not None:
+        _, docs = discover(catalog, sort_by="rating_count", start=start, count=count)
+        return {
+            "count": len(docs),
+            "start": start,
+            "based_on": 0,
+            "source": "popular",
+            "movies": [project(catalog[doc]) for doc in docs]
+        }
+    
+    # 已收藏的电影不推荐
+    exclude = [doc for doc in map(title_index.doc, (movie.get("id", "") for movie in records)) if doc is not None]
+    ranked = recommender.recommend(records, start + count, exclude)[start:]
+    movies = [{**project(catalog[doc]), "similarity": score} for doc, score in ranked]
+    return {
+        "count": len(movies),
+        "start": start,
+        "based_on": len(records),
+        "source": "local",
+        "movies": movies
+    }
+
+
+@app.get("/api/movie/{movie_id}", tags=["API"], dependencies=[rate_limit("detail")])
+async def get_movie_detail(
+    movie_id: str,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
+):
     """获取电影详情 - 使用 TMDB"""
-    # TMDB 详情API：/movie/{id}，追加演员信息
-    params = {"append_to_response": "credits"}
-    data = await fetch_from_tmdb(f"movie/{movie_id}", params)
-    movie = convert_tmdb_to_douban_format(data, is_detail=True)
+    project = get_projection(fields)
+    language = resolve_language(lang)
+    default_language = language == settings.DEFAULT_LANGUAGE
+    if default_language:
+        record_prefetch_hit(movie_id)
+    
+    data = await fetch_localized(
+        f"movie/{movie_id}", DETAIL_PARAMS, language, partial(fetch_movie_detail, movie_id, language)
+    )
+    movie = project(convert_tmdb_to_douban_format(data, is_detail=True, index=default_language))
     
     # 检查是否已收藏
-    is_favorite = movie_id in favorites
+    is_favorite = await favorites_store.contains(movie_id)
+    
+    # 指定了字段时不返回 extra 信息
+    if fields:
+        return {"movie": movie, "is_favorite": is_favorite}
     
     return {
         "movie": movie,
@@ -354,18 +1393,42 @@ async def get_movie_detail(movie_id: str):
     }
 
 
+def require_peer(request: Request):
+    """路由依赖：内部接口只供其它实例调用（单实例部署时不存在）"""
+    if peer_group is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not peer_group.authorized(request.headers, request.client.host if request.client else None):
+        metrics["peer_rejected"] += 1
+        raise HTTPException(status_code=403, detail="只允许其它实例调用")
+
+
+@app.get("/internal/movie/{movie_id}", include_in_schema=False, dependencies=[Depends(require_peer)])
+async def internal_movie_detail(movie_id: str, lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN)):
+    """供其它实例调用：返回本实例负责的电影详情（TMDB 原始格式，未补全翻译），不再转发"""
+    return await load_movie_detail(movie_id, resolve_language(lang))
+
+
 @app.get("/api/top250", tags=["API"])
 async def get_top250(
     start: int = Query(0, ge=0, le=225),
-    count: int = Query(20, ge=1, le=100)
+    count: int = Query(20, ge=1, le=100),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
 ):
     """获取Top250 - 使用 TMDB 热门电影"""
+    project = get_projection(fields)
+    language = resolve_language(lang)
+    default_language = language == settings.DEFAULT_LANGUAGE
+    
     # TMDB 热门电影API：/movie/popular
     page = (start // count) + 1
     params = {"page": page}
-    data = await fetch_from_tmdb("movie/popular", params)
+    data = await fetch_localized("movie/popular", params, language)
     
-    movies = [convert_tmdb_to_douban_format(item) for item in data.get('results', [])]
+    results = [convert_tmdb_to_douban_format(item, index=default_language) for item in data.get('results', [])]
+    movies = [project(movie) for movie in results]
+    if settings.PREFETCH_COUNT > 0 and default_language:
+        schedule_prefetch(results)
     
     return {
         "count": len(movies),
@@ -378,15 +1441,23 @@ async def get_top250(
 @app.get("/api/in_theaters", tags=["API"])
 async def get_in_theaters(
     city: str = Query("北京"),
-    count: int = Query(20, ge=1, le=50)
+    count: int = Query(20, ge=1, le=50),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
 ):
     """正在热映 - 使用 TMDB 正在上映"""
+    project = get_projection(fields)
+    language = resolve_language(lang)
+    
     # TMDB 正在上映API：/movie/now_playing (中国地区)
     params = {"region": "CN", "page": 1}
-    data = await fetch_from_tmdb("movie/now_playing", params)
+    data = await fetch_localized("movie/now_playing", params, language)
     
     # 转换为字典格式，限制数量
-    movies = [convert_tmdb_to_douban_format(item) for item in data.get('results', [])[:count]]
+    default_language = language == settings.DEFAULT_LANGUAGE
+    movies = [
+        project(convert_tmdb_to_douban_format(item, index=default_language)) for item in data.get('results', [])[:count]
+    ]
     
     return {
         "count": len(movies),
@@ -395,14 +1466,24 @@ async def get_in_theaters(
 
 
 @app.get("/api/coming_soon", tags=["API"])
-async def get_coming_soon(count: int = Query(20, ge=1, le=50)):
+async def get_coming_soon(
+    count: int = Query(20, ge=1, le=50),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
+):
     """即将上映 - 使用 TMDB 即将上映"""
+    project = get_projection(fields)
+    language = resolve_language(lang)
+    
     # TMDB 即将上映API：/movie/upcoming (中国地区)
     params = {"region": "CN", "page": 1}
-    data = await fetch_from_tmdb("movie/upcoming", params)
+    data = await fetch_localized("movie/upcoming", params, language)
     
     # 转换为字典格式，限制数量
-    movies = [convert_tmdb_to_douban_format(item) for item in data.get('results', [])[:count]]
+    default_language = language == settings.DEFAULT_LANGUAGE
+    movies = [
+        project(convert_tmdb_to_douban_format(item, index=default_language)) for item in data.get('results', [])[:count]
+    ]
     
     return {
         "count": len(movies),
@@ -410,9 +1491,180 @@ async def get_coming_soon(count: int = Query(20, ge=1, le=50)):
     }
 
 
+# ========== 首页聚合 ==========
+
+# 首页板块名称（与 /api/home 返回的字段一一对应）
+HOME_SECTIONS = ("in_theaters", "coming_soon", "top250")
+
+
+async def build_home_payload(count: int = 20, fields: Optional[str] = None, lang: Optional[str] = None) -> dict:
+    """并发获取首页所有板块，单个板块失败不影响其它板块"""
+    # 先校验字段，避免每个板块各自报错
+    get_projection(fields)
+    
+    results = await asyncio.gather(
+        get_in_theaters(city="北京", count=count, fields=fields, lang=lang),
+        get_coming_soon(count=count, fields=fields, lang=lang),
+        get_top250(start=0, count=count, fields=fields, lang=lang),
+        return_exceptions=True
+    )
+    
+    payload = {"errors": {}}
+    for name, result in zip(HOME_SECTIONS, results):
+        if isinstance(result, Exception):
+            detail = result.detail if isinstance(result, HTTPException) else str(result)
+            print(f"⚠️ 首页板块加载失败: {name} - {detail}")
+            payload[name] = None
+            payload["errors"][name] = detail
+        else:
+            payload[name] = result
+    
+    return payload
+
+
+async def warm_up():
+    """启动前预热：有快照时直接加载快照，否则获取首页各板块和热门榜单前几页，填充标题索引和搜索建议"""
+    snapshot = restore_snapshot()
+    if snapshot is not None:
+        for _ in suggest_trie.restore(snapshot):
+            pass
+        # 在主进程中构建推荐索引，fork 出的 worker 直接共享，不再各自构建
+        await restore_recommender()
+        return
+    
+    await build_home_payload()
+    for page in range(2, settings.WARMUP_PAGES + 1):
+        try:
+            await get_top250(start=(page - 1) * 20, count=20, fields=None, lang=None)
+        except HTTPException as e:
+            print(f"⚠️ 预热失败: 第 {page} 页 - {e.detail}")
+            break
+    # 连接池属于预热的事件循环，worker 中重新创建
+    await upstream.close()
+
+
+@app.get("/api/home", tags=["API"])
+async def get_home(
+    count: int = Query(20, ge=1, le=50),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
+):
+    """首页聚合数据 - 一次请求返回热映、即将上映和热门榜单"""
+    return await build_home_payload(count, fields, lang)
+
+
+# ========== 流式接口 ==========
+
+# 流式响应的媒体类型
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+async def iter_tmdb_pages(endpoint: str, params: dict, pages: int, language: str) -> AsyncIterator[dict]:
+    """并发获取多页 TMDB 列表数据，并按页码顺序逐页产出
+    
+    同时在途的页数不超过 STREAM_CONCURRENCY，内存占用与总页数无关
+    """
+    in_flight = deque()
+    next_page = 1
+    total_pages = pages
+    
+    def schedule():
+        nonlocal next_page
+        while next_page <= total_pages and len(in_flight) < settings.STREAM_CONCURRENCY:
+            task = asyncio.create_task(fetch_localized(endpoint, {**params, "page": next_page}, language))
+            in_flight.append((next_page, task))
+            next_page += 1
+    
+    schedule()
+    try:
+        while in_flight:
+            _, task = in_flight.popleft()
+            data = await task
+            
+            # 返回数据后就知道真实总页数，多余的页不再请求
+            real_total = data.get('total_pages', total_pages)
+            if real_total < total_pages:
+                total_pages = real_total
+                while in_flight and in_flight[-1][0] > total_pages:
+                    in_flight.pop()[1].cancel()
+            
+            schedule()
+            yield data
+    finally:
+        # 客户端断开或出错时取消剩余请求
+        for _, task in in_flight:
+            task.cancel()
+
+
+def format_stream_event(event: str, data: dict, fmt: str) -> str:
+    """把一条数据编码为 NDJSON 行或 SSE 事件"""
+    body = json.dumps(data, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {body}\n\n"
+    return body + "\n"
+
+
+async def stream_movies(
+    endpoint: str,
+    params: dict,
+    pages: int,
+    fmt: str,
+    project: Callable[[dict], dict],
+    language: str
+) -> AsyncIterator[str]:
+    """逐页转换电影数据并立即输出，最后输出汇总信息"""
+    count = 0
+    default_language = language == settings.DEFAULT_LANGUAGE
+    try:
+        async for data in iter_tmdb_pages(endpoint, params, pages, language):
+            for item in data.get('results', []):
+                count += 1
+                yield format_stream_event("movie", project(convert_tmdb_to_douban_format(item, index=default_language)), fmt)
+    except HTTPException as e:
+        # 响应头已经发出，只能在流中报告错误
+        yield format_stream_event("error", {"error": e.detail}, fmt)
+        return
+    
+    yield format_stream_event("end", {"count": count}, fmt)
+
+
+@app.get("/api/top250/stream", tags=["API"])
+async def stream_top250(
+    pages: int = Query(5, ge=1, le=500, description="获取的页数（每页20部）"),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
+):
+    """流式获取热门电影 - 每页数据到达后立即输出"""
+    return StreamingResponse(
+        stream_movies("movie/popular", {}, pages, format, get_projection(fields), resolve_language(lang)),
+        media_type=STREAM_MEDIA_TYPES[format]
+    )
+
+
+@app.get("/api/search/stream", tags=["API"])
+async def stream_search(
+    q: str = Query(..., min_length=1, description="搜索关键词"),
+    pages: int = Query(5, ge=1, le=500, description="获取的页数（每页20部）"),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    lang: Optional[str] = Query(None, pattern=LANGUAGE_PATTERN, description=LANGUAGE_DESCRIPTION)
+):
+    """流式搜索电影 - 每页数据到达后立即输出"""
+    return StreamingResponse(
+        stream_movies(
+            "search/movie", {"query": require_query(q)}, pages, format, get_projection(fields), resolve_language(lang)
+        ),
+        media_type=STREAM_MEDIA_TYPES[format]
+    )
+
+
 # ========== 收藏功能 ==========
 
-@app.post("/api/favorites/{movie_id}", tags=["收藏"])
+@app.post("/api/favorites/{movie_id}", tags=["收藏"], dependencies=[rate_limit("favorite")])
 async def add_favorite(movie_id: str, note: str = ""):
     """添加到收藏"""
     # 获取电影信息 - 使用 TMDB
@@ -421,11 +1673,7 @@ async def add_favorite(movie_id: str, note: str = ""):
     movie = convert_tmdb_to_douban_format(data, is_detail=True)
     
     # 添加到收藏
-    favorites[movie_id] = {
-        "movie": movie,
-        "added_at": datetime.now().isoformat(),
-        "note": note
-    }
+    await favorites_store.add(movie_id, movie, note)
     
     return {
         "success": True,
@@ -437,8 +1685,8 @@ async def add_favorite(movie_id: str, note: str = ""):
 @app.delete("/api/favorites/{movie_id}", tags=["收藏"])
 async def remove_favorite(movie_id: str):
     """取消收藏"""
-    if movie_id in favorites:
-        removed = favorites.pop(movie_id)
+    removed = await favorites_store.remove(movie_id)
+    if removed:
         return {
             "success": True,
             "message": "已取消收藏",
@@ -450,22 +1698,34 @@ async def remove_favorite(movie_id: str):
 
 @app.get("/api/favorites", tags=["收藏"])
 async def get_favorites(
-    sort_by: str = Query("added_at", regex="^(added_at|rating|year)$")
+    sort_by: str = Query("added_at", regex="^(added_at|rating|year)$"),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="每页数量，不传则返回全部"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
-    """获取收藏列表"""
-    fav_list = list(favorites.values())
+    """获取收藏列表（传 limit 或 cursor 时按游标分页）"""
+    project = get_projection(fields)
+    next_cursor = None
     
-    # 排序
-    if sort_by == "added_at":
-        fav_list.sort(key=lambda x: x["added_at"], reverse=True)
-    elif sort_by == "rating":
-        fav_list.sort(key=lambda x: x["movie"]["rating"], reverse=True)
-    elif sort_by == "year":
-        fav_list.sort(key=lambda x: x["movie"]["year"], reverse=True)
+    # 排序由数据库索引完成
+    if limit is None and cursor is None:
+        fav_list = await favorites_store.list(sort_by)
+    else:
+        try:
+            fav_list, next_cursor = await favorites_store.page(sort_by, limit or 20, cursor)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": "参数错误", "message": str(e)}
+            )
+    
+    if fields:
+        fav_list = [{**fav, "movie": project(fav["movie"])} for fav in fav_list]
     
     return {
         "count": len(fav_list),
-        "favorites": fav_list
+        "favorites": fav_list,
+        "next_cursor": next_cursor
     }
 
 
@@ -474,42 +1734,87 @@ async def get_favorites(
 @app.get("/api/stats", tags=["统计"])
 async def get_stats():
     """获取统计信息"""
-    if not favorites:
+    stats = await favorites_store.stats()
+    if stats["total"] == 0:
         return {
             "total_favorites": 0,
             "message": "暂无收藏数据"
         }
     
-    fav_movies = [f["movie"] for f in favorites.values()]
-    
-    # 统计类型分布
-    genres_count = {}
-    for movie in fav_movies:
-        for genre in movie["genres"]:
-            genres_count[genre] = genres_count.get(genre, 0) + 1
-    
-    # 统计年份分布
-    years = [m["year"] for m in fav_movies if m["year"]]
-    
-    # 平均评分
-    ratings = [m["rating"] for m in fav_movies if m["rating"] > 0]
-    avg_rating = sum(ratings) / len(ratings) if ratings else 0
-    
     return {
-        "total_favorites": len(favorites),
-        "average_rating": round(avg_rating, 2),
-        "genres_distribution": genres_count,
-        "total_searches": len(search_history),
-        "recent_searches": search_history[:10]
+        "total_favorites": stats["total"],
+        "average_rating": round(stats["average_rating"], 2),
+        "rating_quantiles": stats["rating_quantiles"],
+        "genres_distribution": stats["genres_distribution"],
+        "years_distribution": stats["years_distribution"],
+        "decades_distribution": stats["decades_distribution"],
+        "total_searches": await search_history.count(),
+        "recent_searches": await search_history.latest(10)
     }
 
 
+@app.get("/api/metrics", tags=["统计"])
+async def get_metrics():
+    """获取运行指标（上游请求、合并、取消等计数）"""
+    return {
+        "counters": dict(metrics),
+        "inflight_requests": len(inflight_requests),
+        "admission": {name: gate.stats() for name, gate in admission_gates.items()},
+        "upstream_throttled": upstream.throttled,
+        "upstream_throttled_seconds": round(upstream.throttled_seconds, 3),
+        "language_fallback_rate": (
+            round(metrics["language_fallbacks"] / metrics["language_requests"], 3) if metrics["language_requests"] else None
+        ),
+        "prefetch_hit_rate": round(metrics["prefetch_hits"] / metrics["prefetch_issued"], 3) if metrics["prefetch_issued"] else None,
+        "state_backend": settings.STATE_BACKEND,
+        "detail_cache_size": len(detail_cache.values) if isinstance(detail_cache, LocalBackend) else None,
+        "memory_bytes": memory_budget.total(),
+        "snapshot_restored": snapshot_state["restored"],
+        "changes_since": datetime.fromtimestamp(changes_state["since"]).isoformat(),
+        "peers": peer_group.ring.nodes if peer_group else [],
+        "rate_limit_clients": {
+            name: len(limiter) for name, limiter in rate_limiters.items() if isinstance(limiter, SlidingWindowLimiter)
+        },
+        "title_index_size": len(title_index),
+        "recommend_clusters": len(recommender.lists),
+        "suggest_size": len(suggest_trie)
+    }
+
+
+@app.get("/debug/memory", tags=["调试"])
+async def debug_memory(limit: int = Query(10, ge=1, le=100)):
+    """各个进程内存储的估算大小、预算淘汰次数，以及 tracemalloc 统计的分配最多的代码位置"""
+    report = memory_budget.report()
+    try:
+        report["favorites_db_bytes"] = os.path.getsize(settings.FAVORITES_DB)
+    except OSError:
+        report["favorites_db_bytes"] = None
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["tracemalloc"] = {
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "top": await asyncio.to_thread(top_allocations, limit),
+        }
+    else:
+        report["tracemalloc"] = "未启动（设置 MEMORY_TRACEMALLOC_FRAMES 大于 0 后重启）"
+    return report
+
+
 @app.get("/api/search_history", tags=["统计"])
 async def get_search_history(limit: int = Query(20, ge=1, le=100)):
     """获取搜索历史"""
     return {
-        "total": len(search_history),
-        "history": search_history[:limit]
+        "total": await search_history.count(),
+        "history": await search_history.latest(limit)
+    }
+
+
+@app.get("/api/trending_searches", tags=["统计"])
+async def get_trending_searches(limit: int = Query(10, ge=1, le=50)):
+    """热门搜索关键词（次数为估计值）"""
+    return {
+        "trending": await search_history.trending_searches(limit)
     }
 
 
@@ -551,4 +1856,10 @@ if __name__ == "__main__":
     print(f"📖 API文档: http://{settings.HOST}:{settings.PORT}/docs")
     print(f"🔑 API Key: {'已配置' if settings.TMDB_API_KEY else '未配置（使用模拟数据）'}")
     print(f"📊 模拟数据模式: {'开启' if settings.USE_MOCK_DATA else '关闭'}")
-    uvicorn.run(app, host=settings.HOST, port=settings.PORT, reload=True)
+    if settings.RELOAD:
+        # 开发模式：单进程，修改代码后自动重启
+        uvicorn.run("main:app", host=settings.HOST, port=settings.PORT, reload=True)
+    else:
+        # 生产模式：多 worker、uvloop/httptools、预热和优雅退出，见 server.py
+        import server
+        server.main()
@@ -0,0 +1,153 @@
+"""
+内存统计模块
+估算各个进程内存储占用的字节数，并在全局预算内统一淘汰缓存：
+缓存的大小在每次写入时更新，索引等不能淘汰的存储定期测量；超出预算时从占用最大的缓存中淘汰最久未使用的条目
+"""
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional
+
+from cache import TTLCache
+
+# 估算大容器时抽样的元素数
+SAMPLE_SIZE = 200
+
+
+def approx_size(value: Any) -> int:
+    """JSON 类数据（字典、列表、字符串、数字）的大致字节数，递归计算"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += approx_size(key) + approx_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += approx_size(item)
+    return size
+
+
+def sampled_size(container: Any, sample: int = SAMPLE_SIZE) -> int:
+    """大容器的大致字节数：容器本身加上前 sample 个元素的平均大小 × 元素数，耗时与容器大小无关"""
+    count = len(container)
+    size = sys.getsizeof(container)
+    if not count:
+        return size
+    if isinstance(container, dict):
+        items = [approx_size(key) + approx_size(value) for key, value in islice(container.items(), sample)]
+    else:
+        items = [approx_size(value) for value in islice(container, sample)]
+    return size + sum(items) * count // len(items)
+
+
+def process_rss() -> Optional[int]:
+    """当前进程的常驻内存（字节）；不支持的平台返回 None"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # 没有 /proc 时只能取峰值（macOS 单位为字节，其它为 KB）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def top_allocations(limit: int) -> List[dict]:
+    """tracemalloc 统计的分配最多的代码位置（需要先 tracemalloc.start()）"""
+    stats = tracemalloc.take_snapshot().statistics("lineno")
+    return [
+        {"location": str(stat.traceback[0]), "bytes": stat.size, "count": stat.count}
+        for stat in stats[:limit]
+    ]
+
+
+class MemoryBudget:
+    """全局内存预算（每个进程）
+
+    limit 为 0 时只统计不淘汰；不能淘汰的存储每隔 measure_interval 秒重新测量，缓存的大小实时更新
+    """
+
+    def __init__(self, limit: int, measure_interval: float = 30):
+        self.limit = limit
+        self.measure_interval = measure_interval
+        self.caches: Dict[str, TTLCache] = {}
+        self.stores: Dict[str, Callable[[], int]] = {}
+        self.evictions: Counter = Counter()
+        self._measured: Dict[str, int] = {}
+        self._measured_at = 0.0
+        self._enforcing = False
+        self._warned = False
+
+    def add_cache(self, name: str, cache: TTLCache):
+        """加入可以淘汰的缓存（开始记录条目大小）"""
+        cache.track_size(approx_size)
+        cache.budget = self
+        self.caches[name] = cache
+
+    def add_store(self, name: str, measure: Callable[[], int]):
+        """加入不能淘汰的存储，measure 返回大致字节数（应当很快，不遍历全部数据）"""
+        self.stores[name] = measure
+
+    def measure(self, force: bool = False) -> Dict[str, int]:
+        """不能淘汰的存储的大小（距上次测量不到 measure_interval 秒时返回上次的结果）"""
+        now = time.monotonic()
+        if force or now - self._measured_at >= self.measure_interval:
+            self._measured = {name: measure() for name, measure in self.stores.items()}
+            self._measured_at = now
+        return self._measured
+
+    def usage(self, force: bool = False) -> Dict[str, int]:
+        usage = dict(self.measure(force))
+        usage.update((name, cache.bytes) for name, cache in self.caches.items())
+        return usage
+
+    def total(self) -> int:
+        return sum(self.measure().values()) + sum(cache.bytes for cache in self.caches.values())
+
+    def enforce(self):
+        """超出预算时从占用最大的缓存中淘汰最久未使用的条目，直到回到预算以内或缓存已空"""
+        if self.limit <= 0 or self._enforcing:
+            return
+        over = self.total() - self.limit
+        if over <= 0:
+            return
+        self._enforcing = True
+        try:
+            while over > 0:
+                name, cache = max(self.caches.items(), key=lambda item: item[1].bytes, default=(None, None))
+                if cache is None or not len(cache):
+                    if not self._warned:
+                        # 缓存已经清空仍然超出：索引等不能淘汰的存储本身超出预算，只提示一次
+                        print(f"⚠️  内存预算 {self.limit // 1024 // 1024} MB 不足，索引等存储已超出预算")
+                        self._warned = True
+                    break
+                over -= cache.evict_oldest()
+                self.evictions[name] += 1
+        finally:
+            self._enforcing = False
+
+    def report(self) -> dict:
+        usage = self.usage(force=True)
+        return {
+            "budget_bytes": self.limit,
+            "total_bytes": sum(usage.values()),
+            "process_rss_bytes": process_rss(),
+            "stores": {
+                name: {
+                    "bytes": size,
+                    "evictable": name in self.caches,
+                    "entries": len(self.caches[name]) if name in self.caches else None,
+                    "evictions": self.evictions[name],
+                }
+                for name, size in sorted(usage.items(), key=lambda item: -item[1])
+            },
+        }
+
+
+__all__ = ['MemoryBudget', 'approx_size', 'process_rss', 'sampled_size', 'top_allocations']
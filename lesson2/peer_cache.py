@@ -0,0 +1,132 @@
+"""
+多实例缓存分片模块
+所有实例组成一致性哈希环，每部电影只由一个实例（所有者）向 TMDB 请求并缓存；
+其它实例通过内部接口向所有者获取，并在本地短暂保存热点数据；
+内部接口只接受带共享密钥（X-Peer-Secret）的请求，未配置密钥时只接受来自实例地址的请求
+"""
+import bisect
+import hashlib
+import hmac
+import socket
+from typing import Any, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from cache import TTLCache
+
+
+def ring_hash(value: str) -> int:
+    """哈希值（md5 取前 8 字节，在不同进程之间结果一致）"""
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环：每个节点放置 replicas 个虚拟节点，增删节点只影响相邻区间的键"""
+
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (ring_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        """顺时针方向第一个虚拟节点所属的节点"""
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.owners[index]
+
+
+class PeerError(Exception):
+    """所有者实例不可用"""
+
+
+# 实例之间请求内部接口时携带的共享密钥
+SECRET_HEADER = "x-peer-secret"
+
+
+class PeerGroup:
+    """实例组：判断键的所有者，向所有者获取数据，并缓存热点数据"""
+
+    def __init__(
+        self,
+        self_url: str,
+        peers: List[str],
+        replicas: int = 64,
+        hot_size: int = 256,
+        hot_ttl: float = 60,
+        timeout: float = 5.0,
+        secret: str = "",
+    ):
+        self.self_url = normalize_url(self_url)
+        self.ring = HashRing([normalize_url(peer) for peer in peers] + [self.self_url], replicas)
+        self.hot = TTLCache(maxsize=hot_size)
+        self.hot_ttl = hot_ttl
+        self.timeout = timeout
+        self.secret = secret
+        # 未配置密钥时，只有这些地址可以请求内部接口
+        self.addresses = peer_addresses(self.ring.nodes)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def owner(self, key: str) -> str:
+        return self.ring.owner(key)
+
+    def is_owner(self, key: str) -> bool:
+        return self.owner(key) == self.self_url
+
+    def authorized(self, headers, host: Optional[str]) -> bool:
+        """内部接口的请求是否来自其它实例"""
+        if self.secret:
+            return hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self.secret.encode())
+        return host is not None and host in self.addresses
+
+    async def fetch(self, owner: str, path: str) -> Tuple[int, Any]:
+        """通过内部接口向所有者获取数据，返回 (状态码, JSON 内容)；连接失败时抛出 PeerError"""
+        if self._client is None:
+            # 实例之间复用长连接
+            headers = {SECRET_HEADER: self.secret} if self.secret else None
+            self._client = httpx.AsyncClient(timeout=self.timeout, headers=headers)
+        try:
+            response = await self._client.get(f"{owner}{path}")
+            return response.status_code, response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise PeerError(f"{owner}: {e}") from e
+
+    def after_fork(self):
+        """fork 出的子进程中调用：不复用父进程的连接"""
+        self._client = None
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def normalize_url(url: str) -> str:
+    return url.strip().rstrip("/")
+
+
+def peer_addresses(urls: List[str]) -> Set[str]:
+    """实例地址对应的 IP（启动时解析一次，无法解析的主机名跳过）"""
+    addresses = set()
+    for url in urls:
+        host = urlparse(url).hostname
+        if not host:
+            continue
+        addresses.add(host)
+        try:
+            addresses.update(info[4][0] for info in socket.getaddrinfo(host, None))
+        except OSError:
+            pass
+    return addresses
+
+
+def parse_peers(value: str) -> List[str]:
+    """解析逗号分隔的实例地址列表"""
+    return [normalize_url(peer) for peer in value.split(",") if peer.strip()]
+
+
+__all__ = ['HashRing', 'PeerGroup', 'PeerError', 'parse_peers', 'peer_addresses', 'SECRET_HEADER']
@@ -0,0 +1,139 @@
+"""
+客户端限流模块
+按客户端（API Token 或 IP）限制每个时间窗口内的请求数，避免单个客户端耗尽 TMDB 配额
+
+使用滑动窗口计数：只保存当前和上一个固定窗口的请求数，按上一个窗口在滑动窗口内剩余的比例加权，
+估算最近 window 秒内的请求数。每个客户端只占几个数字，客户端数量有上限（淘汰最久未访问的）
+"""
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Set
+
+from memory import sampled_size
+from shared_state import StateBackend
+
+
+def retry_after(limit: int, window: float, previous: int, current: int, elapsed: float) -> float:
+    """估算的请求数降到 limit - 1 以下（可以再放行一个请求）还需要等待的秒数"""
+    if current + 1 > limit:
+        # 当前窗口已满：等到下一个窗口，并且当前窗口的计数按比例衰减到足够小
+        needed = 1 - (limit - 1) / current if current else 0.0
+        return window - elapsed + max(needed, 0.0) * window
+    needed = 1 - (limit - current - 1) / previous if previous else 0.0
+    return max(needed * window - elapsed, 0.0)
+
+
+def estimate(window: float, previous: int, current: int, elapsed: float) -> float:
+    """滑动窗口内的请求数估算值"""
+    return previous * (1 - elapsed / window) + current
+
+
+class SlidingWindowLimiter:
+    """进程内限流：每个客户端保存 [窗口编号, 上一个窗口计数, 当前窗口计数]"""
+
+    def __init__(self, limit: int, window: float, max_clients: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[str, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def approx_bytes(self) -> int:
+        return sampled_size(self._clients)
+
+    def hit(self, client: str, now: Optional[float] = None) -> float:
+        """记录一次请求：允许时返回 0，超出限制时返回需要等待的秒数（被拒绝的请求不计数）"""
+        if self.limit <= 0:
+            return 0.0
+        now = time.time() if now is None else now
+        index, elapsed = divmod(now, self.window)
+
+        state = self._clients.get(client)
+        if state is None:
+            state = self._clients[client] = [index, 0, 0]
+            # 超出上限时淘汰最久未访问的客户端（被淘汰的客户端重新计数）
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+            if state[0] != index:
+                # 进入新窗口：相邻窗口的计数成为上一个窗口，间隔更久时清零
+                state[1] = state[2] if index - state[0] == 1 else 0
+                state[2] = 0
+                state[0] = index
+
+        _, previous, current = state
+        if estimate(self.window, previous, current, elapsed) + 1 > self.limit:
+            return retry_after(self.limit, self.window, previous, current, elapsed)
+        state[2] += 1
+        return 0.0
+
+
+class SharedSlidingWindowLimiter:
+    """多进程共享的限流：计数保存在共享状态后端（sqlite/redis），所有 worker 共用同一个限制
+
+    每个请求需要一次计数和一次读取，被拒绝时再撤销计数
+    """
+
+    def __init__(self, backend: StateBackend, name: str, limit: int, window: float):
+        self.backend = backend
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    async def hit(self, client: str, now: Optional[float] = None) -> float:
+        if self.limit <= 0:
+            return 0.0
+        now = time.time() if now is None else now
+        index, elapsed = divmod(now, self.window)
+        key = f"ratelimit:{self.name}:{client}:{int(index)}"
+
+        # 计数器保留两个窗口，下一个窗口还要作为上一个窗口读取
+        current = await self.backend.incr(key, 1, ttl=self.window * 2)
+        previous = await self.backend.get(f"ratelimit:{self.name}:{client}:{int(index) - 1}") or 0
+        if estimate(self.window, previous, current, elapsed) > self.limit:
+            await self.backend.incr(key, -1)
+            return retry_after(self.limit, self.window, previous, current - 1, elapsed)
+        return 0.0
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def parse_tokens(value: str) -> Set[str]:
+    """解析逗号分隔的 API Token 列表，只保存摘要"""
+    return {token_digest(token.strip()) for token in value.split(",") if token.strip()}
+
+
+def client_key(headers, host: Optional[str], trust_proxy: bool = False, tokens: Iterable[str] = frozenset()) -> str:
+    """识别客户端：API Token 在配置的列表中（tokens 为摘要集合）时按 Token 计数，否则按 IP；
+    trust_proxy 时使用 X-Forwarded-For 的第一个地址
+
+    不在列表中的 Token 一律忽略：否则客户端每次换一个 Token 就能绕过限制，还会挤掉其它客户端的计数
+    """
+    token = headers.get("x-api-key")
+    authorization = headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    if token and tokens:
+        digest = token_digest(token)
+        if digest in tokens:
+            return "token:" + digest[:16]
+    if trust_proxy and headers.get("x-forwarded-for"):
+        return "ip:" + headers["x-forwarded-for"].split(",")[0].strip()
+    return f"ip:{host or 'unknown'}"
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+__all__ = [
+    'SlidingWindowLimiter', 'SharedSlidingWindowLimiter', 'client_key', 'estimate', 'parse_tokens', 'retry_after',
+    'retry_after_header',
+]
@@ -0,0 +1,404 @@
+"""
+推荐模块
+为目录中的每部电影建立特征向量（类型 one-hot、年代、评分、导演和演员），
+把用户收藏的向量相加作为偏好，用向量化的内积为候选电影打分。
+
+- 类型、年代、评分是稠密部分，保存在 float16 矩阵中，加入或更新电影时增量写入
+- 导演和演员是稀疏部分，保存为 名字 → {文档编号: 权重} 的倒排表
+- 电影数量达到阈值后对稠密向量聚类（倒排文件索引），查询时只计算与偏好最接近的几个簇中的电影
+  （近似最近邻）；聚类在线程中进行，之后加入的电影直接分配到最近的簇
+"""
+import asyncio
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from catalog import INT_RATING, MAX_GENRES, MovieCatalog, StringPool
+from memory import sampled_size
+
+# 类型 one-hot 的维数（TMDB 共 19 种类型，超出时按编号取余）
+GENRE_DIMS = 32
+# 年代：以 1920、1930 …… 2020 为中心的分桶，年份按距离分配到相邻两个桶
+YEAR_START = 1920
+YEAR_BUCKETS = 11
+DIM = GENRE_DIMS + YEAR_BUCKETS + 1
+
+# 各部分的权重（向量整体归一化，缺少的部分不占权重）
+GENRE_WEIGHT = 1.0
+YEAR_WEIGHT = 0.5
+RATING_WEIGHT = 0.4
+CREDIT_WEIGHT = 0.8
+
+# 导演的权重是演员的两倍；只使用前几位演员
+DIRECTOR_WEIGHT = 2.0
+MAX_ACTORS = 5
+
+# 聚类：簇数量为电影数量的平方根（有上下限），在最多 SAMPLE_SIZE 部电影上训练
+MIN_CLUSTERS = 16
+MAX_CLUSTERS = 1024
+SAMPLE_SIZE = 50000
+KMEANS_ROUNDS = 8
+
+
+def credit_weights(record: dict) -> Dict[str, float]:
+    """导演和演员的权重（归一化前）；记录中没有演职员信息时返回空字典"""
+    weights: Dict[str, float] = {}
+    for name in record.get("actors") or []:
+        if name and len(weights) < MAX_ACTORS:
+            weights[name] = 1.0
+    for name in record.get("directors") or []:
+        if name:
+            weights[name] = DIRECTOR_WEIGHT
+    return weights
+
+
+def year_buckets(year: float) -> Tuple[int, float, float]:
+    """年份所在的两个相邻年代桶，返回 (左侧桶, 左侧权重, 右侧权重)，两个权重的平方和为 1"""
+    position = min(max((year - YEAR_START) / 10, 0), YEAR_BUCKETS - 1)
+    low = min(int(position), YEAR_BUCKETS - 2)
+    frac = position - low
+    norm = ((1 - frac) ** 2 + frac ** 2) ** 0.5
+    return low, (1 - frac) / norm, frac / norm
+
+
+def kmeans(vectors: np.ndarray, clusters: int, rounds: int, seed: int = 0) -> np.ndarray:
+    """球面 k-means：按内积分配，簇中心归一化；空簇用随机样本重新初始化"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(rounds):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / np.maximum(norms, 1e-6)[:, None]
+    return centroids.astype(np.float32)
+
+
+def build_clusters(vectors: np.ndarray, batch: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+    """对向量聚类，返回 (簇中心, 每个向量所属的簇)；耗时较长，在线程中执行"""
+    count = len(vectors)
+    clusters = int(min(max(count ** 0.5, MIN_CLUSTERS), MAX_CLUSTERS, count))
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(count, min(count, SAMPLE_SIZE), replace=False)].astype(np.float32)
+    centroids = kmeans(sample, clusters, KMEANS_ROUNDS)
+
+    labels = np.empty(count, dtype=np.int32)
+    for start in range(0, count, batch):
+        chunk = vectors[start:start + batch].astype(np.float32)
+        labels[start:start + batch] = np.argmax(chunk @ centroids.T, axis=1)
+    return centroids, labels
+
+
+class Recommender:
+    """基于特征向量的推荐索引，下标为文档编号（与标题索引一致）"""
+
+    def __init__(self, ann_min_size: int = 50000, probes: int = 16):
+        self.ann_min_size = ann_min_size
+        self.probes = probes
+        self.size = 0
+        self.vectors = np.zeros((0, DIM), dtype=np.float16)
+        # 类型名称 → 维度（按第一次出现的顺序编号）
+        self.genre_names = StringPool()
+        # 导演和演员：文档编号 → 归一化前的权重；名字 → {文档编号: 归一化后的权重}
+        self.credits: Dict[int, Dict[str, float]] = {}
+        self.credit_postings: Dict[str, Dict[int, float]] = {}
+        # 聚类索引（未训练时为 None）：簇中心、每部电影所属的簇、每个簇的文档编号
+        # 电影改变所属的簇时旧簇中的编号不删除，查询时按 labels 过滤
+        self.centroids: Optional[np.ndarray] = None
+        self.labels = np.full(0, -1, dtype=np.int32)
+        self.lists: List[array] = []
+        self.trained_size = 0
+        self.training = False
+        # 训练期间更新过的文档，训练完成后重新分配簇
+        self._dirty: set = set()
+        # 内容变化的次数（用于判断是否需要重新写快照）
+        self.updates = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def approx_bytes(self) -> int:
+        """大致占用的内存（字节）"""
+        size = self.vectors.nbytes + self.labels.nbytes
+        if self.centroids is not None:
+            size += self.centroids.nbytes
+        size += sampled_size(self.lists) + sampled_size(self.credits) + sampled_size(self.credit_postings)
+        return size
+
+    # ---------- 特征 ----------
+
+    def genre_dim(self, name: str) -> int:
+        return self.genre_names.code(name) % GENRE_DIMS
+
+    def dense_features(self, record: dict) -> Tuple[np.ndarray, float]:
+        """稠密部分（未归一化）及其平方和"""
+        vector = np.zeros(DIM, dtype=np.float32)
+        genres = record.get("genres")
+        if isinstance(genres, list) and genres:
+            for name in genres:
+                vector[self.genre_dim(name)] = 1
+            vector[:GENRE_DIMS] *= GENRE_WEIGHT / np.linalg.norm(vector[:GENRE_DIMS])
+
+        year = str(record.get("year") or "")
+        if year.isdigit():
+            low, left, right = year_buckets(int(year))
+            vector[GENRE_DIMS + low] = left * YEAR_WEIGHT
+            vector[GENRE_DIMS + low + 1] = right * YEAR_WEIGHT
+
+        rating = record.get("rating")
+        if type(rating) in (int, float) and 0 < rating <= 10:
+            vector[DIM - 1] = rating / 10 * RATING_WEIGHT
+        return vector, float(vector @ vector)
+
+    def features(self, record: dict) -> Tuple[np.ndarray, Dict[str, float]]:
+        """完整的特征向量（归一化）：(稠密部分, 名字 → 权重)"""
+        vector, norm = self.dense_features(record)
+        return self._normalize(vector, norm, credit_weights(record))
+
+    @staticmethod
+    def _normalize(vector: np.ndarray, norm: float, credits: Dict[str, float]) -> Tuple[np.ndarray, Dict[str, float]]:
+        scale = 0.0
+        if credits:
+            scale = CREDIT_WEIGHT / sum(w * w for w in credits.values()) ** 0.5
+            norm += CREDIT_WEIGHT ** 2
+        if norm == 0:
+            return vector, {}
+        factor = norm ** -0.5
+        return vector * factor, {name: w * scale * factor for name, w in credits.items()}
+
+    # ---------- 写入 ----------
+
+    def _reserve(self, size: int):
+        """保证矩阵容量（按倍数扩容）"""
+        if size <= len(self.vectors):
+            return
+        capacity = max(size, len(self.vectors) * 2, 1024)
+        vectors = np.zeros((capacity, DIM), dtype=np.float16)
+        vectors[:self.size] = self.vectors[:self.size]
+        labels = np.full(capacity, -1, dtype=np.int32)
+        labels[:self.size] = self.labels[:self.size]
+        self.vectors, self.labels = vectors, labels
+
+    def _set_credits(self, doc: int, old_names: Iterable[str], weights: Dict[str, float]):
+        """替换一部电影在演职员倒排表中的权重"""
+        for name in old_names:
+            posting = self.credit_postings.get(name)
+            if posting is not None:
+                posting.pop(doc, None)
+                if not posting:
+                    del self.credit_postings[name]
+        for name, weight in weights.items():
+            self.credit_postings.setdefault(name, {})[doc] = weight
+
+    def add(self, doc: int, record: dict):
+        """加入或更新一部电影；记录中没有演职员信息（列表数据）时保留之前从详情中得到的演职员"""
+        old = self.credits.get(doc, {})
+        credits = credit_weights(record) or old
+        if credits != old:
+            self.credits[doc] = credits
+            self.updates += 1
+
+        vector, norm = self.dense_features(record)
+        vector, weighted = self._normalize(vector, norm, credits)
+        self._set_credits(doc, old, weighted)
+
+        self._reserve(doc + 1)
+        self.vectors[doc] = vector
+        self.size = max(self.size, doc + 1)
+        if self.centroids is not None:
+            self._assign(np.array([doc]))
+        if self.training:
+            self._dirty.add(doc)
+
+    def rebuild(self, catalog: MovieCatalog, credits: Iterable[Tuple[int, Dict[str, float]]] = ()):
+        """从目录的列中批量计算全部向量（从快照恢复后使用）"""
+        self.__init__(self.ann_min_size, self.probes)
+        self.credits = dict(credits)
+        count = len(catalog)
+        self._reserve(count)
+        self.size = count
+        if count == 0:
+            return
+
+        vectors = np.zeros((count, DIM), dtype=np.float32)
+        bits = np.frombuffer(catalog.genres, dtype=np.uint64)
+        for code, name in enumerate(catalog.genre_names.values[:MAX_GENRES]):
+            vectors[:, self.genre_dim(name)] = np.maximum(
+                vectors[:, self.genre_dim(name)], (bits >> np.uint64(code)) & np.uint64(1)
+            )
+        del bits
+        genre_norms = np.linalg.norm(vectors[:, :GENRE_DIMS], axis=1)
+        vectors[:, :GENRE_DIMS] *= (GENRE_WEIGHT / np.maximum(genre_norms, 1e-6))[:, None]
+
+        years = np.frombuffer(catalog.years, dtype=np.uint16).astype(np.float32)
+        position = np.clip((years - YEAR_START) / 10, 0, YEAR_BUCKETS - 1)
+        low = np.minimum(position.astype(np.int64), YEAR_BUCKETS - 2)
+        frac = position - low
+        norm = np.sqrt((1 - frac) ** 2 + frac ** 2)
+        known = np.flatnonzero(years > 0)
+        vectors[known, GENRE_DIMS + low[known]] = ((1 - frac) / norm * YEAR_WEIGHT)[known]
+        vectors[known, GENRE_DIMS + low[known] + 1] = (frac / norm * YEAR_WEIGHT)[known]
+        del years
+
+        ratings = (np.frombuffer(catalog.ratings, dtype=np.uint16) & (INT_RATING - 1)) / 100
+        vectors[:, DIM - 1] = np.minimum(ratings, 1) * RATING_WEIGHT
+
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        for doc, weights in self.credits.items():
+            if doc < count:
+                norms[doc] += CREDIT_WEIGHT ** 2
+        vectors /= np.sqrt(np.maximum(norms, 1e-12))[:, None]
+        self.vectors[:count] = vectors
+        del vectors
+
+        # overflow 中的值（很少）和演职员逐条计算
+        for doc in set(catalog.overflow) | set(self.credits):
+            if doc < count:
+                record = catalog[doc]
+                vector, norm = self.dense_features(record)
+                vector, weighted = self._normalize(vector, norm, self.credits.get(doc, {}))
+                self.vectors[doc] = vector
+                self._set_credits(doc, (), weighted)
+
+    # ---------- 聚类索引 ----------
+
+    @property
+    def needs_training(self) -> bool:
+        """电影数量达到阈值，且比上次训练时翻倍后重新聚类"""
+        return (
+            not self.training
+            and self.ann_min_size > 0
+            and self.size >= max(self.ann_min_size, self.trained_size * 2)
+        )
+
+    def _assign(self, docs: np.ndarray):
+        """把电影分配到最近的簇（所属的簇没有变化时不重复加入）"""
+        labels = np.argmax(self.vectors[docs].astype(np.float32) @ self.centroids.T, axis=1)
+        moved = labels != self.labels[docs]
+        self.labels[docs] = labels
+        for doc, label in zip(docs[moved].tolist(), labels[moved].tolist()):
+            self.lists[label].append(doc)
+
+    def _install(self, centroids: np.ndarray, labels: np.ndarray):
+        """使用新的聚类结果：训练开始后加入或更新的电影重新分配"""
+        count = len(labels)
+        self.centroids = centroids
+        self.labels[:count] = labels
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(len(centroids) + 1))
+        self.lists = [array("q", order[bounds[i]:bounds[i + 1]].tobytes()) for i in range(len(centroids))]
+        self.trained_size = count
+        # 训练开始后加入的电影按旧的簇编号分配过，清除后重新分配
+        self.labels[count:self.size] = -1
+        changed = set(range(count, self.size)) | {doc for doc in self._dirty if doc < count}
+        self._dirty.clear()
+        if changed:
+            self._assign(np.fromiter(changed, dtype=np.int64))
+
+    def train_now(self):
+        """在当前线程中聚类（启动时使用）"""
+        self._install(*build_clusters(self.vectors[:self.size]))
+
+    def schedule_training(self) -> bool:
+        """需要时在后台开始聚类，返回是否开始
+
+        标记在创建任务之前同步设置：一页电影在同一轮事件循环中逐个加入，越过阈值后只启动一次聚类
+        """
+        if not self.needs_training:
+            return False
+        self.training = True
+        asyncio.create_task(self._train())
+        return True
+
+    async def train(self):
+        """在线程中聚类，完成后在事件循环中切换到新的聚类结果；已有聚类在进行时直接返回"""
+        if self.training:
+            return
+        self.training = True
+        await self._train()
+
+    async def _train(self):
+        try:
+            centroids, labels = await asyncio.to_thread(build_clusters, self.vectors[:self.size])
+            self._install(centroids, labels)
+        finally:
+            self.training = False
+            self._dirty.clear()
+
+    def load_from(self, other: "Recommender"):
+        """替换为另一个推荐索引的内容（在线程中重新构建后，在事件循环中切换）"""
+        vars(self).update(vars(other))
+
+    # ---------- 查询 ----------
+
+    def profile(self, records: Iterable[dict]) -> Tuple[np.ndarray, Dict[str, float]]:
+        """偏好向量：收藏电影的特征向量之和"""
+        dense = np.zeros(DIM, dtype=np.float32)
+        sparse: Dict[str, float] = {}
+        for record in records:
+            vector, credits = self.features(record)
+            dense += vector
+            for name, weight in credits.items():
+                sparse[name] = sparse.get(name, 0.0) + weight
+        return dense, sparse
+
+    def _candidates(self, dense: np.ndarray) -> np.ndarray:
+        """与偏好最接近的 probes 个簇中的电影"""
+        scores = self.centroids @ dense
+        probes = np.argpartition(-scores, min(self.probes, len(scores)) - 1)[:self.probes]
+        docs = np.unique(np.concatenate([np.frombuffer(self.lists[i], dtype=np.int64) for i in probes]))
+        return docs[np.isin(self.labels[docs], probes)]
+
+    def recommend(
+        self,
+        records: List[dict],
+        count: int = 20,
+        exclude: Iterable[int] = (),
+    ) -> List[Tuple[int, float]]:
+        """与收藏最相似的电影，返回 [(文档编号, 相似度)]；分数相同时按文档编号排列"""
+        if self.size == 0 or not records:
+            return []
+        dense, sparse = self.profile(records)
+        dense /= len(records)
+
+        # 演职员得分：只涉及偏好中的名字，逐个累加
+        bonus: Dict[int, float] = {}
+        for name, weight in sparse.items():
+            for doc, value in self.credit_postings.get(name, {}).items():
+                bonus[doc] = bonus.get(doc, 0.0) + weight * value / len(records)
+
+        if self.centroids is None:
+            docs = np.arange(self.size)
+        else:
+            docs = self._candidates(dense)
+            if bonus:
+                docs = np.union1d(docs, np.fromiter(bonus, dtype=np.int64))
+        scores = self.vectors[docs].astype(np.float32) @ dense
+        if bonus:
+            positions = np.searchsorted(docs, np.fromiter(bonus, dtype=np.int64))
+            scores[positions] += np.fromiter(bonus.values(), dtype=np.float32)
+
+        excluded = np.fromiter(exclude, dtype=np.int64)
+        if len(excluded):
+            scores[np.isin(docs, excluded)] = -np.inf
+
+        count = min(count, len(docs))
+        if count <= 0:
+            return []
+        if count < len(docs):
+            threshold = np.partition(-scores, count - 1)[count - 1]
+            keep = np.flatnonzero(-scores <= threshold)
+            docs, scores = docs[keep], scores[keep]
+        order = np.lexsort((docs, -scores))[:count]
+        return [(int(docs[i]), round(float(scores[i]), 4)) for i in order if scores[i] > -np.inf]
+
+    def dump_credits(self) -> list:
+        """演职员（写快照用）：[[文档编号, {名字: 权重}]]"""
+        return [[doc, weights] for doc, weights in self.credits.items()]
+
+
+__all__ = ['Recommender', 'build_clusters', 'DIM']
@@ -0,0 +1,290 @@
+"""
+搜索历史模块
+单进程：最近搜索使用固定容量的环形缓冲区，同时在后台批量追加写入日志文件（文件操作在线程中进行，不阻塞事件循环）；
+热门关键词使用 Count-Min Sketch 统计，只保留前 k 个候选；
+日志超过大小上限时压缩为一行状态（计数、Sketch、候选和最近记录），之后继续追加
+多进程：通过共享状态后端保存，所有 worker 看到同样的历史
+"""
+import asyncio
+import json
+import os
+import zlib
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import List, Optional
+
+from memory import sampled_size
+from shared_state import StateBackend
+
+
+class CountMinSketch:
+    """Count-Min Sketch：固定内存估计每个关键词的出现次数（只会高估，不会低估）"""
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key: str):
+        data = key.encode("utf-8")
+        for row in range(self.depth):
+            # 不同行使用不同的种子，crc32 在进程之间结果一致
+            yield row, zlib.crc32(data, row * 0x9E3779B1 & 0xFFFFFFFF) % self.width
+
+    def add(self, key: str) -> int:
+        """计数加一，返回新的估计值"""
+        estimate = None
+        for row, index in self._indexes(key):
+            self.table[row][index] += 1
+            value = self.table[row][index]
+            estimate = value if estimate is None else min(estimate, value)
+        return estimate
+
+
+class TrendingTracker:
+    """热门关键词：Count-Min Sketch 估计次数，字典保存当前前 k 个关键词"""
+
+    def __init__(self, k: int = 20):
+        self.k = k
+        self.sketch = CountMinSketch()
+        self.top: dict = {}
+
+    def add(self, key: str) -> int:
+        """计数加一，返回估计的出现次数"""
+        estimate = self.sketch.add(key)
+        if key in self.top or len(self.top) < self.k:
+            self.top[key] = estimate
+            return estimate
+
+        # 超过当前最小的候选时替换它（k 很小，线性查找即可）
+        weakest = min(self.top, key=self.top.get)
+        if estimate > self.top[weakest]:
+            del self.top[weakest]
+            self.top[key] = estimate
+        return estimate
+
+    def dump(self) -> dict:
+        return {"table": self.sketch.table, "top": self.top}
+
+    def load(self, state: dict):
+        table = state["table"]
+        if len(table) == self.sketch.depth and all(len(row) == self.sketch.width for row in table):
+            self.sketch.table = table
+        self.top = dict(state["top"])
+        # k 变小时只保留得分最高的候选
+        if len(self.top) > self.k:
+            self.top = dict(sorted(self.top.items(), key=lambda item: item[1], reverse=True)[:self.k])
+
+    def most_common(self, limit: int) -> List[dict]:
+        ranked = sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+        return [{"keyword": key, "count": count} for key, count in ranked[:limit]]
+
+
+class SearchHistory:
+    """搜索历史（单进程）：记录一次搜索的耗时为 O(1)"""
+
+    def __init__(self, log_path: Optional[str], capacity: int = 50, top_k: int = 20, max_log_bytes: int = 1 << 20):
+        self.recent: deque = deque(maxlen=capacity)
+        self.trending = TrendingTracker(top_k)
+        self.total = 0
+        self.max_log_bytes = max_log_bytes
+        self._path = Path(log_path) if log_path else None
+        self._log = None
+        self._log_bytes = 0
+        self._compact_at = max_log_bytes
+        # 等待写入日志的记录（已序列化的行）和正在写入的后台任务
+        self._pending: List[str] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+        if self._path:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._replay(self._path)
+            if self._path.exists() and self._path.stat().st_size > max_log_bytes > 0:
+                self.compact()
+            else:
+                self._open_log()
+
+    def _open_log(self):
+        self._log = open(self._path, "a", encoding="utf-8")
+        self._log_bytes = self._log.tell()
+
+    def approx_bytes(self) -> int:
+        """大致占用的内存（字节）：最近记录、Count-Min Sketch 表和热门候选"""
+        table = sum(sampled_size(row) for row in self.trending.sketch.table)
+        return sampled_size(self.recent) + table + sampled_size(self.trending.top)
+
+    def after_fork(self):
+        """fork 出的子进程中调用：重新打开日志文件，不与父进程共用同一个文件对象；未写入的记录由父进程负责"""
+        self._pending = []
+        self._flusher = None
+        if self._log:
+            self._log.close()
+            self._open_log()
+
+    def _replay(self, path: Path):
+        """启动时逐行回放日志，恢复最近记录和热门统计"""
+        if not path.exists():
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程异常退出时最后一行可能不完整
+                    continue
+                if "state" in entry:
+                    self._load_state(entry["state"])
+                else:
+                    self._remember(entry)
+
+    def _load_state(self, state: dict):
+        """压缩后的状态行：直接恢复，最近记录不重复计数"""
+        self.total = state["total"]
+        self.trending.load(state["trending"])
+        self.recent.clear()
+        self.recent.extend(state["recent"])
+
+    def _state(self) -> dict:
+        """当前状态的副本（Sketch 表按行复制），可以在线程中序列化"""
+        trending = self.trending.dump()
+        trending = {"table": [row[:] for row in trending["table"]], "top": dict(trending["top"])}
+        return {"total": self.total, "trending": trending, "recent": list(self.recent)}
+
+    def compact(self):
+        """把日志重写为一行状态：写入临时文件后替换，中途退出时原日志仍然完整"""
+        if self._path is None:
+            return
+        self._rewrite(self._state())
+
+    def _rewrite(self, state: dict):
+        if self._log:
+            self._log.close()
+        tmp = self._path.with_name(self._path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"state": state}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path)
+        self._open_log()
+        # 状态行本身接近上限时（max_log_bytes 很小），至少再追加同样多的记录才压缩，避免每次记录都重写
+        self._compact_at = max(self.max_log_bytes, self._log_bytes * 2)
+
+    def _remember(self, entry: dict) -> int:
+        self.recent.appendleft(entry)
+        self.total += 1
+        return self.trending.add(entry.get("key") or entry["keyword"])
+
+    def _write(self, lines: str, state: Optional[dict]):
+        """在线程中执行：追加一批记录；state 不为 None 时改为压缩（state 已包含这批记录）"""
+        if state is not None:
+            self._rewrite(state)
+            return
+        self._log.write(lines)
+        self._log.flush()
+        self._log_bytes = self._log.tell()
+
+    async def _flush(self):
+        """后台写入日志：写入期间新增的记录在下一批中一起写入，同一时间只有一个批次在写"""
+        try:
+            while self._pending:
+                lines = "".join(self._pending)
+                self._pending = []
+                state = None
+                if self.max_log_bytes > 0 and self._log_bytes + len(lines.encode("utf-8")) > self._compact_at:
+                    state = self._state()
+                try:
+                    await asyncio.to_thread(self._write, lines, state)
+                except OSError as e:
+                    print(f"⚠️ 搜索历史写入失败: {e}")
+        finally:
+            self._flusher = None
+
+    async def flush(self):
+        """等待已记录的搜索全部写入日志（关闭时调用）"""
+        while self._flusher is not None:
+            await asyncio.shield(self._flusher)
+
+    async def record(self, keyword: str, results_count: int, key: Optional[str] = None) -> int:
+        """记录一次搜索，返回该关键词估计的搜索次数；key 为用于热门统计的规范化关键词
+
+        内存中的统计立即更新，日志由后台任务批量写入
+        """
+        entry = make_entry(keyword, results_count, key)
+        estimate = self._remember(entry)
+
+        if self._log:
+            self._pending.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            if self._flusher is None:
+                self._flusher = asyncio.create_task(self._flush())
+        return estimate
+
+    async def latest(self, limit: int) -> List[dict]:
+        """最近的搜索记录（最新的在前）"""
+        return list(islice(self.recent, limit))
+
+    async def trending_searches(self, limit: int) -> List[dict]:
+        """热门搜索关键词（次数为估计值）"""
+        return self.trending.most_common(limit)
+
+    async def count(self) -> int:
+        """累计搜索次数"""
+        return self.total
+
+
+class SharedSearchHistory:
+    """搜索历史（多进程）：保存在共享状态后端，接口与 SearchHistory 相同"""
+
+    RECENT_KEY = "history:recent"
+    TOTAL_KEY = "history:total"
+    TRENDING_KEY = "history:trending"
+
+    # 每记录这么多次搜索，裁剪一次热门关键词集合，保持内存有界
+    TRIM_EVERY = 100
+
+    def __init__(self, backend: StateBackend, capacity: int = 50, top_k: int = 20):
+        self.backend = backend
+        self.capacity = capacity
+        self.top_k = top_k
+
+    async def record(self, keyword: str, results_count: int, key: Optional[str] = None) -> int:
+        """记录一次搜索，返回该关键词的搜索次数"""
+        entry = make_entry(keyword, results_count, key)
+        await self.backend.push_recent(self.RECENT_KEY, entry, self.capacity)
+        total = await self.backend.incr(self.TOTAL_KEY)
+        searches = await self.backend.zincr(self.TRENDING_KEY, key or keyword)
+        if total % self.TRIM_EVERY == 0:
+            await self.backend.ztrim(self.TRENDING_KEY, self.top_k * 10)
+        return int(searches)
+
+    def after_fork(self):
+        """没有自己的连接，共享状态后端的连接由后端重置"""
+
+    async def flush(self):
+        """每次记录都直接写入共享状态后端，没有需要等待的写入"""
+
+    async def latest(self, limit: int) -> List[dict]:
+        return await self.backend.recent(self.RECENT_KEY, limit)
+
+    async def trending_searches(self, limit: int) -> List[dict]:
+        top = await self.backend.ztop(self.TRENDING_KEY, min(limit, self.top_k))
+        return [{"keyword": keyword, "count": int(count)} for keyword, count in top]
+
+    async def count(self) -> int:
+        return await self.backend.incr(self.TOTAL_KEY, 0)
+
+
+def make_entry(keyword: str, results_count: int, key: Optional[str]) -> dict:
+    """生成一条搜索记录"""
+    entry = {
+        "keyword": keyword,
+        "timestamp": datetime.now().isoformat(),
+        "results_count": results_count,
+    }
+    if key and key != keyword:
+        entry["key"] = key
+    return entry
+
+
+__all__ = ['SearchHistory', 'SharedSearchHistory', 'CountMinSketch', 'TrendingTracker']
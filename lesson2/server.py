@@ -0,0 +1,160 @@
+"""
+生产环境启动脚本
+用法：
+    python server.py
+
+主进程创建监听 socket，（可选）预热缓存后 fork 出多个 worker 共用该 socket；
+预热的数据在 fork 之后以写时复制（copy-on-write）方式由所有 worker 共享；
+数据库连接、Redis 连接和日志文件在 fork 后由 worker 重新打开（main.reset_after_fork）。
+收到 SIGTERM/SIGINT 时通知所有 worker 停止接收新连接，处理完进行中的请求后退出。
+不支持 fork 的系统（Windows）退回 uvicorn 自带的多进程模式（不预热）。
+"""
+import asyncio
+import gc
+import importlib.util
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from config import settings
+
+
+def pick_implementations() -> tuple:
+    """有 uvloop/httptools 时使用它们（uvicorn[standard] 会安装），否则使用纯 Python 实现"""
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return loop, http
+
+
+def worker_count() -> int:
+    """WORKERS 为 0 时：使用共享状态后端（sqlite/redis）时与 CPU 核数相同，local 时只启动一个 worker"""
+    if settings.WORKERS:
+        return settings.WORKERS
+    if settings.STATE_BACKEND == "local":
+        return 1
+    return os.cpu_count() or 1
+
+
+def warn_local_state(workers: int):
+    """local 后端的状态只在单个进程内有效，多个 worker 时每个 worker 的数据各不相同"""
+    if workers > 1 and settings.STATE_BACKEND == "local":
+        print(
+            f"⚠️  警告: STATE_BACKEND=local 时 {workers} 个 worker 各自保存搜索缓存、搜索历史和限流计数，"
+            "不同请求可能看到不同的数据，限流也按 worker 分别计算！\n"
+            "    请设置 STATE_BACKEND=sqlite（同一台机器）或 redis，或设置 WORKERS=1"
+        )
+
+
+def server_options() -> dict:
+    """uvicorn 参数（所有 worker 相同）"""
+    loop, http = pick_implementations()
+    return {
+        "host": settings.HOST,
+        "port": settings.PORT,
+        "loop": loop,
+        "http": http,
+        "backlog": settings.BACKLOG,
+        "timeout_keep_alive": settings.KEEP_ALIVE_TIMEOUT,
+        "timeout_graceful_shutdown": settings.GRACEFUL_TIMEOUT,
+        "access_log": settings.ACCESS_LOG,
+    }
+
+
+def bind_socket() -> socket.socket:
+    """创建所有 worker 共用的监听 socket"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((settings.HOST, settings.PORT))
+    sock.listen(settings.BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket):
+    """worker 进程：在共用的 socket 上运行 uvicorn，收到 SIGTERM 后优雅退出"""
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, **server_options()))
+    server.run(sockets=[sock])
+
+
+def spawn(sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # 子进程使用独立的进程组：终端的 Ctrl+C 只发给主进程，由主进程统一通知一次
+        # （uvicorn 收到第二次信号会立即强制退出，不再等待进行中的请求）
+        os.setpgid(0, 0)
+        # 恢复默认的信号处理，由 uvicorn 重新设置
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            run_worker(sock)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def prefork():
+    """主进程：预热、fork worker、转发退出信号，意外退出的 worker 会被重新启动"""
+    sock = bind_socket()
+
+    # 在主进程中导入应用（模块、模板、模拟数据等），worker 共享这部分内存
+    import main as application
+
+    if settings.PREFORK_WARMUP:
+        start = time.perf_counter()
+        asyncio.run(application.warm_up())
+        print(f"🔥 缓存预热完成，耗时 {time.perf_counter() - start:.2f} 秒")
+    # 预热的对象移出垃圾回收的扫描范围，避免 worker 中的 GC 写入这些内存页破坏写时复制
+    gc.freeze()
+
+    workers = {spawn(sock) for _ in range(worker_count())}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"⚠️  worker {pid} 意外退出（状态 {status}），重新启动")
+            workers.add(spawn(sock))
+
+    sock.close()
+    print("👋 所有 worker 已退出")
+
+
+def main():
+    loop, http = pick_implementations()
+    print("🎬 TMDB 电影搜索系统（生产模式）启动中...")
+    print(f"🌐 访问: http://{settings.HOST}:{settings.PORT}")
+    print(f"⚙️  worker: {worker_count()}  事件循环: {loop}  HTTP 解析: {http}")
+    warn_local_state(worker_count())
+    print(f"📊 模拟数据模式: {'开启' if settings.USE_MOCK_DATA else '关闭'}")
+
+    if hasattr(os, "fork"):
+        prefork()
+    else:
+        uvicorn.run("main:app", workers=worker_count(), **server_options())
+
+
+if __name__ == "__main__":
+    main()
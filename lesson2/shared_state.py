@@ -0,0 +1,588 @@
+"""
+共享状态模块
+多个 worker 进程之间共享缓存、搜索历史等可变状态
+
+- local:  进程内存储（单进程部署，默认）
+- sqlite: 同一台机器上的多个 worker 共享一个 SQLite 文件
+- redis:  Redis 协议（RESP）服务，可跨机器共享；本模块也提供了一个简易的本地替身服务
+
+用法（启动本地替身服务）：
+    python shared_state.py --port 6380
+"""
+import abc
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from cache import TTLCache
+from memory import sampled_size
+
+
+class StateBackend(abc.ABC):
+    """共享状态后端接口
+
+    - 键值：get / set（带过期时间）/ expires_at / delete / incr（可以设置过期时间，从计数器创建时算起）
+    - 列表：push_recent（头部插入并截断）/ recent
+    - 计分：zincr（增加成员得分）/ ztop（得分最高的成员）/ ztrim（只保留得分最高的若干成员）
+    """
+
+    def after_fork(self):
+        """fork 出的子进程中调用，丢弃从父进程继承的连接（默认没有连接）"""
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Any:
+        """读取键值，不存在或已过期时返回 None"""
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Any, ttl: float):
+        """写入键值，ttl 秒后过期"""
+
+    @abc.abstractmethod
+    async def expires_at(self, key: str) -> Optional[float]:
+        """键值的过期时间（time.time() 时间戳），不存在、已过期或没有过期时间时返回 None"""
+
+    @abc.abstractmethod
+    async def delete(self, key: str):
+        """删除键值"""
+
+    @abc.abstractmethod
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """计数器加 amount，返回新值；ttl 只在创建计数器时生效"""
+
+    @abc.abstractmethod
+    async def push_recent(self, key: str, value: Any, maxlen: int):
+        """在列表头部插入，只保留最新的 maxlen 个"""
+
+    @abc.abstractmethod
+    async def recent(self, key: str, limit: int) -> List[Any]:
+        """列表中最新的 limit 个（最新的在前）"""
+
+    @abc.abstractmethod
+    async def zincr(self, key: str, member: str, amount: float = 1) -> float:
+        """增加成员得分，返回新得分"""
+
+    @abc.abstractmethod
+    async def ztop(self, key: str, limit: int) -> List[Tuple[str, float]]:
+        """得分最高的 limit 个成员及得分"""
+
+    @abc.abstractmethod
+    async def ztrim(self, key: str, keep: int):
+        """只保留得分最高的 keep 个成员"""
+
+
+class LocalBackend(StateBackend):
+    """进程内存储：不做序列化，只在单个进程内有效"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.values = TTLCache(maxsize=maxsize)
+        self.counters: Counter = Counter()
+        self.lists: Dict[str, deque] = {}
+        self.zsets: Dict[str, Counter] = {}
+
+    def approx_bytes(self) -> int:
+        """计数器、列表和计分集合大致占用的内存（字节）；键值缓存 values 由内存预算单独统计"""
+        return (
+            sampled_size(self.counters)
+            + sys.getsizeof(self.lists) + sum(sampled_size(items) for items in self.lists.values())
+            + sys.getsizeof(self.zsets) + sum(sampled_size(scores) for scores in self.zsets.values())
+        )
+
+    async def get(self, key: str) -> Any:
+        return self.values.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self.values.set(key, value, ttl)
+
+    async def expires_at(self, key: str) -> Optional[float]:
+        return self.values.expires_at(key)
+
+    async def delete(self, key: str):
+        self.values.delete(key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        # 带过期时间的计数器保存在缓存中，增加计数时不延长过期时间
+        expires_at = self.values.expires_at(key)
+        if expires_at is not None:
+            value = self.values.get(key) + amount
+            self.values.set(key, value, expires_at - time.time())
+            return value
+        if ttl is None:
+            self.counters[key] += amount
+            return self.counters[key]
+        self.values.set(key, amount, ttl)
+        return amount
+
+    async def push_recent(self, key: str, value: Any, maxlen: int):
+        items = self.lists.get(key)
+        if items is None or items.maxlen != maxlen:
+            items = self.lists[key] = deque(items or (), maxlen=maxlen)
+        items.appendleft(value)
+
+    async def recent(self, key: str, limit: int) -> List[Any]:
+        return list(self.lists.get(key, ()))[:limit]
+
+    async def zincr(self, key: str, member: str, amount: float = 1) -> float:
+        scores = self.zsets.setdefault(key, Counter())
+        scores[member] += amount
+        return scores[member]
+
+    async def ztop(self, key: str, limit: int) -> List[Tuple[str, float]]:
+        return self.zsets.get(key, Counter()).most_common(limit)
+
+    async def ztrim(self, key: str, keep: int):
+        scores = self.zsets.get(key)
+        if scores and len(scores) > keep:
+            self.zsets[key] = Counter(dict(scores.most_common(keep)))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL);
+CREATE TABLE IF NOT EXISTS lists (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, value TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_lists_key ON lists (key, id);
+CREATE TABLE IF NOT EXISTS zsets (key TEXT NOT NULL, member TEXT NOT NULL, score REAL NOT NULL,
+                                  PRIMARY KEY (key, member));
+CREATE INDEX IF NOT EXISTS idx_zsets_score ON zsets (key, score);
+"""
+
+
+class SQLiteBackend(StateBackend):
+    """SQLite 存储（WAL 模式）：同一台机器上的多个 worker 共享，数据以 JSON 保存"""
+
+    # 每写入这么多次键值，清理一次过期条目
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(SQLITE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """fork 出的子进程中调用：不再使用父进程打开的连接（不关闭，避免影响父进程），之后按需重新连接"""
+        self._inherited = self._local
+        self._local = threading.local()
+
+    async def _run(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    def _get(self, key: str) -> Any:
+        row = self._connect().execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: Any, ttl: float):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM kv WHERE expires_at < ?", (time.time(),))
+
+    def _expires_at(self, key: str) -> Optional[float]:
+        row = self._connect().execute("SELECT expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] is None or row[0] < time.time():
+            return None
+        return row[0]
+
+    def _delete(self, key: str):
+        self._connect().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _incr(self, key: str, amount: int, ttl: Optional[float]) -> int:
+        conn = self._connect()
+        now = time.time()
+        # 已过期的计数器从头计数
+        conn.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN expires_at < ? THEN excluded.value ELSE CAST(value AS INTEGER) + excluded.value END, "
+            "expires_at = CASE WHEN expires_at < ? THEN excluded.expires_at ELSE expires_at END",
+            (key, amount, now + ttl if ttl is not None else None, now, now),
+        )
+        return int(conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0])
+
+    def _push_recent(self, key: str, value: Any, maxlen: int):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO lists (key, value) VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False)))
+            conn.execute(
+                "DELETE FROM lists WHERE key = ? AND id NOT IN "
+                "(SELECT id FROM lists WHERE key = ? ORDER BY id DESC LIMIT ?)",
+                (key, key, maxlen),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _recent(self, key: str, limit: int) -> List[Any]:
+        rows = self._connect().execute(
+            "SELECT value FROM lists WHERE key = ? ORDER BY id DESC LIMIT ?", (key, limit)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _zincr(self, key: str, member: str, amount: float) -> float:
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO zsets (key, member, score) VALUES (?, ?, ?) "
+            "ON CONFLICT(key, member) DO UPDATE SET score = score + excluded.score",
+            (key, member, amount),
+        )
+        return conn.execute("SELECT score FROM zsets WHERE key = ? AND member = ?", (key, member)).fetchone()[0]
+
+    def _ztop(self, key: str, limit: int) -> List[Tuple[str, float]]:
+        rows = self._connect().execute(
+            "SELECT member, score FROM zsets WHERE key = ? ORDER BY score DESC LIMIT ?", (key, limit)
+        ).fetchall()
+        return [(member, score) for member, score in rows]
+
+    def _ztrim(self, key: str, keep: int):
+        self._connect().execute(
+            "DELETE FROM zsets WHERE key = ? AND member NOT IN "
+            "(SELECT member FROM zsets WHERE key = ? ORDER BY score DESC LIMIT ?)",
+            (key, key, keep),
+        )
+
+    async def get(self, key: str) -> Any:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._run(self._set, key, value, ttl)
+
+    async def expires_at(self, key: str) -> Optional[float]:
+        return await self._run(self._expires_at, key)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return await self._run(self._incr, key, amount, ttl)
+
+    async def push_recent(self, key: str, value: Any, maxlen: int):
+        await self._run(self._push_recent, key, value, maxlen)
+
+    async def recent(self, key: str, limit: int) -> List[Any]:
+        return await self._run(self._recent, key, limit)
+
+    async def zincr(self, key: str, member: str, amount: float = 1) -> float:
+        return await self._run(self._zincr, key, member, amount)
+
+    async def ztop(self, key: str, limit: int) -> List[Tuple[str, float]]:
+        return await self._run(self._ztop, key, limit)
+
+    async def ztrim(self, key: str, keep: int):
+        await self._run(self._ztrim, key, keep)
+
+
+# ========== Redis 协议（RESP） ==========
+
+def encode_command(*args) -> bytes:
+    """把命令编码为 RESP 数组"""
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+    return b"".join(parts)
+
+
+class RedisError(RuntimeError):
+    """服务端返回的错误回复（回复已完整读取，连接仍然可用）"""
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """读取一个 RESP 回复"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("连接已关闭")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        raise RedisError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RuntimeError(f"无法解析的回复: {line!r}")
+
+
+class RedisBackend(StateBackend):
+    """Redis 协议后端：单连接，命令按顺序执行；数据以 JSON 保存"""
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _open(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._send("AUTH", self.password)
+        if self.db:
+            await self._send("SELECT", self.db)
+
+    async def _send(self, *args) -> Any:
+        self._writer.write(encode_command(*args))
+        await self._writer.drain()
+        return await read_reply(self._reader)
+
+    async def command(self, *args) -> Any:
+        """执行一条命令；连接断开时重连一次
+
+        命令已发出但回复没有读完（被取消、回复无法解析）时关闭连接，
+        否则这个回复会留在连接上，被下一条命令当作自己的回复读取
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._open()
+                    return await self._send(*args)
+                except RedisError:
+                    raise
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    self._reset()
+                    if attempt:
+                        raise
+                except BaseException:
+                    self._reset()
+                    raise
+
+    def after_fork(self):
+        """fork 出的子进程中调用：父进程的连接和锁属于父进程的事件循环，直接丢弃，之后重新连接"""
+        self._reader = self._writer = None
+        self._lock = None
+
+    def _reset(self):
+        """丢弃当前连接（不等待关闭完成），下一条命令重新连接"""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def close(self):
+        """关闭连接（之后的命令会重新连接）"""
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    async def get(self, key: str) -> Any:
+        data = await self.command("GET", key)
+        return json.loads(data) if data is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self.command("SET", key, json.dumps(value, ensure_ascii=False), "PX", max(int(ttl * 1000), 1))
+
+    async def expires_at(self, key: str) -> Optional[float]:
+        # PTTL：剩余毫秒数，键不存在时为 -2，没有过期时间时为 -1
+        remaining = await self.command("PTTL", key)
+        return time.time() + remaining / 1000 if remaining >= 0 else None
+
+    async def delete(self, key: str):
+        await self.command("DEL", key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        value = await self.command("INCRBY", key, amount)
+        if ttl is not None and value == amount:
+            # 新建的计数器设置过期时间
+            await self.command("PEXPIRE", key, max(int(ttl * 1000), 1))
+        return value
+
+    async def push_recent(self, key: str, value: Any, maxlen: int):
+        await self.command("LPUSH", key, json.dumps(value, ensure_ascii=False))
+        await self.command("LTRIM", key, 0, maxlen - 1)
+
+    async def recent(self, key: str, limit: int) -> List[Any]:
+        items = await self.command("LRANGE", key, 0, limit - 1)
+        return [json.loads(item) for item in items]
+
+    async def zincr(self, key: str, member: str, amount: float = 1) -> float:
+        return float(await self.command("ZINCRBY", key, amount, member))
+
+    async def ztop(self, key: str, limit: int) -> List[Tuple[str, float]]:
+        items = await self.command("ZREVRANGE", key, 0, limit - 1, "WITHSCORES")
+        return [(items[i].decode("utf-8"), float(items[i + 1])) for i in range(0, len(items), 2)]
+
+    async def ztrim(self, key: str, keep: int):
+        await self.command("ZREMRANGEBYRANK", key, 0, -(keep + 1))
+
+
+def create_backend(kind: str, url: str = "", path: str = "", maxsize: int = 10000) -> StateBackend:
+    """根据配置创建共享状态后端；maxsize 只对 local 生效"""
+    if kind == "local":
+        return LocalBackend(maxsize)
+    if kind == "sqlite":
+        return SQLiteBackend(path)
+    if kind == "redis":
+        return RedisBackend(url or "redis://127.0.0.1:6379/0")
+    raise ValueError(f"不支持的共享状态后端: {kind}")
+
+
+# ========== 本地替身服务 ==========
+
+class MiniRedisServer:
+    """简易的 Redis 协议服务，只实现本模块用到的命令，用于本地开发和测试"""
+
+    def __init__(self):
+        self.values: Dict[bytes, Tuple[Any, Optional[float]]] = {}
+
+    def _get(self, key: bytes, default=None):
+        item = self.values.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            del self.values[key]
+            return default
+        return value
+
+    def execute(self, name: str, args: List[bytes]) -> bytes:
+        """执行命令，返回编码后的回复"""
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("SELECT", "AUTH"):
+            return b"+OK\r\n"
+        if name == "GET":
+            return bulk(self._get(args[0]))
+        if name == "SET":
+            expires_at = None
+            if len(args) >= 4 and args[2].upper() == b"PX":
+                expires_at = time.time() + int(args[3]) / 1000
+            elif len(args) >= 4 and args[2].upper() == b"EX":
+                expires_at = time.time() + int(args[3])
+            self.values[args[0]] = (args[1], expires_at)
+            return b"+OK\r\n"
+        if name == "DEL":
+            removed = sum(self.values.pop(key, None) is not None for key in args)
+            return f":{removed}\r\n".encode()
+        if name == "INCRBY":
+            value = int(self._get(args[0], b"0")) + int(args[1])
+            expires_at = self.values[args[0]][1] if args[0] in self.values else None
+            self.values[args[0]] = (str(value).encode(), expires_at)
+            return f":{value}\r\n".encode()
+        if name == "PTTL":
+            if self._get(args[0]) is None:
+                return b":-2\r\n"
+            expires_at = self.values[args[0]][1]
+            if expires_at is None:
+                return b":-1\r\n"
+            return f":{max(int((expires_at - time.time()) * 1000), 0)}\r\n".encode()
+        if name == "PEXPIRE":
+            value = self._get(args[0])
+            if value is None:
+                return b":0\r\n"
+            self.values[args[0]] = (value, time.time() + int(args[1]) / 1000)
+            return b":1\r\n"
+        if name == "LPUSH":
+            items = self._get(args[0], [])
+            items[0:0] = reversed(args[1:])
+            self.values[args[0]] = (items, None)
+            return f":{len(items)}\r\n".encode()
+        if name == "LTRIM":
+            items = self._get(args[0], [])
+            start, stop = int(args[1]), int(args[2])
+            self.values[args[0]] = (items[start:stop + 1 if stop != -1 else None], None)
+            return b"+OK\r\n"
+        if name == "LRANGE":
+            items = self._get(args[0], [])
+            start, stop = int(args[1]), int(args[2])
+            return array([bulk(item) for item in items[start:stop + 1 if stop != -1 else None]])
+        if name == "ZINCRBY":
+            scores = self._get(args[0], {})
+            scores[args[2]] = scores.get(args[2], 0) + float(args[1])
+            self.values[args[0]] = (scores, None)
+            return bulk(repr(scores[args[2]]).encode())
+        if name in ("ZREVRANGE", "ZREMRANGEBYRANK"):
+            scores = self._get(args[0], {})
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=(name == "ZREVRANGE"))
+            start, stop = int(args[1]), int(args[2])
+            if stop < 0:
+                stop += len(ranked)
+            selected = ranked[start:stop + 1]
+            if name == "ZREMRANGEBYRANK":
+                for member, _ in selected:
+                    del scores[member]
+                return f":{len(selected)}\r\n".encode()
+            return array([part for member, score in selected for part in (bulk(member), bulk(repr(score).encode()))])
+        return f"-ERR unknown command '{name}'\r\n".encode()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await read_reply(reader)
+                writer.write(self.execute(request[0].decode().upper(), request[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"🧪 本地 Redis 替身服务: redis://{host}:{port}/0")
+        async with server:
+            await server.serve_forever()
+
+
+def bulk(value: Optional[bytes]) -> bytes:
+    """编码 RESP 字符串回复"""
+    if value is None:
+        return b"$-1\r\n"
+    return f"${len(value)}\r\n".encode() + value + b"\r\n"
+
+
+def array(items: List[bytes]) -> bytes:
+    """编码 RESP 数组回复（元素已编码）"""
+    return f"*{len(items)}\r\n".encode() + b"".join(items)
+
+
+__all__ = [
+    'StateBackend', 'LocalBackend', 'SQLiteBackend', 'RedisBackend', 'RedisError', 'create_backend', 'MiniRedisServer',
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 Redis 协议替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+    asyncio.run(MiniRedisServer().serve(args.host, args.port))
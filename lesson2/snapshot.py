@@ -0,0 +1,298 @@
+"""
+快照模块
+把内存中的缓存和索引写入带版本号的紧凑二进制文件；启动时以内存映射（mmap）方式打开，
+数据在第一次访问时才解码，新进程无需重新请求上游即可使用之前的缓存
+
+文件格式（整数均为小端）：
+    魔数 b"TMDBSNAP" | 版本 u32 | 段数量 u32 |
+    每段：名称长度 u16、名称（UTF-8）、偏移 u64、长度 u64 | 各段数据（按 8 字节对齐）
+字节串列表（BlobList）的格式：
+    数量 u64 | 偏移 u64 × (数量 + 1) | 数据
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"TMDBSNAP"
+# 格式变化（包括段内编码）时递增，旧版本的快照会被忽略
+SNAPSHOT_VERSION = 2
+
+
+def align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def write_snapshot(path: str, sections: Dict[str, bytes]):
+    """写入快照：先写临时文件再替换，进程中途退出也不会留下不完整的快照"""
+    names = list(sections)
+    header_size = 16 + sum(2 + len(name.encode("utf-8")) + 16 for name in names)
+    offset = align(header_size)
+
+    header = [MAGIC, struct.pack("<II", SNAPSHOT_VERSION, len(names))]
+    for name in names:
+        encoded = name.encode("utf-8")
+        header.append(struct.pack("<H", len(encoded)) + encoded)
+        header.append(struct.pack("<QQ", offset, len(sections[name])))
+        offset = align(offset + len(sections[name]))
+
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(b"".join(header))
+        for name in names:
+            f.seek(align(f.tell()))
+            f.write(sections[name])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, target)
+
+
+class Snapshot:
+    """只读快照：各段以 memoryview 的形式直接引用映射的文件，不复制数据"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError("不是快照文件")
+        version, count = struct.unpack_from("<II", view, 8)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"快照版本不兼容: {version}")
+
+        self.sections: Dict[str, memoryview] = {}
+        position = 16
+        for _ in range(count):
+            (length,) = struct.unpack_from("<H", view, position)
+            name = bytes(view[position + 2:position + 2 + length]).decode("utf-8")
+            offset, size = struct.unpack_from("<QQ", view, position + 2 + length)
+            self.sections[name] = view[offset:offset + size]
+            position += 2 + length + 16
+
+    def section(self, name: str) -> Optional[memoryview]:
+        return self.sections.get(name)
+
+    @property
+    def size(self) -> int:
+        return len(self._mmap)
+
+
+def open_snapshot(path: str) -> Optional[Snapshot]:
+    """打开快照，文件不存在或版本不兼容时返回 None"""
+    if not path or not Path(path).exists():
+        return None
+    try:
+        return Snapshot(path)
+    except (ValueError, OSError, struct.error) as e:
+        print(f"⚠️  忽略快照 {path}: {e}")
+        return None
+
+
+# ========== 字节串列表 ==========
+
+def encode_blobs(items: Iterable[bytes]) -> bytes:
+    """把一组字节串编码为 BlobList"""
+    items = list(items)
+    offsets = array("Q", accumulate(map(len, items), initial=0))
+    if sys.byteorder != "little":
+        raise RuntimeError("快照只支持小端平台")
+    return struct.pack("<Q", len(items)) + offsets.tobytes() + b"".join(items)
+
+
+class BlobList:
+    """BlobList 的只读视图，按下标取出字节串（引用映射的文件，不复制）"""
+
+    def __init__(self, view: memoryview):
+        (count,) = struct.unpack_from("<Q", view, 0)
+        self.count = count
+        self.offsets = view[8:8 + 8 * (count + 1)].cast("Q")
+        self.data = view[8 + 8 * (count + 1):]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> memoryview:
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        for i in range(self.count):
+            yield self[i]
+
+
+class LazyList:
+    """从快照恢复的列表：元素第一次读取时才解码，之后保存在内存中；可以修改和追加"""
+
+    def __init__(self, base: BlobList, decode: Callable[[memoryview], Any], encode: Callable[[Any], bytes]):
+        self.base = base
+        self.decode = decode
+        self.encode = encode
+        self.loaded: Dict[int, Any] = {}
+        self.extra: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.extra)
+
+    def __getitem__(self, i: int) -> Any:
+        if i < 0:
+            i += len(self)
+        if i >= len(self.base):
+            return self.extra[i - len(self.base)]
+        value = self.loaded.get(i)
+        if value is None:
+            value = self.loaded[i] = self.decode(self.base[i])
+        return value
+
+    def __setitem__(self, i: int, value: Any):
+        if i >= len(self.base):
+            self.extra[i - len(self.base)] = value
+        else:
+            self.loaded[i] = value
+
+    def append(self, value: Any):
+        self.extra.append(value)
+
+    def copy(self) -> "LazyList":
+        """浅复制：快照部分共用，已解码和新增的元素复制一份"""
+        other = LazyList(self.base, self.decode, self.encode)
+        other.loaded = dict(self.loaded)
+        other.extra = list(self.extra)
+        return other
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def raw_items(self, encode: Optional[Callable[[Any], bytes]] = None) -> Iterator[bytes]:
+        """编码后的元素：未读取过的元素直接复制快照中的字节，不重新编码"""
+        encode = encode or self.encode
+        for i in range(len(self.base)):
+            value = self.loaded.get(i)
+            yield self.base[i] if value is None else encode(value)
+        for value in self.extra:
+            yield encode(value)
+
+
+class LazyDict:
+    """从快照恢复的字典：键按字节序排好，查找时二分；值第一次读取时才解码，之后保存在内存中"""
+
+    def __init__(self, keys: BlobList, values: BlobList,
+                 decode: Callable[[memoryview], Any], encode: Callable[[Any], bytes]):
+        self.keys = keys
+        self.values = values
+        self.decode = decode
+        self.encode = encode
+        self.loaded: Dict[str, Any] = {}
+
+    def _find(self, key: str) -> int:
+        """键在快照中的下标，不存在时返回 -1"""
+        target = key.encode("utf-8")
+        index = bisect.bisect_left(KeyView(self.keys), target)
+        if index < len(self.keys) and self.keys[index] == target:
+            return index
+        return -1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.loaded.get(key)
+        if value is not None:
+            return value
+        index = self._find(key)
+        if index < 0:
+            return default
+        value = self.loaded[key] = self.decode(self.values[index])
+        return value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.loaded[key] = value
+
+    def setdefault(self, key: str, default: Any) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = self.loaded[key] = default
+        return value
+
+    def __len__(self) -> int:
+        new_keys = sum(1 for key in self.loaded if self._find(key) < 0)
+        return len(self.keys) + new_keys
+
+    def copy(self) -> "LazyDict":
+        other = LazyDict(self.keys, self.values, self.decode, self.encode)
+        other.loaded = dict(self.loaded)
+        return other
+
+    def raw_items(self, encode: Optional[Callable[[Any], bytes]] = None) -> Iterator[Tuple[str, bytes]]:
+        """编码后的 (键, 值)：未读取过的值直接复制快照中的字节"""
+        encode = encode or self.encode
+        for index in range(len(self.keys)):
+            key = bytes(self.keys[index]).decode("utf-8")
+            if key not in self.loaded:
+                yield key, self.values[index]
+        for key, value in self.loaded.items():
+            yield key, encode(value)
+
+
+class KeyView:
+    """让 bisect 可以直接在 BlobList 上查找（比较时转换为 bytes）"""
+
+    def __init__(self, blobs: BlobList):
+        self.blobs = blobs
+
+    def __len__(self) -> int:
+        return len(self.blobs)
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self.blobs[i])
+
+
+def raw_list(items, encode: Callable[[Any], bytes]) -> Iterator[bytes]:
+    """列表中编码后的元素（LazyList 中未读取的元素不重新编码）"""
+    if isinstance(items, LazyList):
+        return items.raw_items(encode)
+    return map(encode, items)
+
+
+def raw_dict(items, encode: Callable[[Any], bytes]) -> Iterator[Tuple[str, bytes]]:
+    """字典中编码后的 (键, 值)（LazyDict 中未读取的值不重新编码）"""
+    if isinstance(items, LazyDict):
+        return items.raw_items(encode)
+    return ((key, encode(value)) for key, value in items.items())
+
+
+# 复用同一个编码器（json.dumps 带参数时每次都会新建编码器）
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_json(value: Any) -> bytes:
+    return JSON_ENCODER.encode(value).encode("utf-8")
+
+
+def decode_json(data: memoryview) -> Any:
+    return json.loads(bytes(data))
+
+
+def encode_sorted_dict(items: Iterable[Tuple[str, bytes]]) -> Tuple[bytes, bytes]:
+    """把 (键, 编码后的值) 按键排序，编码为两个 BlobList（键、值）"""
+    encoded = {key.encode("utf-8"): value for key, value in items}
+    keys = sorted(encoded)
+    return encode_blobs(keys), encode_blobs(map(encoded.__getitem__, keys))
+
+
+__all__ = [
+    'write_snapshot', 'open_snapshot', 'Snapshot', 'encode_blobs', 'encode_sorted_dict',
+    'BlobList', 'LazyList', 'LazyDict', 'raw_list', 'raw_dict', 'encode_json', 'decode_json',
+    'SNAPSHOT_VERSION',
+]
@@ -20,6 +20,36 @@ function showToast(message, type = 'info') {
     alert(message);
 }
 
+// ==================== 首页聚合数据 ====================
+
+// 首页数据：优先使用服务端内联的数据，否则首次需要时请求一次 /api/home
+let homeDataPromise = null;
+
+function getHomeData() {
+    if (!homeDataPromise) {
+        const inline = document.getElementById('home-data');
+        homeDataPromise = inline
+            ? Promise.resolve(JSON.parse(inline.textContent))
+            : fetch('/api/home').then(res => res.json());
+    }
+    return homeDataPromise;
+}
+
+// 每个板块只使用一次首页数据，之后的刷新走各自的接口
+const consumedHomeSections = new Set();
+
+async function takeHomeSection(name) {
+    if (consumedHomeSections.has(name)) return null;
+    consumedHomeSections.add(name);
+    try {
+        const data = await getHomeData();
+        return data[name] || null;
+    } catch (error) {
+        console.error('首页数据加载失败:', error);
+        return null;
+    }
+}
+
 // ==================== 标签页切换 ====================
 
 // 记录已加载的标签页，避免重复加载
@@ -81,18 +111,25 @@ function createMovieCard(movie, showFavoriteBtn = false) {
 
 // ==================== 搜索功能 ====================
 
+// 当前搜索请求的控制器，新搜索开始时取消旧的请求
+let searchController = null;
+
 async function searchMovies(keyword) {
     if (!keyword.trim()) {
         showToast('请输入搜索关键词');
         return;
     }
     
+    if (searchController) searchController.abort();
+    searchController = new AbortController();
+    const { signal } = searchController;
+    
     showLoading();
     const resultsDiv = document.getElementById('search-results');
     resultsDiv.innerHTML = '';
     
     try {
-        const response = await fetch(`/api/search?q=${encodeURIComponent(keyword)}&count=20`);
+        const response = await fetch(`/api/search?q=${encodeURIComponent(keyword)}&count=20`, { signal });
         
         // 检查响应状态
         if (!response.ok) {
@@ -137,6 +174,9 @@ async function searchMovies(keyword) {
             `找到 ${data.total} 个结果，显示前 ${data.movies.length} 个`;
             
     } catch (error) {
+        // 被新的搜索取消，交给新的搜索处理界面
+        if (error.name === 'AbortError') return;
+        
         hideLoading();
         console.error('搜索错误:', error);
         resultsDiv.innerHTML = `
@@ -164,6 +204,41 @@ document.getElementById('search-input').addEventListener('keypress', (e) => {
     }
 });
 
+// ==================== 搜索建议 ====================
+
+let suggestTimer = null;
+let suggestController = null;
+
+async function loadSuggestions(prefix) {
+    if (suggestController) suggestController.abort();
+    suggestController = new AbortController();
+    
+    try {
+        const response = await fetch(`/api/suggest?prefix=${encodeURIComponent(prefix)}&limit=8`, {
+            signal: suggestController.signal
+        });
+        const data = await response.json();
+        
+        const datalist = document.getElementById('search-suggestions');
+        datalist.innerHTML = '';
+        data.suggestions.forEach(text => {
+            const option = document.createElement('option');
+            option.value = text;
+            datalist.appendChild(option);
+        });
+    } catch (error) {
+        if (error.name !== 'AbortError') console.error('搜索建议加载失败:', error);
+    }
+}
+
+// 输入时防抖获取搜索建议
+document.getElementById('search-input').addEventListener('input', (e) => {
+    const prefix = e.target.value.trim();
+    if (suggestTimer) clearTimeout(suggestTimer);
+    if (!prefix) return;
+    suggestTimer = setTimeout(() => loadSuggestions(prefix), 150);
+});
+
 // ==================== Top250 ====================
 
 // 防止重复加载
@@ -178,8 +253,12 @@ async function loadTop250(page = 0) {
     
     try {
         const start = page * pageSize;
-        const response = await fetch(`/api/top250?start=${start}&count=${pageSize}`);
-        const data = await response.json();
+        // 第一页优先使用首页聚合数据
+        let data = page === 0 ? await takeHomeSection('top250') : null;
+        if (!data) {
+            const response = await fetch(`/api/top250?start=${start}&count=${pageSize}`);
+            data = await response.json();
+        }
         
         // 使用 DocumentFragment 减少重绘
         const fragment = document.createDocumentFragment();
@@ -238,14 +317,20 @@ async function loadTheaters() {
     }
     
     try {
-        // 并行请求两个接口，减少等待时间
-        const [theatersRes, comingRes] = await Promise.all([
-            fetch(`/api/in_theaters?city=${encodeURIComponent(city)}`),
-            fetch('/api/coming_soon')
-        ]);
-        
-        const theatersData = await theatersRes.json();
-        const comingData = await comingRes.json();
+        // 首次加载优先使用首页聚合数据
+        let theatersData = await takeHomeSection('in_theaters');
+        let comingData = await takeHomeSection('coming_soon');
+        
+        if (!theatersData || !comingData) {
+            // 并行请求两个接口，减少等待时间
+            const [theatersRes, comingRes] = await Promise.all([
+                fetch(`/api/in_theaters?city=${encodeURIComponent(city)}`),
+                fetch('/api/coming_soon')
+            ]);
+            
+            theatersData = await theatersRes.json();
+            comingData = await comingRes.json();
+        }
         
         // 使用 DocumentFragment 减少重绘次数
         const theatersFragment = document.createDocumentFragment();
@@ -0,0 +1,202 @@
+"""
+搜索建议模块
+前缀树的每个节点预先保存该前缀下得分最高的 k 个建议，查询耗时只与前缀长度有关
+"""
+import sys
+from array import array
+from typing import Dict, Iterator, List, Set, Tuple
+
+from memory import sampled_size
+from snapshot import BlobList, Snapshot, encode_blobs
+from title_index import normalize_text
+
+
+class SuggestNode:
+    """前缀树节点"""
+
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "SuggestNode"] = {}
+        # 该前缀下得分最高的建议 [(得分, 文本)]，按得分降序
+        self.top: List[tuple] = []
+
+
+class SuggestTrie:
+    """带 top-k 的前缀树
+
+    建议按规范化文本去重（"Avatar" 和 "avatar" 是同一条建议），显示时使用一个原始形式，标题的写法优先于搜索关键词；
+    建议的得分只增不减；前缀最多取 max_depth 个字符，超出部分不再建节点以控制内存；
+    搜索关键词最多保留 max_keywords 个，超出 1/4 时删除得分最低的关键词
+    """
+
+    def __init__(self, k: int = 10, max_depth: int = 16, max_keywords: int = 10000):
+        self.k = k
+        self.max_depth = max_depth
+        self.max_keywords = max_keywords
+        self.root = SuggestNode()
+        # 规范化文本 → 得分 / 显示文本；只来自搜索关键词（不是标题）的建议
+        self.scores: Dict[str, float] = {}
+        self.texts: Dict[str, str] = {}
+        self.keywords: Set[str] = set()
+        # 节点数和各节点 top-k 列表的条目总数（估算内存用）
+        self.nodes = 1
+        self.entries = 0
+
+    def add(self, text: str, score: float, keyword: bool = False):
+        """加入建议或提高其得分，耗时 O(前缀长度 × k)；keyword 表示来自搜索关键词"""
+        text = text.strip()
+        norm = normalize_text(text)
+        if not norm:
+            return
+        if norm not in self.texts:
+            self.texts[norm] = text
+            if keyword:
+                self.keywords.add(norm)
+        elif not keyword:
+            self.texts[norm] = text
+            self.keywords.discard(norm)
+        if self.scores.get(norm, -1) >= score:
+            return
+        self.scores[norm] = score
+
+        node = self.root
+        for char in norm[:self.max_depth]:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = SuggestNode()
+                self.nodes += 1
+            node = child
+            self._offer(node, norm, score)
+
+        if keyword and len(self.keywords) > self.max_keywords + self.max_keywords // 4:
+            self.trim_keywords(self.max_keywords)
+
+    def _offer(self, node: SuggestNode, norm: str, score: float):
+        """更新节点的 top-k 列表"""
+        top = node.top
+        for i, (_, existing) in enumerate(top):
+            if existing == norm:
+                del top[i]
+                self.entries -= 1
+                break
+        if len(top) >= self.k and score <= top[-1][0]:
+            return
+
+        position = len(top)
+        while position > 0 and top[position - 1][0] < score:
+            position -= 1
+        top.insert(position, (score, norm))
+        self.entries += 1
+        if len(top) > self.k:
+            del top[self.k:]
+            self.entries -= 1
+
+    def remove(self, norm: str):
+        """删除一条建议（规范化文本），同时删除不再有用的节点
+
+        被删除的条目之前挤出的候选不会补回，节点的候选可能暂时少于 k 个
+        """
+        if self.scores.pop(norm, None) is None:
+            return
+        del self.texts[norm]
+        self.keywords.discard(norm)
+
+        path = [self.root]
+        for char in norm[:self.max_depth]:
+            node = path[-1].children.get(char)
+            if node is None:
+                break
+            for i, (_, existing) in enumerate(node.top):
+                if existing == norm:
+                    del node.top[i]
+                    self.entries -= 1
+                    break
+            path.append(node)
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.children or node.top:
+                break
+            del path[depth - 1].children[norm[depth - 1]]
+            self.nodes -= 1
+
+    def trim_keywords(self, keep: int):
+        """只保留得分最高的 keep 个搜索关键词"""
+        if len(self.keywords) <= keep:
+            return
+        ranked = sorted(self.keywords, key=self.scores.__getitem__, reverse=True)
+        for norm in ranked[keep:]:
+            self.remove(norm)
+
+    def items(self) -> Dict[str, float]:
+        """{显示文本: 得分}"""
+        return {self.texts[norm]: score for norm, score in self.scores.items()}
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[str]:
+        """返回以 prefix 开头的建议（按得分降序）"""
+        full_key = normalize_text(prefix)
+        if not full_key:
+            return []
+
+        node = self.root
+        for char in full_key[:self.max_depth]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        if len(full_key) > self.max_depth:
+            # 前缀超过树的深度时，在最深节点的候选中再过滤
+            return [self.texts[norm] for _, norm in node.top if norm.startswith(full_key)][:limit]
+        return [self.texts[norm] for _, norm in node.top[:limit]]
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def approx_bytes(self) -> int:
+        """大致占用的内存（字节）：按节点数和条目数估算，规范化文本与 scores 共用"""
+        node = sys.getsizeof(SuggestNode()) + sys.getsizeof({}) + sys.getsizeof([])
+        # 每个条目：列表中的指针、(得分, 文本) 元组和得分
+        entry = 8 + sys.getsizeof((0.0, "")) + sys.getsizeof(0.0)
+        # 子节点字典中的每一项（另有字符本身，单个字符有缓存，忽略）
+        child = 40
+        return sampled_size(self.scores) + sampled_size(self.texts) + sampled_size(self.keywords) + self.nodes * (node + child) + self.entries * entry
+
+    def export(self) -> Tuple[Dict[str, float], Set[str]]:
+        """复制写入快照的数据：{显示文本: 得分} 和其中的搜索关键词，关键词只保留得分最高的 max_keywords 个"""
+        keywords = sorted(self.keywords, key=self.scores.__getitem__, reverse=True)[:self.max_keywords]
+        dropped = self.keywords.difference(keywords)
+        scores = {self.texts[norm]: score for norm, score in self.scores.items() if norm not in dropped}
+        return scores, {self.texts[norm] for norm in keywords}
+
+    def dump_snapshot(self) -> Dict[str, bytes]:
+        """编码为快照的各段：建议文本、得分和是否为搜索关键词"""
+        return encode_suggestions(*self.export())
+
+    def restore(self, snapshot: Snapshot, batch: int = 500) -> Iterator[int]:
+        """从快照逐条加入建议，每加入 batch 条 yield 一次已加入的数量，
+        调用方可以在两批之间让出事件循环；期间新加入的更高得分不会被覆盖
+        """
+        texts = snapshot.section("suggest.texts")
+        scores = snapshot.section("suggest.scores")
+        if texts is None or scores is None:
+            return
+        texts = BlobList(texts)
+        scores = scores.cast("d")
+        # 旧快照没有关键词标记，全部按标题恢复
+        keywords = snapshot.section("suggest.keywords")
+        for i in range(len(texts)):
+            self.add(bytes(texts[i]).decode("utf-8"), scores[i], keyword=keywords is not None and keywords[i] == 1)
+            if (i + 1) % batch == 0:
+                yield i + 1
+
+
+def encode_suggestions(scores: Dict[str, float], keywords: Set[str] = frozenset()) -> Dict[str, bytes]:
+    """把 {建议文本: 得分} 编码为快照的各段，keywords 为其中的搜索关键词（可以在其它线程中对复制的数据调用）"""
+    return {
+        "suggest.texts": encode_blobs(text.encode("utf-8") for text in scores),
+        "suggest.scores": array("d", scores.values()).tobytes(),
+        "suggest.keywords": bytes(text in keywords for text in scores),
+    }
+
+
+__all__ = ['SuggestTrie', 'encode_suggestions']
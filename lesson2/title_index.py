@@ -0,0 +1,227 @@
+"""
+标题倒排索引模块
+中文标题按字符二元组（bigram）切分，英文等拉丁文字按规范化后的单词切分，
+用于在本地已缓存的电影中搜索标题和原名
+"""
+import re
+import unicodedata
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from catalog import MovieCatalog
+from memory import sampled_size
+from snapshot import BlobList, LazyDict, LazyList, Snapshot, encode_blobs, encode_sorted_dict, raw_dict, raw_list
+
+
+# 中日韩文字（按字切分），其它字母数字按单词切分
+CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+WORD = re.compile(r"[^\W_]+")
+
+# 快照中索引各部分的段名
+SNAPSHOT_SECTIONS = ("index.ids", "index.keys", "index.tokens", "index.postings")
+
+# 索引中保存的列表字段（与列表接口返回的格式一致）
+LIST_FIELDS = ("id", "title", "original_title", "year", "rating", "rating_count", "cover", "summary", "genres")
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：NFKC、大小写折叠、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def tokenize(text: str) -> Set[str]:
+    """把文本切分为索引词：中文取相邻两字，单字标题保留单字；其它文字取整词"""
+    text = normalize_text(text)
+    tokens = set()
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.add(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    for word in WORD.findall(CJK_RUN.sub(" ", text)):
+        tokens.add(word)
+    return tokens
+
+
+def match_score(name: str, query: str) -> int:
+    """标题与关键词的匹配程度：完全相同 3，以关键词开头 2，连续包含 1，否则 0"""
+    if name == query:
+        return 3
+    if name.startswith(query):
+        return 2
+    if query in name:
+        return 1
+    return 0
+
+
+class TitleIndex:
+    """电影标题倒排索引
+
+    文档编号从 0 递增，倒排表使用紧凑的整数数组，电影保存在列式目录中；同一部电影重复加入时只在标题变化时重建倒排。
+    从快照恢复后，电影文本、标题和倒排表都在第一次用到时才从映射的文件中读取
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.doc_ids: Dict[str, int] = {}
+        self.movies = MovieCatalog()
+        self.keys: List[str] = []
+        # 内容变化的次数（用于判断是否需要重新写快照）
+        self.updates = 0
+        # 从快照恢复、尚未建立 doc_ids 时为快照中按文档编号排列、换行分隔的电影 ID
+        self._snapshot_ids = None
+
+    def add(self, movie: dict) -> Optional[int]:
+        """加入或更新一部电影，返回文档编号（没有 ID 或标题时不加入，返回 None）"""
+        movie_id = movie.get("id")
+        if not movie_id or not movie.get("title"):
+            return None
+
+        if self._snapshot_ids is not None:
+            self._load_doc_ids()
+
+        record = {field: movie.get(field, "") for field in LIST_FIELDS}
+        # 规范化后的标题和原名，用换行分隔
+        key = f"{normalize_text(record['title'])}\n{normalize_text(record['original_title'] or '')}"
+        doc = self.doc_ids.get(movie_id)
+
+        if doc is None:
+            doc = len(self.movies)
+            self.doc_ids[movie_id] = doc
+            self.movies.append(record)
+            self.keys.append("")
+        else:
+            if self.movies.matches(doc, record):
+                return doc
+            self.movies[doc] = record
+            if self.keys[doc] == key:
+                self.updates += 1
+                return doc
+
+        # 新电影或标题变化：从旧词的倒排表中移除，再加入新词
+        new_tokens = tokenize(key)
+        old_tokens = tokenize(self.keys[doc])
+        for token in old_tokens - new_tokens:
+            self.postings[token].remove(doc)
+        for token in new_tokens - old_tokens:
+            self.postings.setdefault(token, array("l")).append(doc)
+        self.keys[doc] = key
+        self.updates += 1
+        return doc
+
+    def search(self, query: str) -> Tuple[List[dict], int]:
+        """搜索标题，返回 (排序后的结果, 标题中连续包含关键词的结果数)
+
+        所有索引词都命中的电影才会返回；排序依次为：标题或原名完全相同、以关键词开头、连续包含、评价人数
+        """
+        query = normalize_text(query)
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+
+        lists = sorted((self.postings.get(token, ()) for token in tokens), key=len)
+        if not lists[0]:
+            return [], 0
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return [], 0
+
+        scored = []
+        exact = 0
+        for doc in candidates:
+            score = max(match_score(name, query) for name in self.keys[doc].split("\n"))
+            exact += score > 0
+            scored.append((score, self.movies.rating_count(doc), doc))
+
+        scored.sort(reverse=True)
+        return [self.movies[doc] for _, _, doc in scored], exact
+
+    def __len__(self) -> int:
+        return len(self.movies)
+
+    def approx_bytes(self) -> int:
+        """大致占用的内存（字节），从快照恢复后只计算已经读取过的倒排表"""
+        postings = self.postings.loaded if isinstance(self.postings, LazyDict) else self.postings
+        if isinstance(self.keys, LazyList):
+            keys = sampled_size(self.keys.loaded) + sampled_size(self.keys.extra)
+        else:
+            keys = sampled_size(self.keys)
+        return self.movies.approx_bytes() + sampled_size(postings) + keys + sampled_size(self.doc_ids)
+
+    def doc(self, movie_id: str) -> Optional[int]:
+        """电影 ID 对应的文档编号，未收录时返回 None"""
+        if self._snapshot_ids is not None:
+            self._load_doc_ids()
+        return self.doc_ids.get(movie_id)
+
+    def _load_doc_ids(self):
+        """从快照恢复后，第一次加入电影时才建立 电影ID → 文档编号 的映射"""
+        ids = bytes(self._snapshot_ids).decode("utf-8").split("\n") if len(self._snapshot_ids) else []
+        self.doc_ids = dict(zip(ids, range(len(ids))))
+        self._snapshot_ids = None
+
+    def copy(self) -> "TitleIndex":
+        """浅复制（写快照用）：在事件循环中复制，之后可以在其它线程中编码
+
+        倒排表数组与原索引共用，之后新加入的文档编号超出复制时的范围，编码时会被过滤掉
+        """
+        other = TitleIndex()
+        other.movies = self.movies.copy()
+        other.keys = self.keys.copy()
+        other.postings = self.postings.copy()
+        other.doc_ids = self.doc_ids.copy()
+        other.updates = self.updates
+        other._snapshot_ids = self._snapshot_ids
+        return other
+
+    def dump_snapshot(self) -> Dict[str, bytes]:
+        """编码为快照的各段（从快照恢复后未读取过的部分直接复制原始字节）"""
+        count = len(self.movies)
+        if self._snapshot_ids is not None:
+            ids = bytes(self._snapshot_ids)
+        else:
+            ordered = [""] * count
+            for movie_id, doc in self.doc_ids.items():
+                if doc < count:
+                    ordered[doc] = movie_id
+            ids = "\n".join(ordered).encode("utf-8")
+
+        def encode_posting(posting: array) -> bytes:
+            if posting and max(posting) >= count:
+                posting = array("l", (doc for doc in posting if doc < count))
+            return posting.tobytes()
+
+        tokens, postings = encode_sorted_dict(raw_dict(self.postings, encode_posting))
+        return {
+            "index.ids": ids,
+            "index.keys": encode_blobs(raw_list(self.keys, str.encode)),
+            "index.tokens": tokens,
+            "index.postings": postings,
+            **self.movies.dump_snapshot("index.catalog"),
+        }
+
+    def load_snapshot(self, snapshot: Snapshot) -> bool:
+        """以快照内容替换索引，数据按需解码；快照中没有索引时返回 False"""
+        sections = [snapshot.section(name) for name in SNAPSHOT_SECTIONS]
+        movies = MovieCatalog.from_snapshot(snapshot, "index.catalog")
+        if movies is None or any(section is None for section in sections):
+            return False
+
+        ids, keys, tokens, postings = sections
+        keys, tokens, postings = (BlobList(section) for section in (keys, tokens, postings))
+        self._snapshot_ids = ids
+        self.doc_ids = {}
+        self.movies = movies
+        self.keys = LazyList(keys, lambda data: bytes(data).decode("utf-8"), str.encode)
+        self.postings = LazyDict(tokens, postings, decode_postings, array.tobytes)
+        return True
+
+
+def decode_postings(data: memoryview) -> array:
+    posting = array("l")
+    posting.frombytes(data)
+    return posting
+
+
+__all__ = ['TitleIndex', 'tokenize', 'normalize_text']
@@ -0,0 +1,253 @@
+"""
+本地 TMDB 替身服务
+按电影 ID 确定性地生成电影数据（同一个 ID 每次生成的内容相同），用于在没有 API Key 或不想消耗配额时
+测试批量导入、限速、变更订阅等需要真实 HTTP 请求的功能。
+电影被修改后版本号加一，评分、评价人数和简介随之变化，并出现在变更列表（/3/movie/changes）中。
+按 language 参数返回不同语言：中文（zh-*）时 ID 为 4 的倍数的电影没有简介（模拟缺少翻译），其它语言标题为原名、简介为英文。
+
+用法：
+    python tmdb_stub.py serve --port 8900 --movies 100000 --latency 0.02 --rate-limit 50
+    python tmdb_stub.py serve --change-rate 5                 # 每秒随机修改 5 部电影
+    curl -X POST "http://127.0.0.1:8900/__change?ids=1,2,3"   # 修改指定电影
+    python tmdb_stub.py export --count 100000 --output data/movie_ids.json.gz
+
+应用指向替身服务：
+    TMDB_API_BASE=http://127.0.0.1:8900/3 TMDB_API_KEY=stub USE_MOCK_DATA=False python main.py
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse
+
+# 与 main.convert_tmdb_to_douban_format 中的类型映射一致
+GENRES = {
+    28: "动作", 12: "冒险", 16: "动画", 35: "喜剧", 80: "犯罪",
+    99: "纪录", 18: "剧情", 10751: "家庭", 14: "奇幻", 36: "历史",
+    27: "恐怖", 10402: "音乐", 9648: "悬疑", 10749: "爱情", 878: "科幻",
+    10770: "电视电影", 53: "惊悚", 10752: "战争", 37: "西部"
+}
+TITLE_CHARS = "天地人山水风云月星光影夜雨雪花海城梦时间爱恋战争英雄少年传奇秘密归来远方故事"
+PAGE_SIZE = 20
+# 中文数据中没有简介（缺少翻译）的电影：ID 为该数的倍数
+UNTRANSLATED_EVERY = 4
+# 变更列表每页的数量（与 TMDB 一致）
+CHANGES_PAGE_SIZE = 100
+
+
+def fake_movie(movie_id: int, credits: bool = False, version: int = 0, language: str = "zh-CN") -> dict:
+    """生成 TMDB 详情格式的电影（内容只由 ID、版本号和语言决定）"""
+    rng = random.Random(movie_id)
+    genre_ids = rng.sample(sorted(GENRES), rng.randint(1, 3))
+    movie = {
+        "id": movie_id,
+        "title": "".join(rng.choices(TITLE_CHARS, k=rng.randint(2, 6))),
+        "original_title": f"Movie {movie_id}",
+        "release_date": f"{rng.randint(1930, 2026)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "vote_average": round(rng.uniform(1, 10), 1),
+        "vote_count": int(rng.paretovariate(1.2) * 10),
+        "popularity": round(rng.paretovariate(1.5), 3),
+        "poster_path": f"/{rng.getrandbits(64):016x}.jpg",
+        "overview": "".join(rng.choices(TITLE_CHARS, k=rng.randint(30, 120))),
+        "genre_ids": genre_ids,
+        "genres": [{"id": gid, "name": GENRES[gid]} for gid in genre_ids],
+        "runtime": rng.randint(70, 180),
+        "production_countries": [{"name": rng.choice(["美国", "中国", "日本", "法国", "英国"])}],
+        "spoken_languages": [{"english_name": rng.choice(["English", "Mandarin", "Japanese", "French"])}],
+        "adult": False,
+    }
+    if version:
+        # 修改后的电影：评分、评价人数和简介变化，其余字段不变
+        changed = random.Random(f"{movie_id}:{version}")
+        movie["vote_average"] = round(changed.uniform(1, 10), 1)
+        movie["vote_count"] += version * changed.randint(1, 50)
+        movie["overview"] = "".join(changed.choices(TITLE_CHARS, k=changed.randint(30, 120)))
+    if not language.startswith("zh"):
+        movie["title"] = movie["original_title"]
+        movie["overview"] = f"Overview of movie {movie_id} (version {version}, {language})."
+    elif movie_id % UNTRANSLATED_EVERY == 0:
+        movie["overview"] = ""
+    if credits:
+        movie["credits"] = {
+            "cast": [{"name": f"演员{rng.randrange(5000)}"} for _ in range(8)],
+            "crew": [{"name": f"导演{rng.randrange(1000)}", "job": "Director"}],
+        }
+    return movie
+
+
+def list_item(movie_id: int, version: int = 0, language: str = "zh-CN") -> dict:
+    """列表接口中的电影（没有 genres、credits 等详情字段）"""
+    movie = fake_movie(movie_id, version=version, language=language)
+    for key in ("genres", "runtime", "production_countries", "spoken_languages"):
+        del movie[key]
+    return movie
+
+
+def create_app(movies: int, latency: float, rate_limit: int, change_rate: float = 0) -> FastAPI:
+    stats: Counter = Counter()
+    recent: deque = deque()
+    # 电影 ID -> 版本号；电影 ID -> 最近一次修改的时间戳
+    versions: Dict[int, int] = {}
+    changed_at: Dict[int, float] = {}
+
+    def change(ids: List[int]) -> List[int]:
+        now = time.time()
+        ids = [movie_id for movie_id in ids if 1 <= movie_id <= movies]
+        for movie_id in ids:
+            versions[movie_id] = versions.get(movie_id, 0) + 1
+            changed_at[movie_id] = now
+        stats["changed"] += len(ids)
+        return ids
+
+    async def change_randomly():
+        rng = random.Random()
+        while True:
+            await asyncio.sleep(1)
+            count = int(change_rate) + (rng.random() < change_rate % 1)
+            change([rng.randint(1, movies) for _ in range(count)])
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        task = asyncio.create_task(change_randomly()) if change_rate > 0 else None
+        yield
+        if task:
+            task.cancel()
+
+    app = FastAPI(title="TMDB 替身服务", lifespan=lifespan)
+
+    def throttled() -> bool:
+        """超过每秒请求数时返回 True（与 TMDB 一样返回 429）"""
+        if rate_limit <= 0:
+            return False
+        now = time.monotonic()
+        while recent and recent[0] <= now - 1:
+            recent.popleft()
+        if len(recent) >= rate_limit:
+            return True
+        recent.append(now)
+        return False
+
+    async def respond(kind: str, body) -> JSONResponse:
+        if throttled():
+            stats["throttled"] += 1
+            return JSONResponse(
+                {"status_code": 25, "status_message": "请求过于频繁"}, status_code=429, headers={"Retry-After": "1"}
+            )
+        stats[kind] += 1
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if body is None:
+            return JSONResponse({"status_code": 34, "status_message": "资源不存在"}, status_code=404)
+        return JSONResponse(body)
+
+    def page_of(page: int, language: str) -> dict:
+        start = (page - 1) * PAGE_SIZE
+        ids = range(start + 1, min(start + PAGE_SIZE, movies) + 1)
+        return {
+            "page": page,
+            "results": [list_item(movie_id, versions.get(movie_id, 0), language) for movie_id in ids],
+            "total_results": movies,
+            "total_pages": (movies + PAGE_SIZE - 1) // PAGE_SIZE,
+        }
+
+    def changes_of(start_date: Optional[str], end_date: Optional[str], page: int) -> dict:
+        """按天筛选（UTC，首尾两天都包含）被修改过的电影，与 TMDB 一样不提供具体修改时间"""
+        start = date.fromisoformat(start_date) if start_date else date.min
+        end = date.fromisoformat(end_date) if end_date else date.max
+        ids = sorted(
+            movie_id for movie_id, ts in changed_at.items()
+            if start <= datetime.fromtimestamp(ts, timezone.utc).date() <= end
+        )
+        offset = (page - 1) * CHANGES_PAGE_SIZE
+        return {
+            "results": [{"id": movie_id, "adult": False} for movie_id in ids[offset:offset + CHANGES_PAGE_SIZE]],
+            "page": page,
+            "total_pages": (len(ids) + CHANGES_PAGE_SIZE - 1) // CHANGES_PAGE_SIZE,
+            "total_results": len(ids),
+        }
+
+    @app.get("/3/movie/changes")
+    async def movie_changes(start_date: Optional[str] = None, end_date: Optional[str] = None, page: int = Query(1, ge=1)):
+        return await respond("changes", changes_of(start_date, end_date, page))
+
+    @app.get("/3/movie/{category}")
+    async def movie(category: str, page: int = Query(1, ge=1), append_to_response: str = "", language: str = "en-US"):
+        stats[f"language:{language}"] += 1
+        if category.isdigit():
+            movie_id = int(category)
+            body = (
+                fake_movie(movie_id, "credits" in append_to_response, versions.get(movie_id, 0), language)
+                if 1 <= movie_id <= movies else None
+            )
+            return await respond("detail", body)
+        return await respond("list", page_of(page, language))
+
+    @app.get("/3/search/movie")
+    async def search(query: str = "", page: int = Query(1, ge=1)):
+        return await respond("search", {"page": page, "results": [], "total_results": 0, "total_pages": 0})
+
+    @app.post("/__change")
+    async def post_change(ids: str = Query(..., description="逗号分隔的电影 ID")):
+        """修改指定电影（测试用）"""
+        return {"changed": change([int(x) for x in ids.split(",") if x.strip().isdigit()])}
+
+    @app.get("/__stats")
+    async def get_stats():
+        return dict(stats)
+
+    return app
+
+
+def write_export(count: int, output: str):
+    """生成与 TMDB 每日导出文件格式相同的 gzip 文件（每行一个 JSON）"""
+    path = Path(output)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for movie_id in range(1, count + 1):
+            movie = fake_movie(movie_id)
+            f.write(json.dumps({
+                "adult": movie_id % 50 == 0,
+                "id": movie_id,
+                "original_title": movie["original_title"],
+                "popularity": movie["popularity"],
+                "video": False,
+            }) + "\n")
+    print(f"✅ 已生成 {count} 行: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 TMDB 替身服务")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="启动服务")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8900)
+    serve_parser.add_argument("--movies", type=int, default=100_000, help="电影 ID 范围 1..movies")
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    serve_parser.add_argument("--rate-limit", type=int, default=0, help="每秒最多请求数，超出返回 429（0 表示不限）")
+    serve_parser.add_argument("--change-rate", type=float, default=0, help="每秒随机修改的电影数量")
+
+    export_parser = subparsers.add_parser("export", help="生成电影 ID 导出文件")
+    export_parser.add_argument("--count", type=int, default=100_000)
+    export_parser.add_argument("--output", default="data/movie_ids.json.gz")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        app = create_app(args.movies, args.latency, args.rate_limit, args.change_rate)
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    elif args.command == "export":
+        write_export(args.count, args.output)
+
+
+if __name__ == "__main__":
+    main()
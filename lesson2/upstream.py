@@ -0,0 +1,99 @@
+"""
+上游连接池模块
+所有 TMDB 请求共用一个 HTTP 连接池（长连接复用，限制连接数），并由令牌桶限制每秒请求数，
+避免批量任务或突发流量超出 TMDB 的请求配额
+"""
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多连续放行 burst 个；rate 为 0 时不限速
+
+    按请求到达的顺序预约时间（GCRA 算法），不需要锁，也不依赖某个事件循环
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        # 下一个请求理论上的放行时间
+        self._next = 0.0
+
+    def reserve(self) -> float:
+        """预约一个令牌，返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        interval = 1 / self.rate
+        now = time.monotonic()
+        start = max(self._next, now)
+        self._next = start + interval
+        return max(start - now - (self.burst - 1) * interval, 0.0)
+
+    def available(self) -> float:
+        """当前无需等待即可发出的请求数（不小于 1 时下一个请求不用等待）"""
+        if self.rate <= 0:
+            return float("inf")
+        return self.burst - max(self._next - time.monotonic(), 0.0) * self.rate
+
+    async def acquire(self) -> float:
+        """等待直到可以发出请求，返回等待的秒数"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class UpstreamPool:
+    """限速的上游连接池
+
+    httpx 的连接池绑定创建它的事件循环：预热（主进程中的 asyncio.run）和 worker 使用不同的事件循环，
+    因此每个事件循环各自创建连接池
+    """
+
+    def __init__(self, rate: float, burst: int, max_connections: int, timeout: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 被限速的请求数和累计等待时间（秒）
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._loop = loop
+        return self._client
+
+    def after_fork(self):
+        """fork 出的子进程中调用：不复用父进程的连接"""
+        self._client = None
+        self._loop = None
+
+    async def get(self, url: str, params: dict) -> httpx.Response:
+        delay = await self.bucket.acquire()
+        if delay > 0:
+            self.throttled += 1
+            self.throttled_seconds += delay
+        return await self.client().get(url, params=params)
+
+    async def close(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+
+__all__ = ['TokenBucket', 'UpstreamPool']